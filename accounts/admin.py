@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.html import format_html
-from .models import User, UserProfile, AuditLog
+from .backends import forget_users
+from .models import User, UserProfile, AuditLog, Sequence
+from .search import reindex_users
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
@@ -41,23 +43,37 @@ class UserAdmin(BaseUserAdmin):
     
     actions = ['activate_membership', 'deactivate_membership', 'make_librarian', 'make_member']
     
+    # update() skips post_save, which keeps cached users and the member search
+    # index current; ids are taken first as a filtered changelist may no
+    # longer match the users afterwards
+
     def activate_membership(self, request, queryset):
+        user_ids = list(queryset.values_list('pk', flat=True))
         queryset.update(is_active_member=True)
+        forget_users(user_ids)
         self.message_user(request, f'{queryset.count()} users activated successfully.')
     activate_membership.short_description = 'Activate selected users'
     
     def deactivate_membership(self, request, queryset):
+        user_ids = list(queryset.values_list('pk', flat=True))
         queryset.update(is_active_member=False)
+        forget_users(user_ids)
         self.message_user(request, f'{queryset.count()} users deactivated successfully.')
     deactivate_membership.short_description = 'Deactivate selected users'
     
     def make_librarian(self, request, queryset):
+        user_ids = list(queryset.values_list('pk', flat=True))
         queryset.update(user_type='librarian')
+        reindex_users(user_ids)
+        forget_users(user_ids)
         self.message_user(request, f'{queryset.count()} users promoted to librarian.')
     make_librarian.short_description = 'Promote to librarian'
     
     def make_member(self, request, queryset):
+        user_ids = list(queryset.values_list('pk', flat=True))
         queryset.update(user_type='member')
+        reindex_users(user_ids)
+        forget_users(user_ids)
         self.message_user(request, f'{queryset.count()} users set as members.')
     make_member.short_description = 'Set as member'
 
@@ -73,13 +89,26 @@ class UserProfileAdmin(admin.ModelAdmin):
 class AuditLogAdmin(admin.ModelAdmin):
     list_display = ('user', 'action', 'timestamp', 'ip_address')
     list_filter = ('action', 'timestamp')
-    search_fields = ('user__username', 'description')
+    list_select_related = ('user',)
+    search_fields = ('user__username', 'description__value')
     readonly_fields = ('user', 'action', 'description', 'ip_address', 'user_agent', 
                       'timestamp', 'additional_data')
-    date_hierarchy = 'timestamp'
+    exclude = ('ip',)
+    # date_hierarchy would scan the whole table for its year and month links,
+    # and the full count is another scan; the timestamp filter needs neither
+    show_full_result_count = False
     
     def has_add_permission(self, request):
         return False
     
     def has_change_permission(self, request, obj=None):
         return False
+
+
+@admin.register(Sequence)
+class SequenceAdmin(admin.ModelAdmin):
+    list_display = ('name', 'next_value', 'updated_at')
+    readonly_fields = ('name', 'next_value', 'updated_at')
+    
+    def has_add_permission(self, request):
+        return False
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        # Audit log hooks, the flusher's shutdown handler, search indexing,
+        # cached user invalidation and its cache check
+        from . import audit, backends, checks, search  # noqa: F401
@@ -0,0 +1,209 @@
+"""
+Retention for AuditLog.
+
+Rows older than AUDIT_RETENTION_DAYS are written a calendar month at a time
+to gzip JSON-lines files under AUDIT_ARCHIVE_DIR and then deleted in small
+chunks. Each file is a series of gzip members, one per member account, and
+a sidecar index records where each account's block starts and which
+actions it holds, so a search reads only the blocks it needs. The whole
+file still reads with ``zcat``.
+"""
+import gzip
+import json
+import os
+import tempfile
+from datetime import datetime, time, timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import AuditLog, unpack_ip
+
+ROW_FIELDS = ['id', 'user_id', 'action', 'description__value', 'ip', 'user_agent__value', 'timestamp', 'additional_data']
+
+
+def get_retention_cutoff(now=None):
+    """Audit entries before this moment belong in the archive."""
+    days = getattr(settings, 'LIBRARY_SETTINGS', {}).get('AUDIT_RETENTION_DAYS', 365)
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def get_archive_dir():
+    return str(getattr(settings, 'AUDIT_ARCHIVE_DIR', settings.BASE_DIR / 'var' / 'audit'))
+
+
+def _month_start(value):
+    return timezone.make_aware(
+        datetime.combine(value.replace(day=1), time.min), timezone.get_current_timezone()
+    )
+
+
+def _next_month(start):
+    return _month_start((start.date().replace(day=1) + timedelta(days=32)))
+
+
+def month_dir(month):
+    return os.path.join(get_archive_dir(), f'{month:%Y-%m}')
+
+
+def month_parts(month):
+    """Sidecar indexes of the archive parts written for ``month``, oldest first."""
+    directory = month_dir(month)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.index.json')
+    )
+
+
+def _load_index(path):
+    with open(path) as index_file:
+        return json.load(index_file)
+
+
+def _write_atomic(path, write):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp:
+        write(tmp)
+    os.replace(tmp_path, path)
+
+
+def _serialize(row):
+    entry = dict(zip(ROW_FIELDS, row))
+    return {
+        'id': entry['id'],
+        'user_id': entry['user_id'],
+        'action': entry['action'],
+        'description': entry['description__value'] or '',
+        'ip_address': unpack_ip(entry['ip']),
+        'user_agent': entry['user_agent__value'] or '',
+        'timestamp': entry['timestamp'].isoformat(),
+        'additional_data': entry['additional_data'],
+    }
+
+
+def write_part(month, queryset):
+    """
+    Writes the rows of ``queryset`` as the next archive part of ``month``.
+    The data file is complete before its index appears, so a part with an
+    index is always whole. Returns the part's index, or None when there
+    was nothing to write.
+    """
+    rows = queryset.order_by('user_id', 'id').values_list(*ROW_FIELDS).iterator(chunk_size=5000)
+    directory = month_dir(month)
+    os.makedirs(directory, exist_ok=True)
+    name = f'part-{len(month_parts(month)) + 1:03d}'
+    index = {'month': f'{month:%Y-%m}', 'rows': 0, 'min_id': None, 'max_id': None, 'actions': {}, 'users': {}}
+
+    def write(data_file):
+        for user_id, user_rows in groupby(rows, key=lambda row: row[1]):
+            entries = [_serialize(row) for row in user_rows]
+            block = gzip.compress(''.join(json.dumps(entry) + '\n' for entry in entries).encode())
+            actions = sorted({entry['action'] for entry in entries})
+            index['users'][str(user_id)] = [data_file.tell(), len(block), len(entries), actions]
+            data_file.write(block)
+            for entry in entries:
+                index['actions'][entry['action']] = index['actions'].get(entry['action'], 0) + 1
+            # Blocks are ordered by user, so ids are not ascending across them
+            low, high = min(entry['id'] for entry in entries), max(entry['id'] for entry in entries)
+            index['rows'] += len(entries)
+            index['min_id'] = low if index['min_id'] is None else min(index['min_id'], low)
+            index['max_id'] = high if index['max_id'] is None else max(index['max_id'], high)
+
+    data_path = os.path.join(directory, f'{name}.jsonl.gz')
+    _write_atomic(data_path, write)
+    if not index['rows']:
+        os.remove(data_path)
+        return None
+    index['file'] = os.path.basename(data_path)
+    _write_atomic(
+        os.path.join(directory, f'{name}.index.json'),
+        lambda index_file: index_file.write(json.dumps(index).encode()),
+    )
+    return index
+
+
+def purge(queryset, chunk_size=1000):
+    """
+    Deletes the rows of ``queryset`` ``chunk_size`` at a time, each chunk in
+    its own short transaction, so writers are never blocked for long.
+    Returns the number of rows deleted.
+    """
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        deleted += AuditLog.objects.filter(id__in=ids).delete()[0]
+
+
+def archive_month(month, chunk_size=1000):
+    """
+    Archives and purges the audit entries of the month starting at
+    ``month``. Rows already covered by an earlier part (left behind by an
+    interrupted purge) are only deleted. Returns ``(archived, purged)``.
+    """
+    in_month = AuditLog.objects.filter(timestamp__gte=month, timestamp__lt=_next_month(month))
+    archived_up_to = max((_load_index(path)['max_id'] for path in month_parts(month)), default=0)
+
+    index = write_part(month, in_month.filter(id__gt=archived_up_to))
+    if index is not None:
+        archived_up_to = index['max_id']
+    purged = purge(in_month.filter(id__lte=archived_up_to), chunk_size) if archived_up_to else 0
+    return (index['rows'] if index else 0), purged
+
+
+def archive_audit_log(cutoff=None, chunk_size=1000):
+    """
+    Archives every whole calendar month of audit entries before ``cutoff``
+    and purges them from the table. Safe to rerun and to resume after an
+    interruption. Returns ``(archived, purged)``.
+    """
+    cutoff = cutoff or get_retention_cutoff()
+    oldest = AuditLog.objects.aggregate(oldest=Min('timestamp'))['oldest']
+    archived = purged = 0
+    if oldest is None:
+        return archived, purged
+
+    month = _month_start(timezone.localtime(oldest).date())
+    while _next_month(month) <= cutoff:
+        month_archived, month_purged = archive_month(month, chunk_size)
+        archived += month_archived
+        purged += month_purged
+        month = _next_month(month)
+    return archived, purged
+
+
+def search_archive(start, end, user_id=None, action=None):
+    """
+    Archived audit entries (as dicts) from the months overlapping
+    [start, end), optionally for one user and one action. Only the gzip
+    blocks the sidecar indexes point at are read and decompressed.
+    """
+    month = _month_start(timezone.localtime(start).date())
+    while month < end:
+        for index_path in month_parts(month):
+            index = _load_index(index_path)
+            if action and action not in index['actions']:
+                continue
+            if user_id is not None:
+                block = index['users'].get(str(user_id))
+                blocks = [block] if block else []
+            else:
+                blocks = list(index['users'].values())
+
+            with open(os.path.join(os.path.dirname(index_path), index['file']), 'rb') as data_file:
+                for offset, length, _, actions in blocks:
+                    if action and action not in actions:
+                        continue
+                    data_file.seek(offset)
+                    for line in gzip.decompress(data_file.read(length)).splitlines():
+                        entry = json.loads(line)
+                        if action and entry['action'] != action:
+                            continue
+                        if not start <= datetime.fromisoformat(entry['timestamp']) < end:
+                            continue
+                        yield entry
+        month = _next_month(month)
@@ -0,0 +1,246 @@
+"""
+Buffered AuditLog writer.
+
+``record`` only appends a tuple to an in-process queue; a background thread
+parses the request details and writes the queue out with ``bulk_create``
+when a batch fills up or every few seconds, and whatever is left is written
+when the process exits. User agents and descriptions are interned into
+dimension tables, so keep descriptions generic and put specifics in ``data``.
+"""
+import atexit
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from books.models import BookReservation
+from borrowing.models import CirculationEvent
+from .models import AuditDescription, AuditLog, AuditUserAgent, User, UserProfile, pack_ip
+
+logger = logging.getLogger(__name__)
+
+_library_settings = getattr(settings, 'LIBRARY_SETTINGS', {})
+BATCH_SIZE = _library_settings.get('AUDIT_BATCH_SIZE', 200)
+FLUSH_SECONDS = _library_settings.get('AUDIT_FLUSH_SECONDS', 2.0)
+
+# Request being served on this thread, set by AuditContextMiddleware so
+# model signal hooks can record where an action came from
+current_request = ContextVar('audit_request', default=None)
+
+# deque appends and pops are atomic, so requests never wait on a lock. If the
+# database falls behind this far the oldest entries are dropped.
+_pending = deque(maxlen=_library_settings.get('AUDIT_MAX_PENDING', 10000))
+_wake = threading.Event()
+_stopping = threading.Event()
+_lock = threading.Lock()
+_flusher = None
+
+
+def record(action, user, description='', request=None, **data):
+    """
+    Queues an AuditLog entry for ``user`` (a user or user id); it is written
+    by the flusher thread.
+    """
+    user_id = getattr(user, 'pk', user)
+    if user_id is None:
+        return
+    request = request or current_request.get()
+    meta = request.META if request is not None else {}
+    _pending.append((
+        user_id, action, description, meta.get('REMOTE_ADDR'), meta.get('HTTP_X_FORWARDED_FOR'),
+        meta.get('HTTP_USER_AGENT', ''), timezone.now(), data,
+    ))
+    if len(_pending) >= BATCH_SIZE:
+        _wake.set()
+    if _flusher is None or not _flusher.is_alive():
+        _start()
+
+
+def record_on_commit(action, user, description='', **data):
+    """``record`` once the current transaction commits, so rolled back actions leave no entry."""
+    transaction.on_commit(partial(record, action, user, description, current_request.get(), **data))
+
+
+def client_ip(remote_addr, forwarded_for=None):
+    """First address in X-Forwarded-For, else REMOTE_ADDR, packed; None if neither is a valid address."""
+    return pack_ip(forwarded_for.split(',')[0].strip() if forwarded_for else remote_addr)
+
+
+class Interner:
+    """
+    Ids of the rows of an InternedString ``model`` holding given strings,
+    creating the missing ones. Recently used ids are kept in an LRU, so a
+    batch of entries usually needs no queries at all.
+    """
+    
+    def __init__(self, model, size=1024):
+        self.model = model
+        self.size = size
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def ids(self, values):
+        """``{value: id}`` for the non-empty strings in ``values``."""
+        found, missing = {}, set()
+        with self._lock:
+            for value in values:
+                if not value or value in found:
+                    continue
+                pk = self._ids.get(value)
+                if pk is None:
+                    missing.add(value)
+                else:
+                    self._ids.move_to_end(value)
+                    found[value] = pk
+        if not missing:
+            return found
+        
+        by_digest = {self.model.digest_of(value): value for value in missing}
+        ids = dict(self.model.objects.filter(digest__in=by_digest).values_list('digest', 'id'))
+        new = [self.model(digest=digest, value=value) for digest, value in by_digest.items() if digest not in ids]
+        if new:
+            # Another process may insert the same strings concurrently
+            self.model.objects.bulk_create(new, ignore_conflicts=True)
+            ids.update(self.model.objects.filter(digest__in=[row.digest for row in new]).values_list('digest', 'id'))
+        with self._lock:
+            for digest, value in by_digest.items():
+                found[value] = self._ids[value] = ids[digest]
+            while len(self._ids) > self.size:
+                self._ids.popitem(last=False)
+        return found
+
+
+user_agents = Interner(AuditUserAgent)
+descriptions = Interner(AuditDescription)
+
+
+def _entries(batch):
+    agent_ids = user_agents.ids(item[5] for item in batch)
+    description_ids = descriptions.ids(item[2] for item in batch)
+    return [
+        AuditLog(
+            user_id=user_id,
+            action=action,
+            description_id=description_ids.get(description),
+            ip=client_ip(remote_addr, forwarded_for),
+            user_agent_id=agent_ids.get(user_agent),
+            timestamp=timestamp,
+            additional_data=data,
+        )
+        for user_id, action, description, remote_addr, forwarded_for, user_agent, timestamp, data in batch
+    ]
+
+
+def flush():
+    """Writes every queued entry now, in batches. Returns the number written."""
+    written = 0
+    while True:
+        batch = []
+        try:
+            while len(batch) < BATCH_SIZE:
+                batch.append(_pending.popleft())
+        except IndexError:
+            pass
+        if not batch:
+            return written
+        try:
+            AuditLog.objects.bulk_create(_entries(batch))
+            written += len(batch)
+        except Exception:
+            logger.exception('Dropped %d audit log entries', len(batch))
+
+
+def _run():
+    while not _stopping.is_set():
+        _wake.wait(FLUSH_SECONDS)
+        _wake.clear()
+        if _pending:
+            close_old_connections()
+            flush()
+
+
+def _start():
+    global _flusher
+    with _lock:
+        # Also restarts the thread in a process forked after it was started
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_run, name='audit-log-flusher', daemon=True)
+            _flusher.start()
+
+
+@atexit.register
+def shutdown(timeout=5):
+    """Stops the flusher thread and writes out whatever is still queued."""
+    _stopping.set()
+    _wake.set()
+    if _flusher is not None and _flusher.is_alive():
+        _flusher.join(timeout)
+    flush()
+
+
+# Hooks
+
+@receiver(user_logged_in)
+def _logged_in(sender, request, user, **kwargs):
+    record('login', user, 'Logged in', request)
+
+
+@receiver(user_logged_out)
+def _logged_out(sender, request, user, **kwargs):
+    if user is not None:
+        record('logout', user, 'Logged out', request)
+
+
+@receiver(post_init, sender=User)
+def _remember_active(sender, instance, **kwargs):
+    # Read from __dict__ so deferred fields are not loaded
+    instance._audit_was_active = instance.__dict__.get('is_active', True) and instance.__dict__.get('is_active_member', True)
+
+
+@receiver(post_save, sender=User)
+def _user_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        record_on_commit('account_created', instance, 'Account created')
+        return
+    # Set by set_password() until the save completes
+    if getattr(instance, '_password', None) is not None:
+        record_on_commit('password_changed', instance, 'Password changed')
+    if instance._audit_was_active and not (instance.is_active and instance.is_active_member):
+        record_on_commit('account_deactivated', instance, 'Account deactivated')
+    instance._audit_was_active = instance.is_active and instance.is_active_member
+
+
+@receiver(post_save, sender=UserProfile)
+def _profile_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        record_on_commit('profile_updated', instance.user_id, 'Profile updated')
+
+
+ACTION_FOR_EVENT = {'checkout': 'book_borrowed', 'return': 'book_returned', 'payment': 'fine_paid'}
+
+
+@receiver(post_save, sender=CirculationEvent)
+def _circulation_event_saved(sender, instance, created, raw=False, **kwargs):
+    action = ACTION_FOR_EVENT.get(instance.event_type)
+    if created and not raw and action:
+        data = {'circulation_event_id': instance.pk}
+        if instance.amount is not None:
+            data['amount'] = str(instance.amount)
+        record_on_commit(action, instance.user_id, instance.get_event_type_display(), **data)
+
+
+@receiver(post_save, sender=BookReservation)
+def _reservation_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        record_on_commit('book_reserved', instance.user_id, 'Book reserved',
+                         reservation_id=instance.pk, book_id=instance.book_id)
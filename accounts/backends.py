@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import User
+
+# Columns the cached user leaves out; a page that needs one loads it on access
+DEFERRED_FIELDS = ['address', 'emergency_contact_name', 'emergency_contact_phone', 'date_of_birth']
+
+
+def user_cache_key(user_id):
+    return f'accounts:user:{user_id}'
+
+
+def get_user_cache_seconds():
+    return getattr(settings, 'LIBRARY_SETTINGS', {}).get('USER_CACHE_SECONDS', 300)
+
+
+def forget_users(user_ids):
+    """
+    Drops cached users once the current transaction commits. ``post_save``
+    does this for single saves; call it after queryset updates of users.
+    """
+    keys = [user_cache_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class CachedUserBackend(ModelBackend):
+    """
+    ModelBackend that serves the user behind a session from the cache, so
+    authenticated requests skip the user query. The cached copy omits
+    DEFERRED_FIELDS and is dropped whenever the user is saved; use a cache
+    shared by all web processes so they see the invalidation too.
+    """
+
+    def get_user(self, user_id):
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = User._default_manager.defer(*DEFERRED_FIELDS).filter(pk=user_id).first()
+            if user is None:
+                return None
+            cache.set(key, user, get_user_cache_seconds())
+        return user if self.user_can_authenticate(user) else None
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _user_changed(sender, instance, **kwargs):
+    forget_users([instance.pk])
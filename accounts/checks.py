@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+LOCAL_CACHES = {'django.core.cache.backends.locmem.LocMemCache'}
+
+
+@register(Tags.caches)
+def check_user_cache(app_configs, **kwargs):
+    """
+    CachedUserBackend drops a user from the cache when they change; with a
+    per-process cache the other processes keep serving the stale copy.
+    """
+    if 'accounts.backends.CachedUserBackend' not in settings.AUTHENTICATION_BACKENDS:
+        return []
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in LOCAL_CACHES:
+        return []
+    return [Error(
+        f'The "{settings.SESSION_PROFILE}" session profile caches users, but the default cache is {backend}, '
+        'which each process keeps to itself.',
+        hint='Point CACHES["default"] at a shared cache such as Redis or Memcached, '
+             'or use SESSION_PROFILE = "database".',
+        id='accounts.E001',
+    )]
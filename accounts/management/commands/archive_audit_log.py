@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from accounts.archive import archive_audit_log, get_archive_dir, get_retention_cutoff
+from accounts.models import AuditLog
+
+
+class Command(BaseCommand):
+    help = 'Move audit log entries past the retention period into monthly archive files'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            help='Keep this many days in the table (default: LIBRARY_SETTINGS["AUDIT_RETENTION_DAYS"])'
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows deleted per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many entries are past retention')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+        else:
+            cutoff = get_retention_cutoff()
+
+        if options['dry_run']:
+            pending = AuditLog.objects.filter(timestamp__lt=cutoff).count()
+            self.stdout.write(f'{pending} audit entr(ies) from before {cutoff:%Y-%m-%d}; whole months are archived')
+            return
+
+        archived, purged = archive_audit_log(cutoff=cutoff, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {archived} and purged {purged} audit entr(ies) before {cutoff:%Y-%m} to {get_archive_dir()}'
+        ))
@@ -0,0 +1,94 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+
+from accounts.models import User
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Compare per-request latency and query counts of the session profiles for a logged-in user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--username', required=True, help='Existing user the requests are made as')
+        parser.add_argument('--url', default='/', help='Page to request (default: /)')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per profile (default: 200)')
+        parser.add_argument('--concurrency', type=int, default=4, help='Simultaneous clients (default: 4)')
+        parser.add_argument(
+            '--profiles', nargs='+', choices=sorted(settings.SESSION_PROFILES),
+            default=list(settings.SESSION_PROFILES), help='Profiles to compare (default: all)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'No user named "{options["username"]}"')
+        concurrency = max(options['concurrency'], 1)
+        per_client = max(options['requests'] // concurrency, 1)
+
+        self.stdout.write(
+            f'{per_client * concurrency} requests per profile to {options["url"]} '
+            f'as {user.username}, {concurrency} at a time'
+        )
+        self.stdout.write(f'{"profile":<10} {"p50 ms":>8} {"p95 ms":>8} {"req/s":>8} {"queries":>8} {"failed":>7}')
+        for name in options['profiles']:
+            engine, backend = settings.SESSION_PROFILES[name]
+            with override_settings(SESSION_ENGINE=engine, AUTHENTICATION_BACKENDS=[backend]):
+                latencies, queries, failed, elapsed = self.run_profile(user, options['url'], per_client, concurrency)
+            p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+            self.stdout.write(
+                f'{name:<10} {statistics.median(latencies):>8.2f} {p95:>8.2f} '
+                f'{len(latencies) / elapsed:>8.1f} {statistics.mean(queries):>8.2f} {failed:>7}'
+            )
+
+    def run_profile(self, user, url, per_client, concurrency):
+        """Returns ``(latencies in ms, queries per request, failed requests, wall seconds)``."""
+        clients = []
+        for _ in range(concurrency):
+            client = Client()
+            client.force_login(user)
+            # Warm the session, the cached user and template caches
+            client.get(url)
+            clients.append(client)
+
+        def run(client):
+            latencies, queries, failed = [], [], 0
+            counter = _QueryCounter()
+            with connection.execute_wrapper(counter):
+                for _ in range(per_client):
+                    counter.count = 0
+                    start = time.perf_counter()
+                    response = client.get(url)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    queries.append(counter.count)
+                    failed += response.status_code != 200
+            connection.close()
+            return latencies, queries, failed
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(run, clients))
+        elapsed = time.perf_counter() - start
+
+        for client in clients:
+            client.logout()
+        return (
+            [ms for latencies, _, _ in results for ms in latencies],
+            [n for _, queries, _ in results for n in queries],
+            sum(failed for _, _, failed in results),
+            elapsed,
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from accounts.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Recompute the member search index from the user table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Users reindexed per transaction')
+
+    def handle(self, *args, **options):
+        written = rebuild_index(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} member search term(s)'))
@@ -0,0 +1,42 @@
+import json
+from datetime import date, datetime, time, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from accounts.archive import search_archive
+from accounts.models import AuditLog, User
+
+
+class Command(BaseCommand):
+    help = 'Search archived audit log entries by member, action and date range'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', required=True, help='First day to search (YYYY-MM-DD)')
+        parser.add_argument('--until', help='Last day to search (YYYY-MM-DD, default: today)')
+        parser.add_argument('--user', help='Username or library card number')
+        parser.add_argument('--action', choices=[key for key, _ in AuditLog.ACTION_CHOICES])
+
+    def handle(self, *args, **options):
+        try:
+            since = date.fromisoformat(options['since'])
+            until = date.fromisoformat(options['until']) if options['until'] else timezone.localdate()
+        except ValueError:
+            raise CommandError('--since and --until must be dates in YYYY-MM-DD format')
+
+        user_id = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first() or \
+                User.objects.filter(library_card_number=options['user']).first()
+            if user is None:
+                raise CommandError(f"No user {options['user']!r}")
+            user_id = user.pk
+
+        tz = timezone.get_current_timezone()
+        start = timezone.make_aware(datetime.combine(since, time.min), tz)
+        end = timezone.make_aware(datetime.combine(until + timedelta(days=1), time.min), tz)
+        found = 0
+        for entry in search_archive(start, end, user_id=user_id, action=options['action']):
+            self.stdout.write(json.dumps(entry))
+            found += 1
+        self.stderr.write(f'{found} archived entr(ies) found')
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_sequence'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['membership_expiry'], name='user_membership_expiry_idx'),
+        ),
+    ]
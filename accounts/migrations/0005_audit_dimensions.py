@@ -0,0 +1,126 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:10
+
+import hashlib
+from ipaddress import ip_address
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+
+CHUNK_SIZE = 2000
+
+
+def _digest(value):
+    return hashlib.blake2b(value.encode(), digest_size=16).hexdigest()
+
+
+def _pack_ip(address):
+    try:
+        return ip_address(address).packed if address else None
+    except ValueError:
+        return None
+
+
+def _intern(model, values):
+    """``{value: id}`` for ``values``, creating the rows that are missing."""
+    by_digest = {_digest(value): value for value in values if value}
+    existing = dict(model.objects.filter(digest__in=by_digest).values_list('digest', 'id'))
+    model.objects.bulk_create(
+        [model(digest=digest, value=value) for digest, value in by_digest.items() if digest not in existing],
+        ignore_conflicts=True,
+    )
+    ids = dict(model.objects.filter(digest__in=by_digest).values_list('digest', 'id'))
+    return {value: ids[digest] for digest, value in by_digest.items()}
+
+
+def compact_audit_rows(apps, schema_editor):
+    # One transaction per chunk so the table is never locked for the whole rewrite
+    AuditLog = apps.get_model('accounts', 'AuditLog')
+    AuditUserAgent = apps.get_model('accounts', 'AuditUserAgent')
+    AuditDescription = apps.get_model('accounts', 'AuditDescription')
+
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                AuditLog.objects.filter(id__gt=last_id).order_by('id')
+                .only('id', 'description', 'ip_address', 'user_agent')[:CHUNK_SIZE]
+            )
+            if not rows:
+                return
+            user_agents = _intern(AuditUserAgent, {row.user_agent for row in rows})
+            descriptions = _intern(AuditDescription, {row.description for row in rows})
+            for row in rows:
+                row.user_agent_ref_id = user_agents.get(row.user_agent)
+                row.description_ref_id = descriptions.get(row.description)
+                row.ip_packed = _pack_ip(row.ip_address)
+            AuditLog.objects.bulk_update(rows, ['user_agent_ref', 'description_ref', 'ip_packed'])
+            last_id = rows[-1].id
+
+
+def expand_audit_rows(apps, schema_editor):
+    AuditLog = apps.get_model('accounts', 'AuditLog')
+
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                AuditLog.objects.filter(id__gt=last_id).order_by('id')
+                .select_related('user_agent_ref', 'description_ref')[:CHUNK_SIZE]
+            )
+            if not rows:
+                return
+            for row in rows:
+                row.user_agent = row.user_agent_ref.value if row.user_agent_ref else ''
+                row.description = row.description_ref.value if row.description_ref else ''
+                row.ip_address = str(ip_address(bytes(row.ip_packed))) if row.ip_packed else None
+            AuditLog.objects.bulk_update(rows, ['user_agent', 'description', 'ip_address'])
+            last_id = rows[-1].id
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0004_user_membership_expiry_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditDescription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=32, unique=True)),
+                ('value', models.TextField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='AuditUserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=32, unique=True)),
+                ('value', models.TextField()),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddField(
+            model_name='auditlog',
+            name='description_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='accounts.auditdescription'),
+        ),
+        migrations.AddField(
+            model_name='auditlog',
+            name='ip_packed',
+            field=models.BinaryField(blank=True, help_text='Packed IPv4 or IPv6 address', max_length=16, null=True),
+        ),
+        migrations.AddField(
+            model_name='auditlog',
+            name='user_agent_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='accounts.audituseragent'),
+        ),
+        migrations.RunPython(compact_audit_rows, expand_audit_rows),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_audit_dimensions'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='auditlog',
+            name='description',
+        ),
+        migrations.RemoveField(
+            model_name='auditlog',
+            name='ip_address',
+        ),
+        migrations.RemoveField(
+            model_name='auditlog',
+            name='user_agent',
+        ),
+        migrations.RenameField(
+            model_name='auditlog',
+            old_name='description_ref',
+            new_name='description',
+        ),
+        migrations.RenameField(
+            model_name='auditlog',
+            old_name='ip_packed',
+            new_name='ip',
+        ),
+        migrations.RenameField(
+            model_name='auditlog',
+            old_name='user_agent_ref',
+            new_name='user_agent',
+        ),
+    ]
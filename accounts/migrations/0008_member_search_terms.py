@@ -0,0 +1,63 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:14
+
+import re
+import unicodedata
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def _tokens(value):
+    text = unicodedata.normalize('NFKD', value or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return [token[:100] for token in re.findall(r'[a-z0-9]+', text)]
+
+
+def index_members(apps, schema_editor):
+    # Same terms as accounts.search.member_terms at the time of writing
+    User = apps.get_model('accounts', 'User')
+    MemberSearchTerm = apps.get_model('accounts', 'MemberSearchTerm')
+
+    rows = []
+    for user in User.objects.filter(user_type='member').iterator(chunk_size=1000):
+        terms = {('name', token) for value in (user.username, user.first_name, user.last_name) for token in _tokens(value)}
+        if user.email:
+            email = user.email.strip().lower()[:100]
+            terms.add(('email', email))
+            terms.update(('name', token) for token in _tokens(email.split('@')[0]))
+        card = re.sub(r'[^A-Z0-9]', '', (user.library_card_number or '').upper())
+        if card:
+            terms.add(('card', card))
+        phone = re.sub(r'\D', '', user.phone_number or '')
+        if len(phone) >= 7:
+            terms.update({('phone', phone), ('phone', phone[-7:])})
+        rows += [MemberSearchTerm(user_id=user.id, kind=kind, term=term) for kind, term in terms]
+        if len(rows) >= 5000:
+            MemberSearchTerm.objects.bulk_create(rows)
+            rows = []
+    MemberSearchTerm.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_audit_retention_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('name', 'Name'), ('card', 'Library card'), ('phone', 'Phone number'), ('email', 'Email')], max_length=10)),
+                ('term', models.CharField(max_length=100)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'term'], name='member_search_term_idx')],
+                'unique_together': {('user', 'kind', 'term')},
+            },
+        ),
+        migrations.RunPython(index_members, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,21 @@
+import hashlib
+from ipaddress import ip_address
+
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.utils import timezone
 
+
+def pack_ip(address):
+    """Packs an IP address string into 4 or 16 bytes; None if it is not a valid address."""
+    try:
+        return ip_address(address).packed if address else None
+    except ValueError:
+        return None
+
+def unpack_ip(packed):
+    return str(ip_address(bytes(packed))) if packed else None
+
 class User(AbstractUser):
     USER_TYPE_CHOICES = [
         ('member', 'Library Member'),
@@ -21,6 +35,12 @@ class User(AbstractUser):
     membership_expiry = models.DateTimeField(blank=True, null=True)
     profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
     
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Range scans for the membership billing run
+            models.Index(fields=['membership_expiry'], name='user_membership_expiry_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.username} ({self.get_user_type_display()})"
     
@@ -38,16 +58,18 @@ class User(AbstractUser):
     
     def save(self, *args, **kwargs):
         if not self.library_card_number and self.user_type == 'member':
-            # Generate library card number
-            last_member = User.objects.filter(user_type='member').order_by('id').last()
-            if last_member and last_member.library_card_number:
-                last_number = int(last_member.library_card_number.replace('LIB', ''))
-                self.library_card_number = f"LIB{last_number + 1:06d}"
-            else:
-                self.library_card_number = "LIB000001"
+            from .sequences import next_value
+            self.library_card_number = next_value('library_card')
         super().save(*args, **kwargs)
 
 class UserProfile(models.Model):
+    # Keys understood in ``notification_preferences``; missing keys fall back to these
+    NOTIFICATION_DEFAULTS = {
+        'email': True,
+        'due_reminders': True,
+        'overdue_notices': True,
+    }
+    
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     bio = models.TextField(max_length=500, blank=True)
     notification_preferences = models.JSONField(default=dict, blank=True)
@@ -69,6 +91,10 @@ class UserProfile(models.Model):
     
     def __str__(self):
         return f"{self.user.username}'s Profile"
+    
+    def wants_notification(self, kind):
+        prefs = {**self.NOTIFICATION_DEFAULTS, **(self.notification_preferences or {})}
+        return bool(prefs.get('email')) and bool(prefs.get(kind, True))
 
 class AuditLog(models.Model):
     ACTION_CHOICES = [
@@ -86,14 +112,88 @@ class AuditLog(models.Model):
     
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='audit_logs')
     action = models.CharField(max_length=30, choices=ACTION_CHOICES)
-    description = models.TextField(blank=True)
-    ip_address = models.GenericIPAddressField(blank=True, null=True)
-    user_agent = models.TextField(blank=True)
+    description = models.ForeignKey(
+        'AuditDescription', on_delete=models.PROTECT, blank=True, null=True, related_name='+'
+    )
+    ip = models.BinaryField(max_length=16, blank=True, null=True, help_text="Packed IPv4 or IPv6 address")
+    user_agent = models.ForeignKey(
+        'AuditUserAgent', on_delete=models.PROTECT, blank=True, null=True, related_name='+'
+    )
     timestamp = models.DateTimeField(auto_now_add=True)
     additional_data = models.JSONField(default=dict, blank=True)
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # A member's recent activity, and the range scans of the retention job
+            models.Index(fields=['user', 'timestamp'], name='audit_user_time_idx'),
+            models.Index(fields=['timestamp'], name='audit_time_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.get_action_display()} at {self.timestamp}"
+    
+    @property
+    def ip_address(self):
+        return unpack_ip(self.ip)
+
+class InternedString(models.Model):
+    """
+    A distinct string stored once and referenced by id, looked up by the
+    digest of its value; see ``accounts.audit`` for the interning.
+    """
+    digest = models.CharField(max_length=32, unique=True)
+    value = models.TextField()
+    
+    class Meta:
+        abstract = True
+    
+    def __str__(self):
+        return self.value
+    
+    @staticmethod
+    def digest_of(value):
+        return hashlib.blake2b(value.encode(), digest_size=16).hexdigest()
+
+class AuditUserAgent(InternedString):
+    pass
+
+class AuditDescription(InternedString):
+    pass
+
+class Sequence(models.Model):
+    """
+    Counter behind generated identifiers (card numbers, receipts, barcodes).
+    Processes reserve blocks of values from it; see accounts.sequences.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} (next {self.next_value})"
+
+class MemberSearchTerm(models.Model):
+    """
+    Normalized search key for a member, maintained by accounts.search so
+    the member list can look members up by index range instead of scanning.
+    """
+    KIND_CHOICES = [
+        ('name', 'Name'),
+        ('card', 'Library card'),
+        ('phone', 'Phone number'),
+        ('email', 'Email'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_terms')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    term = models.CharField(max_length=100)
+    
+    class Meta:
+        unique_together = [['user', 'kind', 'term']]
+        indexes = [
+            models.Index(fields=['kind', 'term'], name='member_search_term_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username}: {self.kind} {self.term}"
@@ -0,0 +1,166 @@
+import re
+import unicodedata
+
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import MemberSearchTerm, User
+
+# Fields the search terms are built from; saves touching none of them skip reindexing
+INDEXED_FIELDS = {'username', 'first_name', 'last_name', 'email', 'phone_number', 'library_card_number', 'user_type'}
+
+# Phone numbers are matched on all their digits or on the local (last seven) digits
+LOCAL_PHONE_DIGITS = 7
+
+# Upper bound for prefix ranges; sorts after any character in a term
+PREFIX_END = '\uffff'
+
+CARD_PATTERN = re.compile(r'^[A-Z]+\d+$')
+MAX_TERM_LENGTH = MemberSearchTerm._meta.get_field('term').max_length
+
+
+def name_tokens(value):
+    """Lower-case, accent-free alphanumeric words of ``value``."""
+    text = unicodedata.normalize('NFKD', value or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return [token[:MAX_TERM_LENGTH] for token in re.findall(r'[a-z0-9]+', text)]
+
+
+def normalize_phone(value):
+    return re.sub(r'\D', '', value or '')
+
+
+def normalize_card(value):
+    return re.sub(r'[^A-Z0-9]', '', (value or '').upper())
+
+
+def member_terms(user):
+    """``{(kind, term)}`` search keys for ``user``; none for staff accounts."""
+    if user.user_type != 'member':
+        return set()
+    terms = {
+        ('name', token)
+        for value in (user.username, user.first_name, user.last_name)
+        for token in name_tokens(value)
+    }
+    if user.email:
+        email = user.email.strip().lower()[:MAX_TERM_LENGTH]
+        terms.add(('email', email))
+        terms.update(('name', token) for token in name_tokens(email.split('@')[0]))
+    card = normalize_card(user.library_card_number)
+    if card:
+        terms.add(('card', card))
+    phone = normalize_phone(user.phone_number)
+    if len(phone) >= LOCAL_PHONE_DIGITS:
+        terms.update({('phone', phone), ('phone', phone[-LOCAL_PHONE_DIGITS:])})
+    return terms
+
+
+def index_member(user):
+    """Brings ``user``'s search terms in line with the user row."""
+    terms = member_terms(user)
+    existing = {
+        (kind, term): pk for kind, term, pk in
+        MemberSearchTerm.objects.filter(user=user).values_list('kind', 'term', 'pk')
+    }
+    stale = [pk for key, pk in existing.items() if key not in terms]
+    missing = [MemberSearchTerm(user=user, kind=kind, term=term) for kind, term in terms if (kind, term) not in existing]
+    if stale or missing:
+        with transaction.atomic():
+            MemberSearchTerm.objects.filter(pk__in=stale).delete()
+            MemberSearchTerm.objects.bulk_create(missing, ignore_conflicts=True)
+
+
+def _write_terms(users):
+    rows = [
+        MemberSearchTerm(user_id=user.id, kind=kind, term=term)
+        for user in users for kind, term in member_terms(user)
+    ]
+    with transaction.atomic():
+        MemberSearchTerm.objects.filter(user_id__in=[user.id for user in users]).delete()
+        MemberSearchTerm.objects.bulk_create(rows)
+    return len(rows)
+
+
+def rebuild_index(chunk_size=1000):
+    """
+    Recomputes every member's search terms, ``chunk_size`` users per
+    transaction. Returns the number of terms written.
+    """
+    written = 0
+    last_id = 0
+    while True:
+        users = list(
+            User.objects.filter(id__gt=last_id).order_by('id')
+            .only('id', *INDEXED_FIELDS)[:chunk_size]
+        )
+        if not users:
+            return written
+        written += _write_terms(users)
+        last_id = users[-1].id
+
+
+def reindex_users(user_ids):
+    """
+    Recomputes the search terms of ``user_ids``, for changes made with
+    ``QuerySet.update()``, which skips the post_save hook. Returns the
+    number of terms written.
+    """
+    return _write_terms(User.objects.filter(pk__in=list(user_ids)).only('id', *INDEXED_FIELDS))
+
+
+@receiver(post_save, sender=User)
+def _user_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not INDEXED_FIELDS & set(update_fields)):
+        return
+    index_member(instance)
+
+
+def _matching(kind, term, prefix=False):
+    terms = MemberSearchTerm.objects.filter(kind=kind)
+    if prefix:
+        # A range rather than LIKE, so every backend can use member_search_term_idx
+        terms = terms.filter(term__gte=term, term__lt=term + PREFIX_END)
+    else:
+        terms = terms.filter(term=term)
+    return terms.values('user_id')
+
+
+def search_members(query, queryset=None):
+    """
+    Users in ``queryset`` (all users by default) matching ``query``.
+
+    An email address is matched by prefix and a phone number (seven or
+    more digits, punctuation ignored) exactly on all or its local digits.
+    A card number is matched by prefix. Anything else is split into words,
+    each of which has to prefix-match a name, username or email word.
+    """
+    queryset = User.objects.all() if queryset is None else queryset
+    query = (query or '').strip()
+    if not query:
+        return queryset
+
+    if '@' in query:
+        return queryset.filter(id__in=_matching('email', query.lower(), prefix=True))
+
+    phone = normalize_phone(query)
+    if len(phone) >= LOCAL_PHONE_DIGITS and not re.search(r'[A-Za-z]', query):
+        # Either side may have been saved with or without the country code
+        return queryset.filter(id__in=MemberSearchTerm.objects.filter(
+            kind='phone', term__in={phone, phone[-LOCAL_PHONE_DIGITS:]}
+        ).values('user_id'))
+
+    tokens = name_tokens(query)
+    if not tokens:
+        return queryset.none()
+    card = normalize_card(query)
+    if CARD_PATTERN.match(card) and len(tokens) == 1:
+        # Could be a card number or a username like "reader42"
+        return queryset.filter(
+            Q(id__in=_matching('card', card, prefix=True)) | Q(id__in=_matching('name', tokens[0], prefix=True))
+        )
+    for token in tokens:
+        queryset = queryset.filter(id__in=_matching('name', token, prefix=True))
+    return queryset
@@ -0,0 +1,200 @@
+import threading
+from collections import defaultdict, deque
+
+from django.apps import apps
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+
+from .models import Sequence
+
+
+class NumberFormat:
+    """Prefix followed by the zero-padded value, e.g. ``LIB000042``."""
+
+    def __init__(self, prefix='', width=6):
+        self.prefix = prefix
+        self.width = width
+
+    def format(self, value):
+        return f'{self.prefix}{value:0{self.width}d}'
+
+    def parse(self, text):
+        """Value behind an identifier in this format, or None if it is not one."""
+        digits = (text or '')[len(self.prefix):]
+        if not text or not text.startswith(self.prefix) or not digits.isdigit():
+            return None
+        return int(digits)
+
+
+def luhn_digit(digits):
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        digit = int(digit)
+        if position % 2 == 0:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return str((10 - total % 10) % 10)
+
+
+class CheckDigitFormat(NumberFormat):
+    """``NumberFormat`` plus a trailing Luhn check digit, so scanners catch misreads."""
+
+    def format(self, value):
+        number = f'{value:0{self.width}d}'
+        return f'{self.prefix}{number}{luhn_digit(number)}'
+
+    def parse(self, text):
+        value = super().parse(text)
+        if value is None or len(text) < len(self.prefix) + 2:
+            return None
+        number, check = text[len(self.prefix):-1], text[-1]
+        return int(number) if luhn_digit(number) == check else None
+
+
+class SequenceSpec:
+    def __init__(self, format, block_size=20, model=None, field=None):
+        self.format = format
+        self.block_size = block_size
+        # Existing identifiers to continue from the first time the sequence is used
+        self.model = model
+        self.field = field
+
+    def seed(self):
+        if not self.model:
+            return 1
+        values = apps.get_model(self.model).objects.filter(
+            **{f'{self.field}__startswith': self.format.prefix}
+        ).values_list(self.field, flat=True)
+        parsed = (self.format.parse(text) for text in values.iterator())
+        return max((value for value in parsed if value is not None), default=0) + 1
+
+
+SEQUENCES = {
+    'library_card': SequenceSpec(NumberFormat('LIB', 6), model='accounts.User', field='library_card_number'),
+    'receipt': SequenceSpec(NumberFormat('RCP', 6), model='fines.FinePayment', field='receipt_number'),
+    'copy_barcode': SequenceSpec(CheckDigitFormat('BC', 9), block_size=100, model='books.BookCopy', field='barcode'),
+}
+
+
+def register(name, format, block_size=20, model=None, field=None):
+    SEQUENCES[name] = SequenceSpec(format, block_size, model, field)
+
+
+class _Block:
+    __slots__ = ('next', 'end')
+
+    def __init__(self, start, end):
+        self.next, self.end = start, end
+
+    def take(self, count):
+        start = self.next
+        self.next = min(self.next + count, self.end)
+        return range(start, self.next)
+
+
+# Committed blocks this process may hand out, shared by all threads
+_pool = defaultdict(deque)
+_lock = threading.Lock()
+
+
+def _reserve_here(name, size):
+    """Moves the counter on by ``size`` on this thread's connection and returns the new end."""
+    with transaction.atomic():
+        if not Sequence.objects.filter(name=name).update(next_value=F('next_value') + size):
+            try:
+                with transaction.atomic():
+                    Sequence.objects.create(name=name, next_value=SEQUENCES[name].seed())
+            except IntegrityError:
+                pass  # created concurrently
+            Sequence.objects.filter(name=name).update(next_value=F('next_value') + size)
+        return Sequence.objects.filter(name=name).values_list('next_value', flat=True).get()
+
+
+def _reserve_apart(name, size):
+    """``_reserve_here`` on a thread of its own, so it commits on a connection of its own."""
+    result = {}
+
+    def run():
+        try:
+            result['end'] = _reserve_here(name, size)
+        except BaseException as exc:
+            result['error'] = exc
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=run, name='sequence-reserve', daemon=True)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['end']
+
+
+def _reserve(name, size):
+    """
+    Moves the counter on by ``size`` and returns the reserved ``(start, end)``.
+    Inside a transaction the update commits separately, so the counter row is
+    not held locked until the caller commits; SQLite allows one writer at a
+    time, so there it joins the caller's transaction instead.
+    """
+    if connection.in_atomic_block and connection.vendor != 'sqlite':
+        end = _reserve_apart(name, size)
+    else:
+        end = _reserve_here(name, size)
+    return end - size, end
+
+
+def allocate_values(name, count=1):
+    """
+    ``count`` unused integers from sequence ``name``. Values come from this
+    process's reserved blocks, so most calls run no query; values drawn in a
+    transaction that rolls back may be skipped but are never handed out twice.
+    """
+    spec = SEQUENCES[name]
+    values = []
+    with _lock:
+        blocks = _pool[name]
+        while len(values) < count and blocks:
+            values.extend(blocks[0].take(count - len(values)))
+            if blocks[0].next >= blocks[0].end:
+                blocks.popleft()
+    if len(values) == count:
+        return values
+
+    needed = count - len(values)
+    if connection.in_atomic_block and connection.vendor == 'sqlite':
+        # Reserved in the caller's transaction, so a rollback hands the
+        # values back to the counter; no block is kept that could outlive it
+        return values + list(range(*_reserve(name, needed)))
+
+    block = _Block(*_reserve(name, max(spec.block_size, needed)))
+    values.extend(block.take(needed))
+    with _lock:
+        _pool[name].append(block)
+    return values
+
+
+def allocate(name, count=1):
+    """``count`` formatted identifiers from sequence ``name``."""
+    spec = SEQUENCES[name]
+    return [spec.format.format(value) for value in allocate_values(name, count)]
+
+
+def next_value(name):
+    return allocate(name)[0]
+
+
+def assign(name, objects, field):
+    """Fills ``field`` on every object in ``objects`` that lacks one, with a single allocation."""
+    missing = [obj for obj in objects if not getattr(obj, field)]
+    for obj, value in zip(missing, allocate(name, len(missing))):
+        setattr(obj, field, value)
+    return objects
+
+
+def reset():
+    """Forgets blocks held by this process, e.g. after the counter table is flushed."""
+    with _lock:
+        _pool.clear()
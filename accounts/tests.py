@@ -1,3 +1,312 @@
-from django.test import TestCase
+import gzip
+import os
+import tempfile
+from datetime import date, datetime
+from unittest import mock
+
+from django.contrib.admin.sites import site
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.cache import cache
+from django.db import transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import archive, audit, sequences
+from .admin import UserAdmin
+from .backends import CachedUserBackend, forget_users
+from .models import AuditDescription, AuditLog, AuditUserAgent, Sequence, User, pack_ip, unpack_ip
+from .search import search_members
+
+
+class SequenceTests(TestCase):
+    def setUp(self):
+        sequences.reset()
+        self.addCleanup(sequences.reset)
+
+    def test_values_are_consecutive_and_unique(self):
+        first = sequences.allocate_values('receipt', 3)
+        second = sequences.allocate_values('receipt', 2)
+        self.assertEqual(first + second, list(range(first[0], first[0] + 5)))
+
+    def test_formats_identifiers(self):
+        self.assertEqual(sequences.allocate('receipt', 2), ['RCP000001', 'RCP000002'])
+        barcode = sequences.next_value('copy_barcode')
+        self.assertEqual(sequences.SEQUENCES['copy_barcode'].format.parse(barcode), 1)
+
+    def test_continues_from_existing_identifiers(self):
+        User.objects.create_user(username='old', password='pw', user_type='member', library_card_number='LIB000041')
+        self.assertEqual(sequences.next_value('library_card'), 'LIB000042')
+
+    def test_values_rolled_back_are_handed_out_again(self):
+        before = Sequence.objects.filter(name='receipt').values_list('next_value', flat=True).first()
+        try:
+            with transaction.atomic():
+                rolled_back = sequences.allocate_values('receipt', 4)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(Sequence.objects.filter(name='receipt').values_list('next_value', flat=True).first(), before)
+        self.assertEqual(sequences.allocate_values('receipt', 4), rolled_back)
+
+    def test_assign_fills_only_missing_values(self):
+        users = [User(username='a', user_type='member'), User(username='b', user_type='member', library_card_number='KEEP1')]
+        sequences.assign('library_card', users, 'library_card_number')
+        self.assertEqual([user.library_card_number for user in users], ['LIB000001', 'KEEP1'])
+
+    def test_assign_after_rollback_leaves_no_gap(self):
+        try:
+            with transaction.atomic():
+                sequences.assign('library_card', [User(username='gone')], 'library_card_number')
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        users = sequences.assign('library_card', [User(username='c'), User(username='d')], 'library_card_number')
+        self.assertEqual([user.library_card_number for user in users], ['LIB000001', 'LIB000002'])
+
+
+class AuditLogTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = User.objects.create_user(username='reader', password='pw', user_type='member')
+
+    def setUp(self):
+        # Keep the flusher thread from writing through its own connection
+        # while the test transaction is open; entries are flushed by hand
+        for patcher in (
+            mock.patch.object(audit, '_start'),
+            # The shared LRUs would remember ids rolled back with other tests
+            mock.patch.object(audit, 'user_agents', audit.Interner(AuditUserAgent)),
+            mock.patch.object(audit, 'descriptions', audit.Interner(AuditDescription)),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        audit._pending.clear()
+        self.addCleanup(audit._pending.clear)
+
+    def test_record_only_queues(self):
+        with self.assertNumQueries(0):
+            audit.record('login', self.member, 'Logged in')
+        self.assertEqual(len(audit._pending), 1)
+        self.assertFalse(AuditLog.objects.exists())
+        audit._start.assert_called_once_with()
+
+    def test_recorded_once_the_transaction_commits(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            audit.record_on_commit('profile_updated', self.member.pk, 'Profile updated')
+        self.assertEqual(len(audit._pending), 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(audit._pending), 1)
+
+    def test_flush_writes_batches(self):
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', HTTP_USER_AGENT='Browser/1.0')
+        with mock.patch.object(audit, 'BATCH_SIZE', 2):
+            for n in range(5):
+                audit.record('login', self.member, 'Logged in', request, attempt=n)
+            self.assertEqual(audit.flush(), 5)
+
+        self.assertEqual(len(audit._pending), 0)
+        entries = AuditLog.objects.order_by('id')
+        self.assertEqual([entry.additional_data['attempt'] for entry in entries], list(range(5)))
+        self.assertEqual({entry.ip_address for entry in entries}, {'10.0.0.1'})
+        self.assertEqual(str(entries[0].description), 'Logged in')
+        self.assertEqual(str(entries[0].user_agent), 'Browser/1.0')
+
+
+class InternerTests(TestCase):
+    def test_strings_are_stored_once(self):
+        interner = audit.Interner(AuditUserAgent)
+        ids = interner.ids(['Browser/1.0', 'Browser/2.0', 'Browser/1.0', ''])
+        self.assertEqual(set(ids), {'Browser/1.0', 'Browser/2.0'})
+        self.assertEqual(AuditUserAgent.objects.count(), 2)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(interner.ids(['Browser/2.0']), {'Browser/2.0': ids['Browser/2.0']})
+        # Another process finds the rows by digest instead of adding its own
+        self.assertEqual(audit.Interner(AuditUserAgent).ids(['Browser/1.0']), {'Browser/1.0': ids['Browser/1.0']})
+        self.assertEqual(AuditUserAgent.objects.count(), 2)
+
+    def test_least_recently_used_ids_are_dropped(self):
+        interner = audit.Interner(AuditDescription, size=2)
+        interner.ids(['a', 'b'])
+        interner.ids(['a', 'c'])
+        with self.assertNumQueries(0):
+            interner.ids(['a', 'c'])
+        with self.assertNumQueries(1):
+            interner.ids(['b'])
+
+
+class PackedAddressTests(SimpleTestCase):
+    def test_round_trip(self):
+        for address, size in [('192.0.2.10', 4), ('2001:db8::1', 16)]:
+            self.assertEqual(len(pack_ip(address)), size)
+            self.assertEqual(unpack_ip(pack_ip(address)), address)
+
+    def test_invalid_addresses(self):
+        self.assertIsNone(pack_ip('not an address'))
+        self.assertIsNone(pack_ip(''))
+        self.assertIsNone(unpack_ip(None))
+
+    def test_client_ip_prefers_the_first_forwarded_address(self):
+        self.assertEqual(unpack_ip(audit.client_ip('10.0.0.1', '198.51.100.7, 10.0.0.2')), '198.51.100.7')
+        self.assertEqual(unpack_ip(audit.client_ip('10.0.0.1')), '10.0.0.1')
+
+
+class AuditArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.members = [User.objects.create_user(username=f'reader{n}', password='pw') for n in range(2)]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(AUDIT_ARCHIVE_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.march = archive._month_start(date(2024, 3, 1))
+
+    def entry(self, user, action, when):
+        entry = AuditLog.objects.create(user=user, action=action, ip=pack_ip('10.0.0.1'))
+        AuditLog.objects.filter(pk=entry.pk).update(timestamp=when)
+        return entry
+
+    def old_entries(self):
+        return [
+            self.entry(user, action, timezone.make_aware(datetime(2024, month, 10, 12)))
+            for month in (3, 4)
+            for user in self.members
+            for action in ('login', 'logout')
+        ]
+
+    def test_archives_whole_old_months(self):
+        self.old_entries()
+        recent = self.entry(self.members[0], 'login', timezone.now())
+
+        self.assertEqual(archive.archive_audit_log(chunk_size=3), (8, 8))
+        self.assertEqual(list(AuditLog.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertEqual(archive.archive_audit_log(), (0, 0))
+
+        parts = archive.month_parts(self.march)
+        self.assertEqual(len(parts), 1)
+        data_path = parts[0].replace('.index.json', '.jsonl.gz')
+        self.assertTrue(os.path.exists(data_path))
+        with gzip.open(data_path, 'rt') as data_file:
+            self.assertEqual(len(data_file.readlines()), 4)
+
+    def test_search_reads_only_matching_blocks(self):
+        self.old_entries()
+        archive.archive_audit_log()
+        start, end = self.march, archive._next_month(archive._next_month(self.march))
+
+        found = list(archive.search_archive(start, end, user_id=self.members[1].pk, action='logout'))
+        self.assertEqual(
+            [(entry['user_id'], entry['action']) for entry in found], [(self.members[1].pk, 'logout')] * 2
+        )
+        self.assertEqual({entry['ip_address'] for entry in found}, {'10.0.0.1'})
+        self.assertEqual(len(list(archive.search_archive(start, archive._next_month(start)))), 4)
+
+    def test_resumes_after_an_interrupted_purge(self):
+        entries = self.old_entries()[:4]
+        in_march = AuditLog.objects.filter(pk__in=[entry.pk for entry in entries])
+        archive.write_part(self.march, in_march)
+
+        self.assertEqual(archive.archive_month(self.march), (0, 4))
+        self.assertEqual(len(archive.month_parts(self.march)), 1)
+
+
+class MemberSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.jane = User.objects.create_user(
+            username='jjohnson', password='pw', first_name='Jane', last_name='Johnson',
+            email='jane.johnson@example.com', phone_number='+960 777-1234', user_type='member',
+        )
+        cls.mario = User.objects.create_user(
+            username='mrossi', password='pw', first_name='Mário', last_name='Rossi',
+            email='mario@example.org', phone_number='7654321', user_type='member',
+        )
+        cls.staff = User.objects.create_user(
+            username='jlibrarian', password='pw', first_name='Jack', last_name='Johnson', user_type='librarian',
+        )
+
+    def assertFinds(self, query, *users):
+        self.assertEqual(set(search_members(query)), set(users), query)
+
+    def test_name_words_match_by_prefix(self):
+        self.assertFinds('john', self.jane)
+        self.assertFinds('Jane Joh', self.jane)
+        self.assertFinds('mario', self.mario)
+        self.assertFinds('son')
+
+    def test_email_matches_by_prefix(self):
+        self.assertFinds('jane.johnson@ex', self.jane)
+        self.assertFinds('MARIO@example.org', self.mario)
+        self.assertFinds('nobody@example.org')
+
+    def test_phone_matches_all_or_local_digits(self):
+        self.assertFinds('9607771234', self.jane)
+        self.assertFinds('777 1234', self.jane)
+        self.assertFinds('+960 765-4321', self.mario)
+
+    def test_card_number_matches_by_prefix(self):
+        self.assertFinds(self.jane.library_card_number, self.jane)
+        self.assertFinds(self.jane.library_card_number.lower(), self.jane)
+
+    def test_blank_query_returns_queryset(self):
+        self.assertEqual(search_members('  ').count(), User.objects.count())
+        self.assertFinds('--')
+
+    def test_staff_are_not_indexed(self):
+        self.assertFinds('jlibrarian')
+
+    def test_edits_are_reindexed(self):
+        self.mario.last_name = 'Bianchi'
+        self.mario.save()
+        self.assertFinds('rossi')
+        self.assertFinds('bianchi', self.mario)
+
+    def test_admin_type_actions_reindex(self):
+        request = RequestFactory().post('/')
+        request.session = {}
+        request._messages = FallbackStorage(request)
+        admin = UserAdmin(User, site)
+
+        admin.make_member(request, User.objects.filter(pk=self.staff.pk))
+        self.assertFinds('jlibrarian', self.staff)
+        admin.make_librarian(request, User.objects.filter(user_type='member', pk=self.staff.pk))
+        self.assertFinds('jlibrarian')
+
+
+class CachedUserBackendTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = User.objects.create_user(username='reader', password='pw', address='1 Main Street')
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.backend = CachedUserBackend()
+
+    def test_second_lookup_is_served_from_the_cache(self):
+        self.assertEqual(self.backend.get_user(self.member.pk), self.member)
+        with self.assertNumQueries(0):
+            user = self.backend.get_user(self.member.pk)
+        self.assertEqual(user.username, 'reader')
+        with self.assertNumQueries(1):
+            self.assertEqual(user.address, '1 Main Street')
+
+    def test_saves_and_updates_drop_the_cached_user(self):
+        self.backend.get_user(self.member.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member.first_name = 'Jane'
+            self.member.save()
+        self.assertEqual(self.backend.get_user(self.member.pk).first_name, 'Jane')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.member.pk).update(is_active=False)
+            forget_users([self.member.pk])
+        self.assertIsNone(self.backend.get_user(self.member.pk))
+
+    def test_unknown_user(self):
+        self.assertIsNone(self.backend.get_user(0))
 
-# Create your tests here.
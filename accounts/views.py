@@ -11,8 +11,12 @@ from django.urls import reverse_lazy
 from django.db.models import Q, Count, Sum
 from django.db import models
 from .models import User, UserProfile, AuditLog
+from .search import search_members
 from .forms import CustomUserCreationForm, UserProfileForm, MemberEditForm
+from borrowing import stats
 from borrowing.models import BorrowTransaction
+from borrowing.summaries import get_summary
+from fines.ledger import outstanding_balance
 from fines.models import Fine
 
 class RegisterView(CreateView):
@@ -28,28 +32,11 @@ class RegisterView(CreateView):
         # Create UserProfile for the new user
         UserProfile.objects.get_or_create(user=user)
         
-        # Log the user in
+        # Log the user in; the account_created audit entry is recorded by accounts.audit
         login(self.request, user)
         
-        # Create audit log
-        AuditLog.objects.create(
-            user=user,
-            action='account_created',
-            description=f'Account created for user {user.username}',
-            ip_address=self.get_client_ip(),
-            user_agent=self.request.META.get('HTTP_USER_AGENT', '')
-        )
-        
         messages.success(self.request, 'Account created successfully! Welcome to the library!')
         return redirect('accounts:profile')
-    
-    def get_client_ip(self):
-        x_forwarded_for = self.request.META.get('HTTP_X_FORWARDED_FOR')
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = self.request.META.get('REMOTE_ADDR')
-        return ip
 
 class ProfileView(LoginRequiredMixin, TemplateView):
     template_name = 'accounts/profile.html'
@@ -61,10 +48,12 @@ class ProfileView(LoginRequiredMixin, TemplateView):
         context.update({
             'current_borrowings': BorrowTransaction.objects.filter(
                 user=user, status='active'
-            ).select_related('book_copy__book'),
+            ).with_accrual().select_related('book_copy__book'),
             'pending_fines': Fine.objects.filter(
                 user=user, status='pending'
             ).select_related('fine_type'),
+            'outstanding_balance': outstanding_balance(user),
+            'summary': get_summary(user),
             'recent_borrowings': BorrowTransaction.objects.filter(
                 user=user
             ).order_by('-borrowed_at')[:5].select_related('book_copy__book'),
@@ -90,27 +79,31 @@ class DashboardView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = self.request.user
+        summary = get_summary(user)
+        context['summary'] = summary
         
         if user.is_librarian:
             # Librarian dashboard
+            context.update(BorrowTransaction.objects.filter(status='active').with_accrual().aggregate(
+                total_active_loans=Count('id'),
+                overdue_books=Count('id', filter=Q(is_overdue=True)),
+                accrued_fines=Sum('accrued_fine'),
+            ))
             context.update({
-                'total_active_loans': BorrowTransaction.objects.filter(status='active').count(),
-                'overdue_books': BorrowTransaction.objects.filter(
-                    status='active', due_date__lt=timezone.now()
-                ).count(),
-                'pending_reservations': user.reservations.filter(status='active').count(),
+                'pending_reservations': summary.active_reservations,
                 'pending_fines': Fine.objects.filter(status='pending').count(),
+                'circulation_mtd': stats.month_to_date(),
             })
         else:
-            # Member dashboard
-            context.update({
-                'active_borrowings': BorrowTransaction.objects.filter(
+            # Member dashboard; fines only accrue while something is overdue
+            if summary.overdue_loans():
+                context.update(BorrowTransaction.objects.filter(
                     user=user, status='active'
-                ).count(),
-                'total_fines': Fine.objects.filter(
-                    user=user, status='pending'
-                ).aggregate(total=Sum('amount'))['total'] or 0,
-                'active_reservations': user.reservations.filter(status='active').count(),
+                ).with_accrual().aggregate(accrued_fines=Sum('accrued_fine')))
+            context.update({
+                'active_borrowings': summary.active_loans,
+                'total_fines': outstanding_balance(user),
+                'active_reservations': summary.active_reservations,
             })
         
         return context
@@ -126,22 +119,26 @@ class MemberListView(LibrarianRequiredMixin, ListView):
     paginate_by = 20
     
     def get_queryset(self):
-        queryset = User.objects.filter(user_type='member').annotate(
-            active_borrowings=Count('borrow_transactions', 
-                                  filter=Q(borrow_transactions__status='active'))
-        )
+        queryset = User.objects.filter(user_type='member')
         
         search = self.request.GET.get('search')
         if search:
-            queryset = queryset.filter(
-                Q(username__icontains=search) |
-                Q(first_name__icontains=search) |
-                Q(last_name__icontains=search) |
-                Q(email__icontains=search) |
-                Q(library_card_number__icontains=search)
-            )
+            queryset = search_members(search, queryset)
         
         return queryset.order_by('-date_joined')
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Active loans counted for the members on this page only
+        members = list(context['object_list'])
+        active = dict(
+            BorrowTransaction.objects.filter(user__in=members, status='active').order_by()
+            .values('user_id').annotate(n=Count('id')).values_list('user_id', 'n')
+        )
+        for member in members:
+            member.active_borrowings = active.get(member.pk, 0)
+        context['object_list'] = context['members'] = members
+        return context
 
 class MemberDetailView(LibrarianRequiredMixin, DetailView):
     model = User
@@ -150,12 +147,13 @@ class MemberDetailView(LibrarianRequiredMixin, DetailView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        member = self.get_object()
+        member = self.object
         
         context.update({
+            'summary': get_summary(member),
             'current_borrowings': BorrowTransaction.objects.filter(
                 user=member, status='active'
-            ).select_related('book_copy__book'),
+            ).with_accrual().select_related('book_copy__book'),
             'borrowing_history': BorrowTransaction.objects.filter(
                 user=member
             ).order_by('-borrowed_at')[:10].select_related('book_copy__book'),
@@ -164,7 +162,7 @@ class MemberDetailView(LibrarianRequiredMixin, DetailView):
             ).select_related('fine_type'),
             'audit_logs': AuditLog.objects.filter(
                 user=member
-            ).order_by('-timestamp')[:20],
+            ).select_related('description').order_by('-timestamp')[:20],
         })
         return context
 
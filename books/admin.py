@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Author, Publisher, Category, Book, BookCopy, BookReservation
+from .models import Author, Publisher, Category, Book, BookCopy, BookReservation, BookBranchAvailability
 
 @admin.register(Author)
 class AuthorAdmin(admin.ModelAdmin):
@@ -70,3 +70,13 @@ class BookReservationAdmin(admin.ModelAdmin):
     raw_id_fields = ('user', 'book')
     date_hierarchy = 'reserved_at'
     readonly_fields = ('reserved_at',)
+
+@admin.register(BookBranchAvailability)
+class BookBranchAvailabilityAdmin(admin.ModelAdmin):
+    list_display = ('book', 'branch', 'available', 'borrowed', 'reserved', 'total')
+    list_filter = ('branch',)
+    search_fields = ('book__title',)
+    readonly_fields = ('book', 'branch', 'total', 'available', 'borrowed', 'reserved')
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,27 @@
+from django.db.models import Case, IntegerField, Value, When
+
+from .models import BookBranchAvailability
+
+
+def _preferred_branch_id(user):
+    profile = getattr(user, 'profile', None)
+    return profile.preferred_branch_id if profile else None
+
+
+def pick_branch(user, book):
+    """
+    Availability row for the branch that should serve ``user`` for ``book``,
+    in one query against the availability matrix: branches with a copy on
+    the shelf first, the patron's preferred branch before others, then the
+    most spare copies. Returns None when no branch stocks the book.
+    """
+    preferred_id = _preferred_branch_id(user)
+    return BookBranchAvailability.objects.filter(book=book, total__gt=0).annotate(
+        no_spare=Case(When(available__gt=0, then=Value(0)), default=Value(1), output_field=IntegerField()),
+        not_preferred=Case(When(branch_id=preferred_id, then=Value(0)), default=Value(1), output_field=IntegerField()),
+    ).order_by('no_spare', 'not_preferred', '-available', '-total', 'branch_id').select_related('branch').first()
+
+
+def branch_availability(book):
+    """Per-branch copy counts for ``book``, for display."""
+    return BookBranchAvailability.objects.filter(book=book, total__gt=0).select_related('branch').order_by('branch__name')
@@ -0,0 +1,156 @@
+import math
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db.models import Avg, Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from library_branches.models import LibraryBranch
+from .models import Book, BookBranchAvailability, BookReservation
+
+try:
+    import numpy as np
+except ImportError:  # optional; the same model runs in pure Python without it
+    np = None
+
+# Titles need this many returned loans before their own average loan length
+# is trusted over their category's
+MIN_LOAN_SAMPLES = 5
+
+
+def _default_loan_days():
+    return getattr(settings, 'LIBRARY_SETTINGS', {}).get('DEFAULT_LOAN_PERIOD_DAYS', 14)
+
+
+def loan_length_averages():
+    """
+    Average days a loan lasts, per book and per category, aggregated in the
+    database from returned BorrowingHistory rows.
+    Returns ``(per_book, per_category)`` dicts of ``id: (loans, avg_days)``.
+    """
+    from borrowing.models import BorrowingHistory
+
+    returned = BorrowingHistory.objects.filter(action='returned', days_borrowed__isnull=False).order_by()
+    per_book = {
+        row['book_id']: (row['loans'], row['avg_days'])
+        for row in returned.values('book_id').annotate(loans=Count('id'), avg_days=Avg('days_borrowed')).iterator()
+    }
+    per_category = {
+        row['book__category_id']: (row['loans'], row['avg_days'])
+        for row in returned.values('book__category_id').annotate(loans=Count('id'), avg_days=Avg('days_borrowed')).iterator()
+    }
+    return per_book, per_category
+
+
+def _weekly_checkouts(start, weeks):
+    """
+    ``{(book_id, branch_id): [checkouts per week]}`` for the ``weeks`` weeks
+    starting at ``start``, grouped by day in the database.
+    """
+    from borrowing.models import BorrowTransaction
+
+    series = defaultdict(lambda: [0] * weeks)
+    rows = BorrowTransaction.objects.filter(
+        borrowed_at__gte=start, borrowed_at__lt=start + timedelta(weeks=weeks)
+    ).order_by().values_list(
+        'book_copy__book_id', 'book_copy__branch_id', TruncDate('borrowed_at')
+    ).annotate(checkouts=Count('id'))
+    for book_id, branch_id, day, checkouts in rows.iterator():
+        series[(book_id, branch_id)][(day - start.date()).days // 7] += checkouts
+    return series
+
+
+def trend_forecast(series, horizon_days):
+    """
+    Forecast checkouts over the next ``horizon_days`` for each row of
+    ``series`` (equal-length weekly counts) by fitting a least-squares line
+    per row and taking its value at the middle of the horizon, floored at 0.
+    """
+    if not series:
+        return []
+    weeks = len(series[0])
+    horizon_weeks = horizon_days / 7
+    ahead = (weeks - 1) / 2 + (horizon_weeks + 1) / 2
+
+    if np is not None:
+        y = np.asarray(series, dtype=float)
+        t = np.arange(weeks) - (weeks - 1) / 2
+        denominator = float(t @ t) or 1.0
+        slope = (y @ t) / denominator
+        rate = y.mean(axis=1) + slope * ahead
+        return (np.maximum(rate, 0) * horizon_weeks).tolist()
+
+    t = [week - (weeks - 1) / 2 for week in range(weeks)]
+    denominator = sum(x * x for x in t) or 1.0
+    forecasts = []
+    for row in series:
+        slope = sum(x * y for x, y in zip(t, row)) / denominator
+        rate = sum(row) / weeks + slope * ahead
+        forecasts.append(max(rate, 0) * horizon_weeks)
+    return forecasts
+
+
+def forecast_demand(weeks=12, horizon_days=30, now=None):
+    """
+    Ranked purchase suggestions per book and branch.
+
+    Demand over the horizon is the trend forecast of checkouts plus the holds
+    already waiting; supply is the circulating copies times the loans each
+    can serve in that time. Rows are sorted by demand-to-supply ratio.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    start_day = today - timedelta(days=today.weekday()) - timedelta(weeks=weeks)
+    start = timezone.make_aware(datetime.combine(start_day, time.min), timezone.get_current_timezone())
+
+    holds = {
+        (row['book_id'], row['branch_id']): row['holds']
+        for row in BookReservation.objects.filter(status='active').order_by()
+        .values('book_id', 'branch_id').annotate(holds=Count('id')).iterator()
+    }
+    copies = {
+        (row['book_id'], row['branch_id']): row['available'] + row['borrowed'] + row['reserved']
+        for row in BookBranchAvailability.objects.values('book_id', 'branch_id', 'available', 'borrowed', 'reserved').iterator()
+    }
+    series = _weekly_checkouts(start, weeks)
+    keys = sorted(set(holds) | set(series))
+    if not keys:
+        return []
+
+    forecasts = trend_forecast([series[key] if key in series else [0] * weeks for key in keys], horizon_days)
+
+    per_book, per_category = loan_length_averages()
+    books = Book.objects.in_bulk({book_id for book_id, _ in keys})
+    branches = LibraryBranch.objects.in_bulk({branch_id for _, branch_id in keys})
+
+    report = []
+    for (book_id, branch_id), forecast in zip(keys, forecasts):
+        book = books[book_id]
+        loans, avg_days = per_book.get(book_id, (0, None))
+        if loans < MIN_LOAN_SAMPLES:
+            avg_days = per_category.get(book.category_id, (0, None))[1] or avg_days
+        avg_days = max(avg_days or _default_loan_days(), 1)
+
+        copy_count = copies.get((book_id, branch_id), 0)
+        hold_count = holds.get((book_id, branch_id), 0)
+        demand = forecast + hold_count
+        capacity = copy_count * horizon_days / avg_days
+        needed = math.ceil(demand * avg_days / horizon_days) if demand else 0
+        report.append({
+            'book': book,
+            'branch': branches.get(branch_id),
+            'copies': copy_count,
+            'active_holds': hold_count,
+            'hold_ratio': round(hold_count / copy_count if copy_count else float(hold_count), 2),
+            'avg_loan_days': round(avg_days, 1),
+            'expected_wait_days': round(hold_count * avg_days / copy_count, 1) if copy_count else None,
+            'forecast_checkouts': round(forecast, 1),
+            'forecast_demand': round(demand, 1),
+            'demand_ratio': round(demand / capacity if capacity else float(demand), 2),
+            'suggested_copies': max(needed - copy_count, 0),
+        })
+
+    report.sort(key=lambda row: (-row['demand_ratio'], -row['suggested_copies'], row['book'].title))
+    return report
@@ -0,0 +1,271 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import BookCopy, BookReservation
+
+# 'priority' sorts before 'regular', so ordering by type serves priority holds
+# first; ties are served first in, first out. Matches reservation_queue_idx.
+QUEUE_ORDER = [F('reservation_type').asc(), F('reserved_at').asc(), F('id').asc()]
+
+
+def get_pickup_deadline(now=None):
+    """Expiry of a hold whose copy is ready for pickup."""
+    hours = getattr(settings, 'LIBRARY_SETTINGS', {}).get('RESERVATION_EXPIRY_HOURS', 24)
+    return (now or timezone.now()) + timedelta(hours=hours)
+
+
+def get_queue_expiry(now=None):
+    """Expiry of a hold still waiting in the queue; reset to the pickup deadline once a copy is ready."""
+    days = getattr(settings, 'LIBRARY_SETTINGS', {}).get('HOLD_QUEUE_EXPIRY_DAYS', 90)
+    return (now or timezone.now()) + timedelta(days=days)
+
+
+def waiting_holds(book_id, branch_id):
+    """Active holds on the book at the branch that are still waiting for a copy, in service order."""
+    return BookReservation.objects.filter(
+        book_id=book_id, branch_id=branch_id, status='active', held_copy__isnull=True
+    ).order_by(*QUEUE_ORDER)
+
+
+def _claim(reservation_id, copy, now):
+    # Conditional UPDATE: only one transaction can move a hold from waiting to ready
+    return BookReservation.objects.filter(
+        pk=reservation_id, status='active', held_copy__isnull=True
+    ).update(held_copy=copy, ready_at=now, expires_at=get_pickup_deadline(now))
+
+
+def _hold_ready(reservation, copy):
+    from borrowing.events import record_event
+
+    record_event(
+        'hold_ready',
+        user=reservation.user,
+        book=copy.book,
+        branch=copy.branch,
+        reservation_id=reservation.pk,
+        book_copy_id=copy.id,
+    )
+    transaction.on_commit(lambda: notify_hold_ready(reservation.pk))
+
+
+def allocate_copy(copy, now=None):
+    """
+    Hands ``copy``, which has just come back, to the head of its hold queue.
+
+    The copy is set to ``reserved`` for that patron, or to ``available`` when
+    nobody is waiting. Returns the reservation that received it, if any. Call
+    it inside the transaction that frees the copy; the patron is notified
+    once that transaction commits.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        # Serialises allocations of the same copy
+        locked = BookCopy.objects.select_for_update().select_related('book', 'branch').get(pk=copy.pk)
+        if locked.holds.filter(status='active').exists():
+            return None
+
+        reservation = None
+        while True:
+            head = waiting_holds(locked.book_id, locked.branch_id).select_related('user').first()
+            if head is None:
+                break
+            # Another return may have claimed this hold first; try the next one
+            if _claim(head.pk, locked, now):
+                reservation = head
+                break
+
+        copy.status = 'reserved' if reservation else 'available'
+        BookCopy.objects.filter(pk=copy.pk).update(status=copy.status)
+        if reservation is None:
+            return None
+        _hold_ready(reservation, locked)
+
+    reservation.refresh_from_db()
+    return reservation
+
+
+def hold_available_copy(reservation, now=None):
+    """
+    Sets aside an available copy for a new ``reservation`` at its branch.
+    Returns the copy, or None when the reservation has to wait in the queue.
+    A reservation a concurrent return has already served (or that has been
+    closed meanwhile) keeps what it has: its held copy, or None.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        for copy in BookCopy.objects.filter(
+            book_id=reservation.book_id, branch_id=reservation.branch_id, status='available'
+        ).select_related('book', 'branch'):
+            # Conditional UPDATE so a concurrent checkout cannot take the same copy
+            if not BookCopy.objects.filter(pk=copy.pk, status='available').update(status='reserved'):
+                continue
+            if not _claim(reservation.pk, copy, now):
+                # No longer waiting; put the copy back on the shelf
+                BookCopy.objects.filter(pk=copy.pk).update(status='available')
+                reservation.refresh_from_db()
+                return reservation.held_copy if reservation.status == 'active' else None
+            _hold_ready(reservation, copy)
+            reservation.refresh_from_db()
+            return copy
+    return None
+
+
+def held_copy_for(user, book):
+    """Copy currently set aside for ``user`` on ``book``, if any."""
+    reservation = BookReservation.objects.filter(
+        user=user, book=book, status='active', held_copy__isnull=False
+    ).select_related('held_copy__book', 'held_copy__branch').first()
+    return reservation.held_copy if reservation else None
+
+
+def fulfil_hold(user, copy, now=None):
+    """Marks the hold that set ``copy`` aside for ``user`` as fulfilled on checkout."""
+    from borrowing.summaries import reservations_changed
+
+    fulfilled = BookReservation.objects.filter(user=user, held_copy=copy, status='active').update(
+        status='fulfilled', fulfilled_at=now or timezone.now()
+    )
+    reservations_changed({user.pk: -fulfilled})
+    return fulfilled
+
+
+def release_hold(reservation):
+    """Passes the copy held for a cancelled or expired ``reservation`` on to the next hold."""
+    if reservation.held_copy_id is None:
+        return None
+    return allocate_copy(reservation.held_copy)
+
+
+def reallocate_copies(copy_ids, now=None):
+    """
+    Bulk variant of ``allocate_copy`` for copies whose holds have closed.
+
+    Waiting holds for all affected queues are read with one window query and
+    paired with the copies in queue order; copies nobody is waiting for are
+    made available with one UPDATE. Returns the number of copies passed on.
+    Call it inside a transaction.
+    """
+    now = now or timezone.now()
+    copies = list(
+        BookCopy.objects.select_for_update().filter(pk__in=copy_ids, status='reserved')
+        .exclude(holds__status='active').select_related('book', 'branch')
+    )
+    if not copies:
+        return 0
+
+    by_queue = defaultdict(list)
+    for copy in copies:
+        by_queue[(copy.book_id, copy.branch_id)].append(copy)
+
+    heads = defaultdict(list)
+    ranked = BookReservation.objects.filter(
+        status='active', held_copy__isnull=True, book_id__in={book_id for book_id, _ in by_queue}
+    ).annotate(
+        position=Window(RowNumber(), partition_by=[F('book_id'), F('branch_id')], order_by=QUEUE_ORDER)
+    ).filter(position__lte=max(len(group) for group in by_queue.values())).select_related('user')
+    for reservation in ranked.order_by('position'):
+        heads[(reservation.book_id, reservation.branch_id)].append(reservation)
+
+    passed_on, released = 0, []
+    for queue, group in by_queue.items():
+        waiting = iter(heads.get(queue, []))
+        for copy in group:
+            for reservation in waiting:
+                # A concurrent return may already have served this hold
+                if _claim(reservation.pk, copy, now):
+                    _hold_ready(reservation, copy)
+                    passed_on += 1
+                    break
+            else:
+                released.append(copy.pk)
+
+    BookCopy.objects.filter(pk__in=released).update(status='available')
+    return passed_on
+
+
+def expire_holds(now=None):
+    """
+    Moves every active hold past its ``expires_at`` to ``expired`` with one
+    UPDATE, records a ``hold_expired`` event per hold and passes the copies
+    they held to the next hold in line (or back to the shelf).
+
+    Rows are locked with SKIP LOCKED where the database supports it and the
+    UPDATE re-checks the status, so overlapping runs never expire the same
+    hold twice. Returns ``(expired, passed_on)``.
+    """
+    from borrowing.events import record_events
+    from borrowing.summaries import reservations_changed
+
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = list(
+            BookReservation.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(status='active', expires_at__lt=now)
+            .select_related('user', 'book', 'branch')
+        )
+        if not due:
+            return 0, 0
+
+        BookReservation.objects.filter(
+            pk__in=[r.pk for r in due], status='active'
+        ).update(status='expired')
+
+        record_events('hold_expired', [
+            {
+                'user': r.user,
+                'book': r.book,
+                'branch': r.branch,
+                'occurred_at': now,
+                'reservation_id': r.pk,
+                'book_copy_id': r.held_copy_id,
+            }
+            for r in due
+        ])
+        reservations_changed({user_id: -n for user_id, n in Counter(r.user_id for r in due).items()})
+        passed_on = reallocate_copies([r.held_copy_id for r in due if r.held_copy_id], now=now)
+
+    return len(due), passed_on
+
+
+def queue_positions(reservations):
+    """
+    Maps the id of each waiting reservation in ``reservations`` to its
+    1-based position in its book and branch queue, using one window query.
+    """
+    waiting = {r.id: r.book_id for r in reservations if r.status == 'active' and r.held_copy_id is None}
+    if not waiting:
+        return {}
+
+    ranked = BookReservation.objects.filter(
+        status='active', held_copy__isnull=True, book_id__in=set(waiting.values())
+    ).annotate(
+        position=Window(RowNumber(), partition_by=[F('book_id'), F('branch_id')], order_by=QUEUE_ORDER)
+    ).values_list('id', 'position')
+    return {pk: position for pk, position in ranked if pk in waiting}
+
+
+def notify_hold_ready(reservation_id):
+    reservation = BookReservation.objects.select_related(
+        'user', 'user__profile', 'book', 'branch', 'held_copy'
+    ).get(pk=reservation_id)
+    user = reservation.user
+    profile = getattr(user, 'profile', None)
+    if not user.email or (profile is not None and not profile.wants_notification('email')):
+        return False
+
+    body = render_to_string('books/email/hold_ready.txt', {'reservation': reservation, 'name': user.full_name})
+    message = EmailMessage(
+        subject=f'Library hold ready: {reservation.book.title}',
+        body=body,
+        from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', None),
+        to=[user.email],
+    )
+    return bool(message.send(fail_silently=True))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from books.holds import expire_holds
+from books.models import BookReservation
+
+
+class Command(BaseCommand):
+    help = 'Expire reservations past their deadline and pass held copies to the next hold in line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many reservations would expire')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+
+        if options['dry_run']:
+            pending = BookReservation.objects.filter(status='active', expires_at__lt=now).count()
+            self.stdout.write(f'{pending} reservation(s) would expire')
+            return
+
+        expired, passed_on = expire_holds(now=now)
+        self.stdout.write(self.style.SUCCESS(
+            f'Expired {expired} reservation(s); {passed_on} held cop{"y" if passed_on == 1 else "ies"} passed to the next hold'
+        ))
@@ -249,14 +249,12 @@ class Command(BaseCommand):
                 # Create multiple copies of each book
                 for i in range(random.randint(2, 5)):
                     copy_number = f"{book.isbn}-{i+1:03d}"
-                    barcode = f"BC{book.isbn}{i+1:03d}"
                     book_copy, created = BookCopy.objects.get_or_create(
                         book=book,
                         copy_number=copy_number,
                         defaults={
                             'branch': branch,
                             'section': sections[random.choice(['Fiction', 'Science', 'History', 'Children'])],
-                            'barcode': barcode,
                             'status': 'available',
                             'condition': random.choice(['excellent', 'good', 'fair']),
                             'acquisition_date': date(2020 + random.randint(0, 4), random.randint(1, 12), random.randint(1, 28)),
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from books.models import BookBranchAvailability
+
+
+class Command(BaseCommand):
+    help = 'Recompute the book x branch availability matrix from the book copies'
+
+    def handle(self, *args, **options):
+        rows = BookBranchAvailability.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt availability for {rows} book/branch pair(s)'))
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0001_initial'),
+        ('library_branches', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='bookreservation',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='bookreservation',
+            name='held_copy',
+            field=models.ForeignKey(blank=True, help_text='Copy set aside for pickup', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='holds', to='books.bookcopy'),
+        ),
+        migrations.AddField(
+            model_name='bookreservation',
+            name='ready_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='bookreservation',
+            index=models.Index(fields=['book', 'branch', 'status', 'reservation_type', 'reserved_at'], name='reservation_queue_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookreservation',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'active')), fields=('user', 'book'), name='unique_active_reservation'),
+        ),
+    ]
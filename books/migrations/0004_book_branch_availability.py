@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_availability(apps, schema_editor):
+    BookCopy = apps.get_model('books', 'BookCopy')
+    BookBranchAvailability = apps.get_model('books', 'BookBranchAvailability')
+    rows = BookCopy.objects.order_by().values('book_id', 'branch_id').annotate(
+        total=Count('id'),
+        available=Count('id', filter=Q(status='available')),
+        borrowed=Count('id', filter=Q(status='borrowed')),
+        reserved=Count('id', filter=Q(status='reserved')),
+    )
+    BookBranchAvailability.objects.bulk_create(
+        [BookBranchAvailability(**row) for row in rows], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_reservation_expiry_index'),
+        ('library_branches', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookBranchAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('available', models.PositiveIntegerField(default=0)),
+                ('borrowed', models.PositiveIntegerField(default=0)),
+                ('reserved', models.PositiveIntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='branch_availability', to='books.book')),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='book_availability', to='library_branches.librarybranch')),
+            ],
+            options={
+                'verbose_name': 'Book Branch Availability',
+                'verbose_name_plural': 'Book Branch Availability',
+                'indexes': [models.Index(fields=['book', '-available'], name='availability_book_idx')],
+                'unique_together': {('book', 'branch')},
+            },
+        ),
+        migrations.RunPython(backfill_availability, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_branch_availability'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookcopy',
+            name='barcode',
+            field=models.CharField(blank=True, help_text='Leave blank to generate one', max_length=100, unique=True),
+        ),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, Q
 from django.core.validators import RegexValidator
 from django.conf import settings
 from decimal import Decimal
@@ -125,6 +126,40 @@ class Book(models.Model):
     def total_copies_count(self):
         return self.book_copies.count()
 
+class BookCopyQuerySet(models.QuerySet):
+    """Keeps BookBranchAvailability current for bulk creates, status changes and deletes."""
+
+    def update(self, **kwargs):
+        if not {'status', 'book', 'book_id', 'branch', 'branch_id'} & set(kwargs):
+            return super().update(**kwargs)
+        with transaction.atomic():
+            before = list(self.values_list('pk', 'book_id', 'branch_id'))
+            rows = super().update(**kwargs)
+            pairs = {(book_id, branch_id) for _, book_id, branch_id in before}
+            if {'book', 'book_id', 'branch', 'branch_id'} & set(kwargs):
+                # Copies moved: their new book/branch pairs change too
+                pairs |= set(self.model.objects.filter(
+                    pk__in=[pk for pk, _, _ in before]
+                ).values_list('book_id', 'branch_id'))
+            BookBranchAvailability.refresh(pairs)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from accounts.sequences import assign
+
+        objs = assign('copy_barcode', list(objs), 'barcode')
+        with transaction.atomic():
+            created = super().bulk_create(objs, *args, **kwargs)
+            BookBranchAvailability.refresh({(obj.book_id, obj.branch_id) for obj in objs})
+        return created
+
+    def delete(self):
+        with transaction.atomic():
+            pairs = set(self.values_list('book_id', 'branch_id'))
+            result = super().delete()
+            BookBranchAvailability.refresh(pairs)
+        return result
+
 class BookCopy(models.Model):
     STATUS_CHOICES = [
         ('available', 'Available'),
@@ -147,13 +182,15 @@ class BookCopy(models.Model):
     branch = models.ForeignKey('library_branches.LibraryBranch', on_delete=models.CASCADE, related_name='book_copies')
     section = models.ForeignKey('library_branches.LibrarySection', on_delete=models.SET_NULL, blank=True, null=True, related_name='book_copies')
     copy_number = models.CharField(max_length=50)
-    barcode = models.CharField(max_length=100, unique=True)
+    barcode = models.CharField(max_length=100, unique=True, blank=True, help_text="Leave blank to generate one")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='available')
     condition = models.CharField(max_length=20, choices=CONDITION_CHOICES, default='good')
     acquisition_date = models.DateField()
     last_maintenance_date = models.DateField(blank=True, null=True)
     notes = models.TextField(blank=True)
 
+    objects = BookCopyQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Book Copy'
         verbose_name_plural = 'Book Copies'
@@ -163,10 +200,125 @@ class BookCopy(models.Model):
     def __str__(self):
         return f"{self.book.title} - Copy {self.copy_number} ({self.branch.name})"
 
+    def save(self, *args, **kwargs):
+        if not self.barcode:
+            from accounts.sequences import next_value
+            self.barcode = next_value('copy_barcode')
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = BookCopy.objects.filter(pk=self.pk).values_list('book_id', 'branch_id', 'status').first()
+            super().save(*args, **kwargs)
+            # Only status, book or branch changes move the availability counts
+            if previous != (self.book_id, self.branch_id, self.status):
+                pairs = {(self.book_id, self.branch_id)}
+                if previous:
+                    pairs.add(previous[:2])
+                BookBranchAvailability.refresh(pairs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            BookBranchAvailability.refresh({(self.book_id, self.branch_id)})
+        return result
+
     @property
     def is_available(self):
         return self.status == 'available'
 
+def _pairs_filter(pairs):
+    condition = Q()
+    for book_id, branch_id in pairs:
+        condition |= Q(book_id=book_id, branch_id=branch_id)
+    return condition
+
+class BookBranchAvailability(models.Model):
+    """
+    Copy counts per book and branch. Recounted under a row lock whenever a
+    copy's status, book or branch changes, so reads never have to aggregate
+    BookCopy.
+    """
+    COUNT_FIELDS = ['total', 'available', 'borrowed', 'reserved']
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='branch_availability')
+    branch = models.ForeignKey('library_branches.LibraryBranch', on_delete=models.CASCADE, related_name='book_availability')
+    total = models.PositiveIntegerField(default=0)
+    available = models.PositiveIntegerField(default=0)
+    borrowed = models.PositiveIntegerField(default=0)
+    reserved = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Book Branch Availability'
+        verbose_name_plural = 'Book Branch Availability'
+        unique_together = [['book', 'branch']]
+        indexes = [
+            models.Index(fields=['book', '-available'], name='availability_book_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id}@{self.branch_id}: {self.available}/{self.total} available"
+
+    @property
+    def unavailable(self):
+        """Copies under maintenance, damaged or lost."""
+        return self.total - self.available - self.borrowed - self.reserved
+
+    @classmethod
+    def counts(cls, copies):
+        """Per (book_id, branch_id) counts for ``copies`` with one grouped query."""
+        rows = copies.order_by().values('book_id', 'branch_id').annotate(
+            total=Count('id'),
+            available=Count('id', filter=Q(status='available')),
+            borrowed=Count('id', filter=Q(status='borrowed')),
+            reserved=Count('id', filter=Q(status='reserved')),
+        )
+        return {(row.pop('book_id'), row.pop('branch_id')): row for row in rows}
+
+    @classmethod
+    def _locked(cls, pairs):
+        # A fixed lock order, so writers touching several pairs cannot deadlock
+        rows = cls.objects.select_for_update().filter(_pairs_filter(pairs)).order_by('book_id', 'branch_id')
+        return {(row.book_id, row.branch_id): row for row in rows}
+
+    @classmethod
+    def refresh(cls, pairs):
+        """
+        Recounts the given (book_id, branch_id) pairs. Their rows are created
+        if missing and locked before the recount: under READ COMMITTED a
+        recount cannot see another writer's uncommitted change, so writers of
+        the same pair have to take turns for the last one to count both.
+        """
+        pairs = {pair for pair in pairs if None not in pair}
+        if not pairs:
+            return
+        with transaction.atomic():
+            rows = cls._locked(pairs)
+            missing = pairs - rows.keys()
+            if missing:
+                cls.objects.bulk_create(
+                    [cls(book_id=book_id, branch_id=branch_id) for book_id, branch_id in missing],
+                    ignore_conflicts=True,
+                )
+                rows.update(cls._locked(missing))
+            counts = cls.counts(BookCopy.objects.filter(_pairs_filter(pairs)))
+            empty = dict.fromkeys(cls.COUNT_FIELDS, 0)
+            for pair, row in rows.items():
+                for field, value in counts.get(pair, empty).items():
+                    setattr(row, field, value)
+            cls.objects.bulk_update(rows.values(), cls.COUNT_FIELDS)
+
+    @classmethod
+    def rebuild(cls):
+        """Recomputes the whole matrix from BookCopy. Returns the number of rows."""
+        counts = cls.counts(BookCopy.objects.all())
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(
+                [cls(book_id=book_id, branch_id=branch_id, **row) for (book_id, branch_id), row in counts.items()],
+                batch_size=1000,
+            )
+        return len(counts)
+
 class BookReservation(models.Model):
     RESERVATION_TYPE_CHOICES = [
         ('regular', 'Regular Reservation'),
@@ -187,13 +339,26 @@ class BookReservation(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     reserved_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
+    held_copy = models.ForeignKey(BookCopy, on_delete=models.SET_NULL, blank=True, null=True, related_name='holds', help_text="Copy set aside for pickup")
+    ready_at = models.DateTimeField(blank=True, null=True)
     fulfilled_at = models.DateTimeField(blank=True, null=True)
     cancelled_at = models.DateTimeField(blank=True, null=True)
     notes = models.TextField(blank=True)
 
     class Meta:
         ordering = ['reserved_at']
-        unique_together = [['user', 'book', 'status']]
+        constraints = [
+            # Members may reserve a book again once an earlier hold has closed
+            models.UniqueConstraint(
+                fields=['user', 'book'], condition=models.Q(status='active'), name='unique_active_reservation'
+            ),
+        ]
+        indexes = [
+            # Hold queue scan: priority holds first, then oldest first
+            models.Index(fields=['book', 'branch', 'status', 'reservation_type', 'reserved_at'], name='reservation_queue_idx'),
+            # Expiry sweep
+            models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.book.title} ({self.status})"
@@ -202,6 +367,10 @@ class BookReservation(models.Model):
     def is_active(self):
         return self.status == 'active'
 
+    @property
+    def is_ready(self):
+        return self.status == 'active' and self.held_copy_id is not None
+
     @property
     def is_expired(self):
         from django.utils import timezone
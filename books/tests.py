@@ -1,3 +1,261 @@
+from datetime import date, timedelta
+from unittest import mock
+
+from django.core import mail
 from django.test import TestCase
+from django.utils import timezone
+
+from accounts.models import User
+from borrowing.models import BorrowTransaction, CirculationEvent
+from library_branches.models import LibraryBranch
+from . import forecasting
+from .holds import allocate_copy, expire_holds, fulfil_hold, hold_available_copy, queue_positions, release_hold
+from .models import Book, BookBranchAvailability, BookCopy, BookReservation
+
+
+def make_branch(code='MAIN'):
+    return LibraryBranch.objects.create(
+        name=f'{code} branch', code=code, address='1 Main Street', phone_number='+9601234567',
+        email=f'{code.lower()}@library.example', manager_name='Manager',
+        established_date=date(2020, 1, 1), total_capacity=1000,
+    )
+
+
+def make_book(title='Book'):
+    return Book.objects.create(
+        isbn=f'978{Book.objects.count():010d}', title=title, publication_date=date(2000, 1, 1), pages=100,
+    )
+
+
+def make_member(username):
+    return User.objects.create_user(username=username, password='pw', email=f'{username}@example.com', user_type='member')
+
+
+def make_copies(book, branch, count, status='available'):
+    start = BookCopy.objects.filter(book=book, branch=branch).count()
+    return [
+        BookCopy.objects.create(
+            book=book, branch=branch, copy_number=str(start + n + 1), status=status, acquisition_date=date(2020, 1, 1),
+        )
+        for n in range(count)
+    ]
+
+
+class AvailabilityMatrixTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.main = make_branch('MAIN')
+        cls.east = make_branch('EAST')
+        cls.book = make_book('Matrix')
+        cls.other_book = make_book('Other')
+
+    def assertMatchesCopies(self):
+        stored = {
+            (row['book_id'], row['branch_id']): {field: row[field] for field in BookBranchAvailability.COUNT_FIELDS}
+            for row in BookBranchAvailability.objects.filter(total__gt=0).values()
+        }
+        self.assertEqual(stored, BookBranchAvailability.counts(BookCopy.objects.all()))
+
+    def test_status_changes_move_the_counts(self):
+        copies = make_copies(self.book, self.main, 3) + make_copies(self.book, self.east, 2)
+        make_copies(self.other_book, self.main, 1)
+        self.assertMatchesCopies()
+
+        for copy, status in zip(copies, ['borrowed', 'reserved', 'lost', 'borrowed', 'maintenance']):
+            copy.status = status
+            copy.save()
+            self.assertMatchesCopies()
+
+        row = BookBranchAvailability.objects.get(book=self.book, branch=self.main)
+        self.assertEqual((row.total, row.available, row.borrowed, row.reserved, row.unavailable), (3, 0, 1, 1, 1))
+
+    def test_bulk_updates_moves_and_deletes(self):
+        copies = make_copies(self.book, self.main, 4)
+        BookCopy.objects.filter(pk__in=[copy.pk for copy in copies[:2]]).update(status='borrowed')
+        self.assertMatchesCopies()
+
+        BookCopy.objects.filter(pk=copies[2].pk).update(branch=self.east)
+        self.assertMatchesCopies()
+
+        copies[3].delete()
+        BookCopy.objects.filter(branch=self.main, status='borrowed').delete()
+        self.assertMatchesCopies()
+        self.assertEqual(BookBranchAvailability.objects.get(book=self.book, branch=self.main).total, 0)
+
+    def test_refresh_creates_missing_rows(self):
+        make_copies(self.book, self.main, 2)
+        BookBranchAvailability.objects.all().delete()
+        BookBranchAvailability.refresh({(self.book.pk, self.main.pk), (self.other_book.pk, self.east.pk)})
+        self.assertMatchesCopies()
+        self.assertEqual(BookBranchAvailability.objects.get(book=self.other_book, branch=self.east).total, 0)
+
+    def test_rebuild(self):
+        make_copies(self.book, self.main, 2, status='borrowed')
+        make_copies(self.other_book, self.east, 1)
+        BookBranchAvailability.objects.update(available=7)
+        self.assertEqual(BookBranchAvailability.rebuild(), 2)
+        self.assertMatchesCopies()
+
+
+class HoldQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = make_branch()
+        cls.book = make_book('Popular')
+        cls.members = [make_member(f'patron{n}') for n in range(3)]
+
+    def hold(self, member, reservation_type='regular'):
+        return BookReservation.objects.create(
+            user=member, book=self.book, branch=self.branch, reservation_type=reservation_type,
+            expires_at=timezone.now() + timedelta(days=90),
+        )
+
+    def test_priority_holds_then_oldest_first(self):
+        first = self.hold(self.members[0])
+        priority = self.hold(self.members[1], 'priority')
+        last = self.hold(self.members[2])
+        copies = make_copies(self.book, self.branch, 2, status='borrowed')
+        self.assertEqual(queue_positions([first, priority, last]), {priority.pk: 1, first.pk: 2, last.pk: 3})
+
+        self.assertEqual(allocate_copy(copies[0]), priority)
+        self.assertEqual(allocate_copy(copies[1]), first)
+
+        self.assertEqual(
+            dict(BookReservation.objects.filter(held_copy__isnull=False).values_list('pk', 'held_copy')),
+            {priority.pk: copies[0].pk, first.pk: copies[1].pk},
+        )
+        self.assertEqual(set(BookCopy.objects.values_list('status', flat=True)), {'reserved'})
+        last.refresh_from_db()
+        self.assertEqual(queue_positions([last]), {last.pk: 1})
+
+    def test_copy_nobody_waits_for_goes_back_on_the_shelf(self):
+        copy = make_copies(self.book, self.branch, 1, status='borrowed')[0]
+        self.assertIsNone(allocate_copy(copy))
+        copy.refresh_from_db()
+        self.assertEqual(copy.status, 'available')
+
+    def test_allocating_a_held_copy_again_changes_nothing(self):
+        reservation = self.hold(self.members[0])
+        self.hold(self.members[1])
+        copy = make_copies(self.book, self.branch, 1, status='borrowed')[0]
+        allocate_copy(copy)
+        self.assertIsNone(allocate_copy(copy))
+        self.assertEqual(BookReservation.objects.get(held_copy=copy), reservation)
+
+    def test_new_hold_takes_an_available_copy(self):
+        copy = make_copies(self.book, self.branch, 1)[0]
+        first = self.hold(self.members[0])
+        self.assertEqual(hold_available_copy(first), copy)
+        self.assertIsNone(hold_available_copy(self.hold(self.members[1])))
+        copy.refresh_from_db()
+        self.assertEqual(copy.status, 'reserved')
+
+    def test_patron_is_told_once_the_hold_commits(self):
+        self.hold(self.members[0])
+        copy = make_copies(self.book, self.branch, 1, status='borrowed')[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            allocate_copy(copy)
+        self.assertEqual([message.to for message in mail.outbox], [[self.members[0].email]])
+
+    def test_cancelled_hold_passes_its_copy_on(self):
+        first, second = self.hold(self.members[0]), self.hold(self.members[1])
+        copy = make_copies(self.book, self.branch, 1, status='borrowed')[0]
+        allocate_copy(copy)
+        first.refresh_from_db()
+        BookReservation.objects.filter(pk=first.pk).update(status='cancelled')
+
+        self.assertEqual(release_hold(first), second)
+        self.assertEqual(fulfil_hold(self.members[1], copy), 1)
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'fulfilled')
+
+
+class HoldExpiryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = make_branch()
+        cls.book = make_book('Popular')
+        cls.members = [make_member(f'patron{n}') for n in range(3)]
+
+    def hold(self, member, hours_left):
+        return BookReservation.objects.create(
+            user=member, book=self.book, branch=self.branch, expires_at=timezone.now() + timedelta(hours=hours_left),
+        )
+
+    def test_expired_pickup_passes_the_copy_to_the_next_hold(self):
+        uncollected = self.hold(self.members[0], 48)
+        waiting = self.hold(self.members[1], 48)
+        copy = make_copies(self.book, self.branch, 1, status='borrowed')[0]
+        allocate_copy(copy)
+        BookReservation.objects.filter(pk=uncollected.pk).update(expires_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(expire_holds(), (1, 1))
+        self.assertEqual(BookReservation.objects.get(pk=uncollected.pk).status, 'expired')
+        waiting.refresh_from_db()
+        self.assertEqual((waiting.status, waiting.held_copy), ('active', copy))
+        self.assertGreater(waiting.expires_at, timezone.now())
+
+    def test_copy_nobody_waits_for_is_made_available(self):
+        reservation = self.hold(self.members[0], 48)
+        copy = make_copies(self.book, self.branch, 1)[0]
+        hold_available_copy(reservation)
+
+        self.assertEqual(expire_holds(now=timezone.now() + timedelta(days=3)), (1, 0))
+        copy.refresh_from_db()
+        self.assertEqual(copy.status, 'available')
+
+    def test_rerun_expires_nothing_twice(self):
+        self.hold(self.members[0], -1)
+        self.hold(self.members[1], -2)
+        self.hold(self.members[2], 5)
+
+        self.assertEqual(expire_holds(), (2, 0))
+        self.assertEqual(expire_holds(), (0, 0))
+        self.assertEqual(BookReservation.objects.filter(status='active').count(), 1)
+        self.assertEqual(CirculationEvent.objects.filter(event_type='hold_expired').count(), 2)
+
+
+class DemandForecastTests(TestCase):
+    def test_trend_forecast(self):
+        with mock.patch.object(forecasting, 'np', None):
+            flat, rising, falling = forecasting.trend_forecast([[2, 2, 2, 2], [1, 2, 3, 4], [6, 4, 2, 0]], 14)
+        self.assertAlmostEqual(flat, 4.0)
+        # Weeks 5 and 6 continue the line at 5 and 6 checkouts
+        self.assertAlmostEqual(rising, 11.0)
+        self.assertEqual(falling, 0)
+        self.assertEqual(forecasting.trend_forecast([], 30), [])
+
+    def test_numpy_and_python_agree(self):
+        if forecasting.np is None:
+            self.skipTest('numpy is not installed')
+        series = [[0, 3, 1, 5, 2, 7], [4, 4, 3, 1, 0, 0]]
+        with mock.patch.object(forecasting, 'np', None):
+            expected = forecasting.trend_forecast(series, 30)
+        for value, reference in zip(forecasting.trend_forecast(series, 30), expected):
+            self.assertAlmostEqual(value, reference)
+
+    def test_titles_with_waiting_holds_rank_first(self):
+        branch = make_branch()
+        quiet, wanted = make_book('Quiet'), make_book('Wanted')
+        make_copies(quiet, branch, 2)
+        copy = make_copies(wanted, branch, 1, status='borrowed')[0]
+        member = make_member('reader')
+        loan = BorrowTransaction.objects.create(
+            user=member, book_copy=copy, due_date=timezone.now() + timedelta(days=7), status='active',
+        )
+        # Only whole weeks before this one are forecast from
+        BorrowTransaction.objects.filter(pk=loan.pk).update(borrowed_at=timezone.now() - timedelta(days=7))
+        for n in range(3):
+            BookReservation.objects.create(
+                user=make_member(f'patron{n}'), book=wanted, branch=branch,
+                expires_at=timezone.now() + timedelta(days=90),
+            )
+
+        with mock.patch.object(forecasting, 'np', None):
+            report = forecasting.forecast_demand(weeks=4, horizon_days=28)
 
-# Create your tests here.
+        self.assertEqual([row['book'] for row in report], [wanted])
+        row = report[0]
+        self.assertEqual((row['copies'], row['active_holds']), (1, 3))
+        self.assertGreater(row['forecast_checkouts'], 0)
+        self.assertGreaterEqual(row['suggested_copies'], 1)
@@ -5,9 +5,15 @@ from django.views.generic import (
     ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView, View
 )
 from django.urls import reverse_lazy
+from django.conf import settings
 from django.db.models import Q, Count, Sum
-from django.db import models
-from .models import Book, BookCopy, BookReservation, Author, Publisher, Category
+from django.db import models, transaction
+from django.utils import timezone
+from .availability import branch_availability, pick_branch
+from borrowing.loan_lengths import estimate_wait
+from borrowing.summaries import reservations_changed
+from .holds import get_queue_expiry, hold_available_copy, queue_positions, release_hold, waiting_holds
+from .models import Book, BookBranchAvailability, BookCopy, BookReservation, Author, Publisher, Category
 from django.urls import reverse_lazy
 from django.db.models import Q, Count, Sum
 from .models import Book, BookCopy, BookReservation, Author, Publisher, Category
@@ -45,6 +51,7 @@ class BookDetailView(DetailView):
         context = super().get_context_data(**kwargs)
         book = self.get_object()
         context['available_copies'] = book.book_copies.filter(status='available')
+        context['branch_availability'] = branch_availability(book)
         context['user_can_reserve'] = (
             self.request.user.is_authenticated and 
             not book.reservations.filter(user=self.request.user, status='active').exists()
@@ -229,9 +236,29 @@ class BookReserveView(LoginRequiredMixin, TemplateView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['book'] = get_object_or_404(Book, id=self.kwargs.get('pk'))
+        book = get_object_or_404(Book, id=self.kwargs.get('pk'))
+        context['book'] = book
+        context['pickup_hours'] = getattr(settings, 'LIBRARY_SETTINGS', {}).get('RESERVATION_EXPIRY_HOURS', 24)
+        
+        branch = self.get_branch(book)
+        if branch:
+            queue_length = waiting_holds(book.id, branch.id).count()
+            context['branch'] = branch
+            context['queue_length'] = queue_length
+            context['wait_estimate'] = estimate_wait(book, branch, queue_length + 1)
         return context
     
+    def get_branch(self, book):
+        from library_branches.models import LibraryBranch
+        
+        # Preferred branch or the one with the most spare copies; books no
+        # branch stocks yet are queued at the preferred or first branch
+        availability = pick_branch(self.request.user, book)
+        if availability:
+            return availability.branch
+        profile = getattr(self.request.user, 'profile', None)
+        return (profile and profile.preferred_branch) or LibraryBranch.objects.first()
+    
     def post(self, request, *args, **kwargs):
         book = get_object_or_404(Book, id=self.kwargs.get('pk'))
         
@@ -246,33 +273,36 @@ class BookReserveView(LoginRequiredMixin, TemplateView):
             messages.error(request, 'You already have an active reservation for this book.')
             return redirect('books:book_detail', pk=book.id)
         
-        # Check if there are available copies
-        available_copies = book.book_copies.filter(status='available').count()
-        if available_copies == 0:
-            messages.error(request, 'No copies available for reservation.')
-            return redirect('books:book_detail', pk=book.id)
-        
-        # Create the reservation
-        from library_branches.models import LibraryBranch
-        from django.utils import timezone
-        from datetime import timedelta
-        
-        # Get the first available branch (since you don't need more than 1 branch)
-        branch = LibraryBranch.objects.first()
+        # Create the reservation; without a free copy it joins the hold queue
+        branch = self.get_branch(book)
         if not branch:
             messages.error(request, 'No library branch available.')
             return redirect('books:book_detail', pk=book.id)
         
-        reservation = BookReservation.objects.create(
-            user=request.user,
-            book=book,
-            branch=branch,
-            reservation_type='regular',
-            status='active',
-            expires_at=timezone.now() + timedelta(days=7)  # 7 days to pick up
-        )
+        with transaction.atomic():
+            # The pickup deadline replaces this once a copy is set aside
+            reservation = BookReservation.objects.create(
+                user=request.user,
+                book=book,
+                branch=branch,
+                reservation_type='regular',
+                status='active',
+                expires_at=get_queue_expiry()
+            )
+            reservations_changed({request.user.pk: 1})
+            held_copy = hold_available_copy(reservation)
         
-        messages.success(request, f'Book "{book.title}" has been reserved successfully!')
+        if held_copy:
+            messages.success(request, f'Book "{book.title}" has been reserved successfully! A copy is waiting for you at {branch.name}.')
+        elif reservation.status != 'active':
+            messages.info(request, f'Your reservation for "{book.title}" was closed while it was being placed.')
+        else:
+            position = queue_positions([reservation]).get(reservation.id)
+            message = f'No copies of "{book.title}" are free right now. You are number {position} in the queue.'
+            estimate = estimate_wait(book, branch, position) if position else None
+            if estimate:
+                message += f' Estimated wait: about {estimate["days"]} days.'
+            messages.success(request, message)
         return redirect('books:reservation_list')
 
 class ReservationListView(LoginRequiredMixin, ListView):
@@ -281,15 +311,27 @@ class ReservationListView(LoginRequiredMixin, ListView):
     context_object_name = 'reservations'
     
     def get_queryset(self):
-        return BookReservation.objects.filter(user=self.request.user)
+        return BookReservation.objects.filter(user=self.request.user).select_related('book', 'branch')
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        positions = queue_positions(context['reservations'])
+        for reservation in context['reservations']:
+            reservation.queue_position = positions.get(reservation.id)
+        return context
 
 class ReservationCancelView(LoginRequiredMixin, View):
     def post(self, request, pk):
         try:
             reservation = get_object_or_404(BookReservation, pk=pk, user=request.user)
             if reservation.status == 'active':
-                reservation.status = 'cancelled'
-                reservation.save()
+                with transaction.atomic():
+                    reservation.status = 'cancelled'
+                    reservation.cancelled_at = timezone.now()
+                    reservation.save()
+                    reservations_changed({request.user.pk: -1})
+                    # A copy held for this reservation goes to the next in line
+                    release_hold(reservation)
                 messages.success(request, f'Reservation for "{reservation.book.title}" has been cancelled.')
             else:
                 messages.error(request, 'This reservation cannot be cancelled.')
@@ -383,32 +425,50 @@ class LibrarianDashboardView(LibrarianRequiredMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         from accounts.models import User
         from borrowing.models import BorrowTransaction
-        from fines.models import Fine
+        from fines.models import FineAccount
         from django.utils import timezone
         from datetime import timedelta
         
+        from borrowing import stats
+        
         # Book statistics
-        context['total_books'] = Book.objects.count()
-        context['active_books'] = Book.objects.filter(is_active=True).count()
-        context['total_copies'] = BookCopy.objects.count()
-        context['available_copies'] = BookCopy.objects.filter(status='available').count()
+        context.update(Book.objects.aggregate(
+            total_books=Count('id'),
+            active_books=Count('id', filter=Q(is_active=True)),
+        ))
+        # Copy counts from the availability matrix rather than BookCopy
+        context.update({
+            key: value or 0 for key, value in BookBranchAvailability.objects.aggregate(
+                total_copies=Sum('total'),
+                available_copies=Sum('available'),
+            ).items()
+        })
         
         # Member statistics
-        context['total_members'] = User.objects.filter(user_type='member').count()
-        context['active_members'] = User.objects.filter(user_type='member', is_active_member=True).count()
+        context.update(User.objects.filter(user_type='member').aggregate(
+            total_members=Count('id'),
+            active_members=Count('id', filter=Q(is_active_member=True)),
+        ))
         
         # Borrowing statistics
-        context['active_borrowings'] = BorrowTransaction.objects.filter(status='active').count()
-        context['overdue_books'] = BorrowTransaction.objects.filter(
-            status='active',
-            due_date__lt=timezone.now().date()
-        ).count()
+        context.update(BorrowTransaction.objects.filter(status='active').with_accrual().aggregate(
+            active_borrowings=Count('id'),
+            overdue_books=Count('id', filter=Q(is_overdue=True)),
+            accrued_fines=Sum('accrued_fine'),
+        ))
+        
+        # Fine statistics from the materialized member balances
+        context.update(FineAccount.objects.filter(outstanding_balance__gt=0).aggregate(
+            unpaid_fines=Count('pk'),
+            total_fine_amount=Sum('outstanding_balance'),
+        ))
+        context['total_fine_amount'] = context['total_fine_amount'] or 0
         
-        # Fine statistics
-        context['unpaid_fines'] = Fine.objects.filter(status='unpaid').count()
-        context['total_fine_amount'] = Fine.objects.filter(status='unpaid').aggregate(
-            total=Sum('amount')
-        )['total'] or 0
+        # Circulation trends, every window from one rollup query
+        overview = stats.overview(30)
+        context['circulation_30_days'] = overview['last_n_days']
+        context['circulation_mtd'] = overview['month_to_date']
+        context['circulation_yoy'] = overview['year_over_year']
         
         # Recent activities
         context['recent_borrowings'] = BorrowTransaction.objects.filter(
@@ -425,7 +485,7 @@ class LibrarianDashboardView(LibrarianRequiredMixin, TemplateView):
             status='active',
             due_date__lte=due_soon_date,
             due_date__gte=timezone.now().date()
-        ).order_by('due_date')[:10].select_related('user', 'book_copy__book')
+        ).with_accrual().order_by('due_date')[:10].select_related('user', 'book_copy__book')
         
         return context
 
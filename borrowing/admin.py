@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import BorrowTransaction, BorrowingHistory, ReturnTransaction
+from .models import (
+    BorrowTransaction, BorrowingHistory, ArchivedBorrowingHistory, ReturnTransaction,
+    CirculationEvent, EventConsumerWatermark, BookCirculationStats, LoanPolicy,
+    LoanLengthHistogram, AccountSummary
+)
 
 @admin.register(BorrowTransaction)
 class BorrowTransactionAdmin(admin.ModelAdmin):
@@ -9,6 +13,10 @@ class BorrowTransactionAdmin(admin.ModelAdmin):
     raw_id_fields = ('user', 'book_copy', 'librarian_issued', 'librarian_returned')
     date_hierarchy = 'borrowed_at'
     readonly_fields = ('borrowed_at', 'is_overdue', 'days_overdue', 'fine_amount')
+    
+    def get_queryset(self, request):
+        # Overdue flags and fines priced in the list query, not per row
+        return super().get_queryset(request).with_accrual()
 
 @admin.register(BorrowingHistory)
 class BorrowingHistoryAdmin(admin.ModelAdmin):
@@ -26,3 +34,57 @@ class ReturnTransactionAdmin(admin.ModelAdmin):
     search_fields = ('borrow_transaction__user__username', 'borrow_transaction__book_copy__book__title')
     raw_id_fields = ('borrow_transaction', 'librarian')
     readonly_fields = ('returned_at', 'total_penalty')
+
+@admin.register(ArchivedBorrowingHistory)
+class ArchivedBorrowingHistoryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'book', 'borrowed_date', 'returned_date', 'fine_paid', 'action', 'archived_at')
+    list_filter = ('action', 'was_overdue')
+    search_fields = ('user__username', 'book__title')
+    raw_id_fields = ('user', 'book', 'branch')
+    readonly_fields = ('original_id', 'archived_at')
+
+@admin.register(CirculationEvent)
+class CirculationEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'event_type', 'occurred_at', 'user', 'book', 'branch', 'amount')
+    list_filter = ('event_type',)
+    search_fields = ('user__username', 'book__title')
+    raw_id_fields = ('user', 'borrow_transaction', 'book', 'branch')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(EventConsumerWatermark)
+class EventConsumerWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('name', 'last_event_id', 'updated_at')
+    readonly_fields = ('updated_at',)
+
+@admin.register(BookCirculationStats)
+class BookCirculationStatsAdmin(admin.ModelAdmin):
+    list_display = ('book', 'checkouts', 'renewals', 'returns', 'lost', 'active_loans', 'last_checkout_at')
+    search_fields = ('book__title',)
+    raw_id_fields = ('book',)
+
+@admin.register(AccountSummary)
+class AccountSummaryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'active_loans', 'active_reservations', 'lifetime_borrows')
+    search_fields = ('user__username',)
+    raw_id_fields = ('user',)
+    readonly_fields = ('lifetime_borrows', 'active_reservations', 'loan_due_dates')
+
+@admin.register(LoanPolicy)
+class LoanPolicyAdmin(admin.ModelAdmin):
+    list_display = ('user_type', 'category', 'book_format', 'loan_days', 'max_renewals', 'max_loans', 'fine_per_day', 'is_active')
+    list_filter = ('user_type', 'book_format', 'is_active')
+    list_editable = ('loan_days', 'max_renewals', 'max_loans', 'fine_per_day', 'is_active')
+
+@admin.register(LoanLengthHistogram)
+class LoanLengthHistogramAdmin(admin.ModelAdmin):
+    list_display = ('book', 'category', 'samples', 'updated_at')
+    raw_id_fields = ('book', 'category')
+    readonly_fields = ('counts', 'samples', 'updated_at')
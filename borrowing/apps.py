@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class BorrowingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'borrowing'
+
+    def ready(self):
+        # Register the built-in circulation event consumers and the loan
+        # policy cache invalidation handlers
+        from . import consumers, policies  # noqa: F401
@@ -0,0 +1,102 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import ArchivedBorrowingHistory, BorrowingHistory
+
+# Columns shared by the hot and archived history tables
+HISTORY_FIELDS = [
+    'user_id', 'book_id', 'branch_id', 'borrowed_date', 'returned_date',
+    'days_borrowed', 'was_overdue', 'fine_paid', 'renewal_count', 'action',
+]
+
+
+def get_archive_cutoff(now=None):
+    """Rows borrowed before this moment belong in the archive."""
+    days = getattr(settings, 'LIBRARY_SETTINGS', {}).get('HISTORY_ARCHIVE_AFTER_DAYS', 730)
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def archive_history(cutoff=None, chunk_size=1000, max_chunks=None):
+    """
+    Moves BorrowingHistory rows older than ``cutoff`` into
+    ArchivedBorrowingHistory, ``chunk_size`` rows per transaction.
+
+    Each chunk is copied and deleted atomically and the copy is keyed on the
+    original id, so an interrupted run simply resumes where it stopped.
+    Returns the number of rows moved.
+    """
+    cutoff = cutoff or get_archive_cutoff()
+    moved = 0
+    chunks = 0
+
+    while max_chunks is None or chunks < max_chunks:
+        with transaction.atomic():
+            rows = list(
+                BorrowingHistory.objects.filter(borrowed_date__lt=cutoff)
+                .order_by('id')
+                .values('id', *HISTORY_FIELDS)[:chunk_size]
+            )
+            if not rows:
+                break
+
+            ids = [row.pop('id') for row in rows]
+            ArchivedBorrowingHistory.objects.bulk_create(
+                [
+                    ArchivedBorrowingHistory(original_id=original_id, **row)
+                    for original_id, row in zip(ids, rows)
+                ],
+                ignore_conflicts=True,
+            )
+            BorrowingHistory.objects.filter(id__in=ids).delete()
+
+        moved += len(ids)
+        chunks += 1
+
+    return moved
+
+
+def _history_values(queryset):
+    # Clear the model's default ordering; it is not allowed inside a UNION
+    return queryset.order_by().values(
+        *HISTORY_FIELDS,
+        book_title=F('book__title'),
+        book_isbn=F('book__isbn'),
+        branch_name=F('branch__name'),
+    )
+
+
+def combined_history(since=None, include_archive=None, **filters):
+    """
+    Returns history rows (as dicts) matching ``filters``, newest first.
+
+    Unless ``include_archive`` says otherwise, the archive table is only
+    consulted when ``since`` is None or reaches back past the archive cutoff;
+    recent periods are served by the hot table alone.
+    """
+    if include_archive is None:
+        include_archive = since is None or since < get_archive_cutoff()
+
+    hot = BorrowingHistory.objects.filter(**filters)
+    if since is not None:
+        hot = hot.filter(borrowed_date__gte=since)
+
+    if not include_archive:
+        return _history_values(hot).order_by('-borrowed_date')
+
+    cold = ArchivedBorrowingHistory.objects.filter(**filters)
+    if since is not None:
+        cold = cold.filter(borrowed_date__gte=since)
+
+    return _history_values(hot).union(_history_values(cold), all=True).order_by('-borrowed_date')
+
+
+def history_count(**filters):
+    """Number of history rows matching ``filters`` across both tables."""
+    return (
+        BorrowingHistory.objects.filter(**filters).count()
+        + ArchivedBorrowingHistory.objects.filter(**filters).count()
+    )
@@ -0,0 +1,73 @@
+from collections import defaultdict
+
+from django.utils import timezone
+
+from .events import EventConsumer, register_consumer
+from .models import BookCirculationStats, DailyCirculationStat
+from .stats import EVENT_METRICS, apply_events
+
+# Counter deltas applied for each event type
+BOOK_COUNTER_DELTAS = {
+    'checkout': {'checkouts': 1, 'active_loans': 1},
+    'renew': {'renewals': 1},
+    'return': {'returns': 1, 'active_loans': -1},
+    'lost': {'lost': 1, 'active_loans': -1},
+}
+
+
+@register_consumer
+class BookCirculationStatsConsumer(EventConsumer):
+    name = 'book_circulation_stats'
+    event_types = list(BOOK_COUNTER_DELTAS)
+
+    def handle_batch(self, events):
+        deltas = defaultdict(lambda: defaultdict(int))
+        last_checkout = {}
+        for event in events:
+            if event.book_id is None:
+                continue
+            for field, delta in BOOK_COUNTER_DELTAS[event.event_type].items():
+                deltas[event.book_id][field] += delta
+            if event.event_type == 'checkout':
+                last_checkout[event.book_id] = event.occurred_at
+
+        if not deltas:
+            return
+
+        existing = BookCirculationStats.objects.in_bulk(deltas.keys(), field_name='book_id')
+        to_create, to_update = [], []
+        for book_id, changes in deltas.items():
+            stats = existing.get(book_id)
+            if stats is None:
+                stats = BookCirculationStats(book_id=book_id)
+                to_create.append(stats)
+            else:
+                to_update.append(stats)
+            for field, delta in changes.items():
+                setattr(stats, field, getattr(stats, field) + delta)
+            if book_id in last_checkout:
+                stats.last_checkout_at = last_checkout[book_id]
+
+        BookCirculationStats.objects.bulk_create(to_create)
+        BookCirculationStats.objects.bulk_update(
+            to_update, ['checkouts', 'renewals', 'returns', 'lost', 'active_loans', 'last_checkout_at']
+        )
+
+    def reset(self):
+        BookCirculationStats.objects.all().delete()
+
+
+@register_consumer
+class DailyCirculationStatsConsumer(EventConsumer):
+    """
+    Keeps today's DailyCirculationStat rows current. Earlier days are
+    recomputed from the source tables by ``rollup_circulation_stats``.
+    """
+    name = 'daily_circulation_stats'
+    event_types = list(EVENT_METRICS)
+
+    def handle_batch(self, events):
+        apply_events(events)
+
+    def reset(self):
+        DailyCirculationStat.objects.filter(date=timezone.localdate()).delete()
@@ -0,0 +1,146 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CirculationEvent, EventConsumerWatermark
+
+# Registered consumers by name, filled in by ``register_consumer``
+CONSUMERS = {}
+
+
+def get_gap_timeout():
+    """How long a gap in event ids may still be an insert that has not committed yet."""
+    return timedelta(seconds=getattr(settings, 'LIBRARY_SETTINGS', {}).get('EVENT_GAP_SECONDS', 60))
+
+
+def committed_through(after_id, rows, now=None):
+    """
+    Highest id a consumer at ``after_id`` may move past, given the next
+    ``(id, recorded_at)`` rows of the stream in id order. Ids are handed out
+    when a row is inserted, not when it commits, so a missing id may belong to
+    a transaction still open; the stream stops before it until the row after
+    the gap is older than ``get_gap_timeout()``, after which the insert is
+    taken to have rolled back.
+    """
+    cutoff = (now or timezone.now()) - get_gap_timeout()
+    last = after_id
+    for event_id, recorded_at in rows:
+        if event_id != last + 1 and recorded_at > cutoff:
+            break
+        last = event_id
+    return last
+
+
+def _event_for(event_type, user=None, borrow_transaction=None, book=None, branch=None,
+               amount=None, occurred_at=None, **data):
+    event = CirculationEvent(
+        event_type=event_type,
+        occurred_at=occurred_at or timezone.now(),
+        user=user,
+        borrow_transaction=borrow_transaction,
+        book=book,
+        branch=branch,
+        amount=amount,
+        data=data,
+    )
+    if borrow_transaction is not None:
+        # Only ids are copied so bulk callers don't load related rows
+        book_copy = borrow_transaction.book_copy
+        event.user_id = event.user_id or borrow_transaction.user_id
+        event.book_id = event.book_id or book_copy.book_id
+        event.branch_id = event.branch_id or book_copy.branch_id
+        event.data.setdefault('book_copy_id', book_copy.id)
+    return event
+
+
+def record_event(event_type, **kwargs):
+    """
+    Appends one event to the circulation stream. Call it inside the same
+    ``transaction.atomic()`` block as the state change it describes.
+    """
+    event = _event_for(event_type, **kwargs)
+    event.save()
+    return event
+
+
+def record_events(event_type, items):
+    """Bulk variant of ``record_event``; ``items`` is a list of kwargs dicts."""
+    return CirculationEvent.objects.bulk_create(
+        [_event_for(event_type, **kwargs) for kwargs in items]
+    )
+
+
+class EventConsumer:
+    """
+    Folds circulation events into derived tables.
+
+    Subclasses set ``name`` (and optionally ``event_types``) and implement
+    ``handle_batch``; ``reset`` must empty the derived tables so the consumer
+    can be rebuilt by replaying the stream from the beginning.
+
+    Events are consumed in id order, stopping at a gap in the ids until it is
+    ``EVENT_GAP_SECONDS`` old (see ``committed_through``). A batch and the
+    watermark advance are committed together, so each event is folded exactly
+    once as long as no transaction writing events stays open longer than that.
+    """
+    name = None
+    event_types = None
+
+    def handle_batch(self, events):
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    def pending_events(self, after_id):
+        queryset = CirculationEvent.objects.filter(id__gt=after_id)
+        if self.event_types:
+            queryset = queryset.filter(event_type__in=self.event_types)
+        return queryset.order_by('id')
+
+    def run(self, batch_size=1000):
+        """Consumes every pending event. Returns the number of events folded."""
+        processed = 0
+        while True:
+            with transaction.atomic():
+                watermark, _ = EventConsumerWatermark.objects.select_for_update().get_or_create(name=self.name)
+                after_id = watermark.last_event_id
+                # Gaps are looked for in the whole stream, as the event types
+                # a consumer reads have gaps between them anyway
+                rows = CirculationEvent.objects.filter(id__gt=after_id).order_by('id').values_list('id', 'recorded_at')
+                through = committed_through(after_id, rows[:batch_size])
+                if through == after_id:
+                    break
+                events = list(self.pending_events(after_id).filter(id__lte=through))
+                if events:
+                    self.handle_batch(events)
+                watermark.last_event_id = through
+                watermark.save(update_fields=['last_event_id', 'updated_at'])
+            processed += len(events)
+        return processed
+
+    def rebuild(self, batch_size=1000):
+        """Empties the derived tables and replays the whole event stream."""
+        with transaction.atomic():
+            self.reset()
+            EventConsumerWatermark.objects.update_or_create(name=self.name, defaults={'last_event_id': 0})
+        return self.run(batch_size=batch_size)
+
+
+def register_consumer(cls):
+    CONSUMERS[cls.name] = cls
+    return cls
+
+
+def run_consumers(names=None, batch_size=1000, rebuild=False):
+    """Runs the named consumers (default: all). Returns ``{name: processed}``."""
+    results = {}
+    for name in names or list(CONSUMERS):
+        consumer = CONSUMERS[name]()
+        if rebuild:
+            results[name] = consumer.rebuild(batch_size=batch_size)
+        else:
+            results[name] = consumer.run(batch_size=batch_size)
+    return results
@@ -0,0 +1,164 @@
+import math
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.functions import Least
+
+from .models import BorrowingHistory, LoanLengthHistogram
+
+# Titles need this many returned loans for a histogram of their own;
+# others use their category's
+MIN_TITLE_SAMPLES = 20
+
+# Beyond this many full loans ahead the exact convolution gets slow, and a
+# normal approximation of the sum is close enough
+MAX_EXACT_TURNS = 8
+
+CACHE_TIMEOUT = 60 * 60
+VERSION_CACHE_KEY = 'borrowing:loan_lengths:version'
+
+
+def _cache_key(book_id, category_id):
+    return f'borrowing:loan_lengths:{cache.get(VERSION_CACHE_KEY, 0)}:{book_id}:{category_id}'
+
+
+def build_histograms(min_title_samples=MIN_TITLE_SAMPLES):
+    """
+    Rebuilds every LoanLengthHistogram from returned BorrowingHistory rows,
+    using grouped counts so no history rows are loaded. Returns the number
+    of histograms written.
+    """
+    max_days = LoanLengthHistogram.MAX_DAYS
+    returned = BorrowingHistory.objects.filter(
+        action='returned', days_borrowed__isnull=False
+    ).order_by().annotate(bucket=Least('days_borrowed', max_days))
+
+    def collect(*scope):
+        histograms = defaultdict(lambda: [0] * (max_days + 1))
+        for row in returned.values(*scope, 'bucket').annotate(loans=Count('id')).iterator():
+            key = tuple(row[field] for field in scope)
+            histograms[key][max(row['bucket'], 0)] += row['loans']
+        return histograms
+
+    rows = [LoanLengthHistogram(counts=counts, samples=sum(counts)) for counts in collect().values()]
+    rows += [
+        LoanLengthHistogram(category_id=category_id, counts=counts, samples=sum(counts))
+        for (category_id,), counts in collect('book__category_id').items()
+        if category_id is not None
+    ]
+    rows += [
+        LoanLengthHistogram(book_id=book_id, counts=counts, samples=sum(counts))
+        for (book_id,), counts in collect('book_id').items()
+        if sum(counts) >= min_title_samples
+    ]
+
+    with transaction.atomic():
+        LoanLengthHistogram.objects.all().delete()
+        LoanLengthHistogram.objects.bulk_create(rows, batch_size=1000)
+    # Start a new generation of cached lookups
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 1, None)
+    return len(rows)
+
+
+def histogram_for(book):
+    """
+    Loan length counts for ``book``: its own histogram, else its category's,
+    else the collection's. Cached, and a single query on a cache miss.
+    Returns None when no loans have been returned yet.
+    """
+    key = _cache_key(book.id, book.category_id)
+    counts = cache.get(key)
+    if counts is None:
+        scopes = Q(book=book) | Q(book__isnull=True, category__isnull=True)
+        if book.category_id:
+            scopes |= Q(book__isnull=True, category_id=book.category_id)
+        by_scope = {
+            (row.book_id, row.category_id): row.counts
+            for row in LoanLengthHistogram.objects.filter(scopes, samples__gt=0)
+        }
+        counts = (
+            by_scope.get((book.id, None))
+            or by_scope.get((None, book.category_id))
+            or by_scope.get((None, None))
+            or []
+        )
+        cache.set(key, counts, CACHE_TIMEOUT)
+    return counts or None
+
+
+def _convolve(a, b):
+    result = [0.0] * (len(a) + len(b) - 1)
+    for i, x in enumerate(a):
+        if x:
+            for j, y in enumerate(b):
+                result[i + j] += x * y
+    return result
+
+
+def _percentile(pmf, q):
+    total = 0.0
+    for days, probability in enumerate(pmf):
+        total += probability
+        if total >= q:
+            return days
+    return len(pmf) - 1
+
+
+def _moments(pmf):
+    mean = sum(days * p for days, p in enumerate(pmf))
+    return mean, sum((days - mean) ** 2 * p for days, p in enumerate(pmf))
+
+
+def wait_percentiles(counts, position, copies, quantiles=(0.1, 0.5, 0.9)):
+    """
+    Wait in days at each quantile for the ``position``-th hold when
+    ``copies`` copies are all on loan. The first turn waits out the residual
+    of a loan in progress; each further turn takes a full loan.
+    """
+    samples = sum(counts)
+    loan = [count / samples for count in counts]
+    # P(L > d) / E[L] is the residual life of a loan already in progress
+    survival = [sum(loan[d + 1:]) for d in range(len(loan))]
+    mean = sum(survival) or 1.0
+    residual = [s / mean for s in survival]
+    turns = math.ceil(position / copies) - 1
+
+    if turns > MAX_EXACT_TURNS:
+        (residual_mean, residual_var), (loan_mean, loan_var) = _moments(residual), _moments(loan)
+        total_mean = residual_mean + turns * loan_mean
+        total_sd = math.sqrt(residual_var + turns * loan_var)
+        z_scores = {0.1: -1.2816, 0.5: 0.0, 0.9: 1.2816}
+        return [max(round(total_mean + z_scores[q] * total_sd), 0) for q in quantiles]
+
+    distribution = residual
+    for _ in range(turns):
+        distribution = _convolve(distribution, loan)
+    return [_percentile(distribution, q) for q in quantiles]
+
+
+def estimate_wait(book, branch, position):
+    """
+    Estimated days until the ``position``-th hold on ``book`` at ``branch``
+    gets a copy, as ``{'days', 'low', 'high'}`` (median and 10th-90th
+    percentile band). Returns None when there is nothing to base it on.
+    """
+    from books.models import BookBranchAvailability
+
+    availability = BookBranchAvailability.objects.filter(book=book, branch=branch).first()
+    if availability is None:
+        return None
+    if position <= availability.available:
+        return {'days': 0, 'low': 0, 'high': 0}
+
+    copies = availability.borrowed + availability.reserved
+    counts = histogram_for(book)
+    if not copies or not counts:
+        return None
+
+    low, days, high = wait_percentiles(counts, position - availability.available, copies)
+    return {'days': days, 'low': low, 'high': high}
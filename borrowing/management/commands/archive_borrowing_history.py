@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from borrowing.archive import archive_history, get_archive_cutoff
+from borrowing.models import BorrowingHistory
+
+
+class Command(BaseCommand):
+    help = 'Move old borrowing history rows into the archive table in chunked batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            help='Archive rows borrowed more than this many days ago '
+                 '(default: LIBRARY_SETTINGS["HISTORY_ARCHIVE_AFTER_DAYS"])'
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows moved per transaction')
+        parser.add_argument('--max-chunks', type=int, help='Stop after this many chunks; rerun to resume')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows would move')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None:
+            cutoff = timezone.now() - timedelta(days=options['days'])
+        else:
+            cutoff = get_archive_cutoff()
+
+        if options['dry_run']:
+            pending = BorrowingHistory.objects.filter(borrowed_date__lt=cutoff).count()
+            self.stdout.write(f'{pending} history row(s) borrowed before {cutoff:%Y-%m-%d} would be archived')
+            return
+
+        moved = archive_history(
+            cutoff=cutoff,
+            chunk_size=options['chunk_size'],
+            max_chunks=options['max_chunks'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} history row(s) borrowed before {cutoff:%Y-%m-%d}'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from borrowing.loan_lengths import MIN_TITLE_SAMPLES, build_histograms
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the loan length histograms used to estimate hold wait times'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-title-samples', type=int, default=MIN_TITLE_SAMPLES,
+            help=f'Returned loans a title needs for its own histogram (default: {MIN_TITLE_SAMPLES})'
+        )
+
+    def handle(self, *args, **options):
+        written = build_histograms(options['min_title_samples'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} loan length histogram(s)'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from borrowing.events import CONSUMERS, run_consumers
+
+
+class Command(BaseCommand):
+    help = 'Fold new circulation events into derived tables, or rebuild them from the full stream'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'consumers', nargs='*',
+            help=f'Consumers to run (default: all). Available: {", ".join(sorted(CONSUMERS))}'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Events folded per transaction')
+        parser.add_argument('--rebuild', action='store_true', help='Reset derived tables and replay every event')
+
+    def handle(self, *args, **options):
+        unknown = set(options['consumers']) - set(CONSUMERS)
+        if unknown:
+            raise CommandError(f'Unknown consumer(s): {", ".join(sorted(unknown))}')
+
+        results = run_consumers(
+            names=options['consumers'] or None,
+            batch_size=options['batch_size'],
+            rebuild=options['rebuild'],
+        )
+        for name, processed in results.items():
+            self.stdout.write(self.style.SUCCESS(f'{name}: folded {processed} event(s)'))
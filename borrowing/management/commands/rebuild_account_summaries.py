@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from borrowing.summaries import rebuild_summaries, verify_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute member account summaries from the loan and reservation tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Users processed per transaction')
+        parser.add_argument('--verify', action='store_true', help='Only compare the stored summaries with the source tables')
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            mismatched = verify_summaries(options['chunk_size'])
+            if mismatched:
+                shown = ', '.join(str(user_id) for user_id in mismatched[:20])
+                raise CommandError(f'{len(mismatched)} summary(ies) out of date (user ids: {shown}); run without --verify to rebuild')
+            self.stdout.write(self.style.SUCCESS('All account summaries match the source tables'))
+            return
+
+        written = rebuild_summaries(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} account summary(ies)'))
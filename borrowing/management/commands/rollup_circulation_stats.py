@@ -0,0 +1,27 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from borrowing.stats import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute daily circulation statistics for closed days from the source tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=1, help='Number of closed days to recompute (default: 1, yesterday)')
+        parser.add_argument('--since', help='Backfill every day from this date (YYYY-MM-DD) up to yesterday')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        if options['since']:
+            try:
+                start = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError('--since must be a date in YYYY-MM-DD format')
+        else:
+            start = today - timedelta(days=options['days'])
+
+        written = rebuild_daily_stats(start, today)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollup row(s) for {start} to {today - timedelta(days=1)}'))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from borrowing.notifications import claim_notices, collect_digests, send_digests
+
+
+class Command(BaseCommand):
+    help = 'Email due-date reminders and overdue notices, one digest per member'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--remind-days', type=int, nargs='+', default=[3],
+            help='Send a reminder for loans due in this many days (default: 3)'
+        )
+        parser.add_argument(
+            '--overdue-days', type=int, nargs='+', default=[1, 7, 14],
+            help='Send a notice for loans overdue by this many days (default: 1 7 14)'
+        )
+        parser.add_argument('--batch-size', type=int, default=100, help='Messages sent per mail connection')
+        parser.add_argument('--workers', type=int, default=4, help='Threads used to render messages')
+        parser.add_argument('--dry-run', action='store_true', help='Collect digests without sending them')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        digests = collect_digests(
+            reminder_days=options['remind_days'],
+            overdue_days=options['overdue_days'],
+            today=today,
+        )
+        self.stdout.write(f'{len(digests)} member(s) to notify for {today}')
+
+        if options['dry_run']:
+            for digest in digests:
+                self.stdout.write(
+                    f"  {digest['email']}: {len(digest['due_soon'])} due soon, {len(digest['overdue'])} overdue"
+                )
+            return
+
+        digests = claim_notices(digests)
+        sent = send_digests(digests, batch_size=options['batch_size'], workers=options['workers'])
+        self.stdout.write(self.style.SUCCESS(f'Sent {sent} notice(s)'))
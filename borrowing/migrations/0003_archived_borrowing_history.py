@@ -0,0 +1,66 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:31
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0001_initial'),
+        ('borrowing', '0002_borrowtransaction_status_due_index'),
+        ('library_branches', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBorrowingHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('original_id', models.BigIntegerField(unique=True)),
+                ('borrowed_date', models.DateTimeField()),
+                ('returned_date', models.DateTimeField(blank=True, null=True)),
+                ('days_borrowed', models.PositiveIntegerField(blank=True, null=True)),
+                ('was_overdue', models.BooleanField(default=False)),
+                ('fine_paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=10)),
+                ('renewal_count', models.PositiveIntegerField(default=0)),
+                ('action', models.CharField(choices=[('borrowed', 'Borrowed'), ('returned', 'Returned'), ('renewed', 'Renewed'), ('lost', 'Lost'), ('damaged', 'Damaged')], max_length=20)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Archived Borrowing History',
+                'verbose_name_plural': 'Archived Borrowing Histories',
+                'ordering': ['-borrowed_date'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='borrowinghistory',
+            index=models.Index(fields=['user', '-borrowed_date'], name='history_user_borrowed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowinghistory',
+            index=models.Index(fields=['borrowed_date'], name='history_borrowed_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedborrowinghistory',
+            name='book',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_borrowing_history', to='books.book'),
+        ),
+        migrations.AddField(
+            model_name='archivedborrowinghistory',
+            name='branch',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_borrowing_history', to='library_branches.librarybranch'),
+        ),
+        migrations.AddField(
+            model_name='archivedborrowinghistory',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_borrowing_history', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='archivedborrowinghistory',
+            index=models.Index(fields=['user', '-borrowed_date'], name='archive_user_borrowed_idx'),
+        ),
+    ]
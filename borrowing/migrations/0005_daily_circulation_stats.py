@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:35
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0001_initial'),
+        ('borrowing', '0004_circulation_events'),
+        ('library_branches', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyCirculationStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('user_type', models.CharField(blank=True, max_length=20)),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('renewals', models.PositiveIntegerField(default=0)),
+                ('overdues', models.PositiveIntegerField(default=0, help_text='Loans that passed their due date on this day without being returned')),
+                ('fines_issued', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('fines_paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('active_members', models.PositiveIntegerField(default=0, help_text='Distinct members who borrowed or returned on this day')),
+                ('branch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='library_branches.librarybranch')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='books.category')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['date'], name='daily_stat_date_idx')],
+                'unique_together': {('date', 'branch', 'category', 'user_type')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:40
+
+import borrowing.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0001_initial'),
+        ('borrowing', '0005_daily_circulation_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='borrowtransaction',
+            name='max_renewals_allowed',
+            field=models.PositiveIntegerField(default=borrowing.models.default_max_renewals),
+        ),
+        migrations.CreateModel(
+            name='LoanPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_type', models.CharField(blank=True, choices=[('member', 'Library Member'), ('librarian', 'Librarian'), ('admin', 'Administrator')], help_text='Leave blank for all member types', max_length=20)),
+                ('book_format', models.CharField(blank=True, choices=[('hardcover', 'Hardcover'), ('paperback', 'Paperback'), ('ebook', 'E-book'), ('audiobook', 'Audiobook')], help_text='Leave blank for all formats', max_length=20)),
+                ('loan_days', models.PositiveIntegerField()),
+                ('max_renewals', models.PositiveIntegerField()),
+                ('max_loans', models.PositiveIntegerField(help_text='Books a member may have on loan at once')),
+                ('fine_per_day', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('is_active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(blank=True, help_text='Leave blank for all categories', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='loan_policies', to='books.category')),
+            ],
+            options={
+                'verbose_name_plural': 'Loan Policies',
+                'unique_together': {('user_type', 'category', 'book_format')},
+            },
+        ),
+    ]
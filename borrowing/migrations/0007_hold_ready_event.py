@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrowing', '0006_loan_policy'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='circulationevent',
+            name='event_type',
+            field=models.CharField(choices=[('checkout', 'Checkout'), ('renew', 'Renewal'), ('return', 'Return'), ('lost', 'Lost'), ('fine_issued', 'Fine Issued'), ('fine_waived', 'Fine Waived'), ('payment', 'Payment'), ('hold_ready', 'Hold Ready')], max_length=20),
+        ),
+    ]
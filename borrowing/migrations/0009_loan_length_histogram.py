@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_branch_availability'),
+        ('borrowing', '0008_hold_expired_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanLengthHistogram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('counts', models.JSONField(default=list)),
+                ('samples', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('book', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='loan_length_histograms', to='books.book')),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='loan_length_histograms', to='books.category')),
+            ],
+        ),
+    ]
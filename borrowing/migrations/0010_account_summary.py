@@ -0,0 +1,28 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_member_search_terms'),
+        ('borrowing', '0009_loan_length_histogram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountSummary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='account_summary', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('lifetime_borrows', models.PositiveIntegerField(default=0)),
+                ('active_reservations', models.PositiveIntegerField(default=0)),
+                ('loan_due_dates', models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                'verbose_name_plural': 'Account Summaries',
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrowing', '0010_account_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DueNotice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('due_soon', 'Due Soon'), ('overdue', 'Overdue')], max_length=20)),
+                ('days', models.PositiveSmallIntegerField(help_text='Days before or after the due date the notice is for')),
+                ('due_date', models.DateTimeField()),
+                ('run', models.CharField(db_index=True, help_text='Run that claimed and sent the notice', max_length=32)),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+                ('borrow_transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='due_notices', to='borrowing.borrowtransaction')),
+            ],
+            options={
+                'unique_together': {('borrow_transaction', 'kind', 'days', 'due_date')},
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:44
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrowing', '0011_due_notices'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='circulationevent',
+            name='recorded_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
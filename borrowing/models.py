@@ -1,8 +1,79 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, ExpressionWrapper, F, Q, Value, When
+from django.db.models.functions import Least, TruncDate
 from django.conf import settings
 from django.utils import timezone
+from django.utils.functional import cached_property
 from decimal import Decimal
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from accounts.models import User
+from books.models import Book
+
+CLOSED_LOAN_STATUSES = ['returned', 'lost']
+
+def default_max_renewals():
+    return getattr(settings, 'LIBRARY_SETTINGS', {}).get('MAX_RENEWALS', 2)
+
+class DaysBetween(models.Func):
+    """Whole days from the ``start`` date expression to the ``end`` date expression."""
+    output_field = models.IntegerField()
+    arity = 2
+    
+    def __init__(self, end, start, **extra):
+        super().__init__(end, start, **extra)
+    
+    def _compile_args(self, compiler):
+        end, end_params = compiler.compile(self.source_expressions[0])
+        start, start_params = compiler.compile(self.source_expressions[1])
+        return end, start, (*end_params, *start_params)
+    
+    def as_sql(self, compiler, connection, **extra_context):
+        end, start, params = self._compile_args(compiler)
+        return f'(CAST({end} AS DATE) - CAST({start} AS DATE))', params
+    
+    def as_sqlite(self, compiler, connection, **extra_context):
+        end, start, params = self._compile_args(compiler)
+        return f'CAST(julianday({end}) - julianday({start}) AS INTEGER)', params
+    
+    def as_mysql(self, compiler, connection, **extra_context):
+        end, start, params = self._compile_args(compiler)
+        return f'DATEDIFF({end}, {start})', params
+
+class BorrowTransactionQuerySet(models.QuerySet):
+    def with_accrual(self, as_of=None, fine_type=None):
+        """
+        Annotates ``is_overdue``, ``days_overdue`` and ``accrued_fine`` computed
+        in the database against a single ``as_of`` timestamp (default: now).
+        
+        The daily rate comes from the matching LoanPolicy, then from
+        ``fine_type`` when it is a per-day type, then from
+        LIBRARY_SETTINGS['FINE_PER_DAY']; ``fine_type.max_amount`` caps the
+        accrued amount when set.
+        """
+        from .policies import fine_rate_expression
+        
+        as_of = as_of or timezone.now()
+        if fine_type is not None and fine_type.is_per_day:
+            default_rate = fine_type.default_amount
+        else:
+            default_rate = Decimal(str(getattr(settings, 'LIBRARY_SETTINGS', {}).get('FINE_PER_DAY', 1.00)))
+        
+        overdue = Q(due_date__lt=as_of) & ~Q(status__in=CLOSED_LOAN_STATUSES)
+        # Day arithmetic uses UTC dates, matching the Python properties
+        days = DaysBetween(
+            Value(as_of.astimezone(dt_timezone.utc).date(), output_field=models.DateField()),
+            TruncDate('due_date', tzinfo=dt_timezone.utc),
+        )
+        money = models.DecimalField(max_digits=10, decimal_places=2)
+        accrued = ExpressionWrapper(F('days_overdue') * fine_rate_expression(default_rate), output_field=money)
+        if fine_type is not None and fine_type.max_amount is not None:
+            accrued = Least(accrued, Value(fine_type.max_amount, output_field=money), output_field=money)
+        
+        return self.annotate(
+            is_overdue=Case(When(overdue, then=Value(True)), default=Value(False), output_field=models.BooleanField()),
+            days_overdue=Case(When(overdue, then=days), default=Value(0), output_field=models.IntegerField()),
+        ).annotate(accrued_fine=accrued)
 
 class BorrowTransaction(models.Model):
     STATUS_CHOICES = [
@@ -34,27 +105,47 @@ class BorrowTransaction(models.Model):
     returned_at = models.DateTimeField(blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     renewal_count = models.PositiveIntegerField(default=0)
-    max_renewals_allowed = models.PositiveIntegerField(default=1)
+    max_renewals_allowed = models.PositiveIntegerField(default=default_max_renewals)
     notes = models.TextField(blank=True)
     
+    objects = BorrowTransactionQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-borrowed_at']
+        indexes = [
+            models.Index(fields=['status', 'due_date'], name='borrow_status_due_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.book_copy.book.title} ({self.status})"
     
+    # is_overdue, days_overdue and fine_amount prefer the values annotated by
+    # BorrowTransactionQuerySet.with_accrual() and fall back to Python otherwise
+    
     @property
     def is_overdue(self):
-        if self.status in ['returned', 'lost']:
+        if '_is_overdue' in self.__dict__:
+            return self._is_overdue
+        if self.status in CLOSED_LOAN_STATUSES:
             return False
         return timezone.now() > self.due_date
     
+    @is_overdue.setter
+    def is_overdue(self, value):
+        self._is_overdue = value
+    
     @property
     def days_overdue(self):
+        if '_days_overdue' in self.__dict__:
+            return self._days_overdue
         if not self.is_overdue:
             return 0
         return (timezone.now().date() - self.due_date.date()).days
     
+    @days_overdue.setter
+    def days_overdue(self, value):
+        self._days_overdue = value
+    
     @property
     def days_until_due(self):
         """Returns the number of days until the book is due"""
@@ -76,34 +167,48 @@ class BorrowTransaction(models.Model):
     
     @property
     def fine_amount(self):
+        # Without the annotation the policy is resolved per loan (and the user
+        # and book loaded); lists should use with_accrual() or fine_for()
+        if 'accrued_fine' in self.__dict__:
+            return self.accrued_fine
+        return self.fine_for(self.policy)
+    
+    def fine_for(self, policy):
+        """Fine accrued so far at ``policy``'s daily rate."""
         if not self.is_overdue:
             return Decimal('0.00')
-        
-        from django.conf import settings
-        fine_per_day = getattr(settings, 'LIBRARY_SETTINGS', {}).get('FINE_PER_DAY', 1.00)
-        return Decimal(str(fine_per_day)) * self.days_overdue
+        return policy.fine_per_day * self.days_overdue
+    
+    @cached_property
+    def policy(self):
+        from .policies import policy_for
+        return policy_for(self.user, self.book_copy.book)
     
     def renew(self, librarian=None):
         if not self.can_renew:
             raise ValueError("This transaction cannot be renewed")
         
-        loan_period = getattr(settings, 'LIBRARY_SETTINGS', {}).get('DEFAULT_LOAN_PERIOD_DAYS', 14)
-        self.due_date = timezone.now() + timedelta(days=loan_period)
+        from .events import record_event
+        
+        self.due_date = timezone.now() + timedelta(days=self.policy.loan_days)
         self.renewal_count += 1
         self.status = 'renewed'
         if librarian:
             self.librarian_issued = librarian
-        self.save()
         
-        # Log the renewal
-        BorrowingHistory.objects.create(
-            user=self.user,
-            book=self.book_copy.book,
-            branch=self.book_copy.branch,
-            borrowed_date=self.borrowed_at,
-            renewal_count=self.renewal_count,
-            action='renewed'
-        )
+        with transaction.atomic():
+            self.save()
+            
+            # Log the renewal
+            BorrowingHistory.objects.create(
+                user=self.user,
+                book=self.book_copy.book,
+                branch=self.book_copy.branch,
+                borrowed_date=self.borrowed_at,
+                renewal_count=self.renewal_count,
+                action='renewed'
+            )
+            record_event('renew', borrow_transaction=self, due_date=self.due_date.isoformat())
 
 class ReturnTransaction(models.Model):
     CONDITION_CHOICES = [
@@ -142,6 +247,13 @@ class ReturnTransaction(models.Model):
         return f"Return: {self.borrow_transaction.user.username} - {self.borrow_transaction.book_copy.book.title}"
     
     def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self._save_and_close_loan(*args, **kwargs)
+    
+    def _save_and_close_loan(self, *args, **kwargs):
+        from .events import record_event
+        from .summaries import loans_closed
+        
         # Calculate total penalty
         self.total_penalty = self.damage_fee + self.late_fine
         super().save(*args, **kwargs)
@@ -152,11 +264,13 @@ class ReturnTransaction(models.Model):
         self.borrow_transaction.librarian_returned = self.librarian
         self.borrow_transaction.save()
         
-        # Update book copy status
-        self.borrow_transaction.book_copy.status = 'available'
+        # Update book copy status; a returned copy goes to the next hold in the queue
         if self.condition in ['damaged', 'lost']:
             self.borrow_transaction.book_copy.status = self.condition
-        self.borrow_transaction.book_copy.save()
+            self.borrow_transaction.book_copy.save()
+        else:
+            from books.holds import allocate_copy
+            allocate_copy(self.borrow_transaction.book_copy)
         
         # Create history record
         BorrowingHistory.objects.create(
@@ -171,6 +285,14 @@ class ReturnTransaction(models.Model):
             renewal_count=self.borrow_transaction.renewal_count,
             action='returned'
         )
+        
+        record_event(
+            'lost' if self.condition == 'lost' else 'return',
+            borrow_transaction=self.borrow_transaction,
+            amount=self.total_penalty,
+            condition=self.condition,
+        )
+        loans_closed([self.borrow_transaction])
 
 class BorrowingHistory(models.Model):
     ACTION_CHOICES = [
@@ -198,6 +320,246 @@ class BorrowingHistory(models.Model):
         verbose_name = 'Borrowing History'
         verbose_name_plural = 'Borrowing Histories'
         ordering = ['-borrowed_date']
+        indexes = [
+            models.Index(fields=['user', '-borrowed_date'], name='history_user_borrowed_idx'),
+            models.Index(fields=['borrowed_date'], name='history_borrowed_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.book.title} ({self.action})"
+
+class ArchivedBorrowingHistory(models.Model):
+    """
+    Cold storage for BorrowingHistory rows older than the archive horizon.
+    Field names match BorrowingHistory so both can be queried as one stream.
+    """
+    original_id = models.BigIntegerField(unique=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='archived_borrowing_history')
+    book = models.ForeignKey('books.Book', on_delete=models.CASCADE, related_name='archived_borrowing_history')
+    branch = models.ForeignKey('library_branches.LibraryBranch', on_delete=models.CASCADE, related_name='archived_borrowing_history')
+    borrowed_date = models.DateTimeField()
+    returned_date = models.DateTimeField(blank=True, null=True)
+    days_borrowed = models.PositiveIntegerField(blank=True, null=True)
+    was_overdue = models.BooleanField(default=False)
+    fine_paid = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.00'))
+    renewal_count = models.PositiveIntegerField(default=0)
+    action = models.CharField(max_length=20, choices=BorrowingHistory.ACTION_CHOICES)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Archived Borrowing History'
+        verbose_name_plural = 'Archived Borrowing Histories'
+        ordering = ['-borrowed_date']
+        indexes = [
+            models.Index(fields=['user', '-borrowed_date'], name='archive_user_borrowed_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.book.title} ({self.action}, archived)"
+
+class CirculationEvent(models.Model):
+    """
+    Append-only record of every circulation state change. Rows are written in
+    the same database transaction as the change itself and never updated.
+    """
+    EVENT_TYPE_CHOICES = [
+        ('checkout', 'Checkout'),
+        ('renew', 'Renewal'),
+        ('return', 'Return'),
+        ('lost', 'Lost'),
+        ('fine_issued', 'Fine Issued'),
+        ('fine_waived', 'Fine Waived'),
+        ('payment', 'Payment'),
+        ('hold_ready', 'Hold Ready'),
+        ('hold_expired', 'Hold Expired'),
+    ]
+    
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPE_CHOICES)
+    occurred_at = models.DateTimeField(default=timezone.now)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='circulation_events'
+    )
+    borrow_transaction = models.ForeignKey(
+        BorrowTransaction,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='events'
+    )
+    book = models.ForeignKey('books.Book', on_delete=models.SET_NULL, blank=True, null=True, related_name='circulation_events')
+    branch = models.ForeignKey('library_branches.LibraryBranch', on_delete=models.SET_NULL, blank=True, null=True, related_name='circulation_events')
+    amount = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    data = models.JSONField(default=dict, blank=True)
+    # When the row was inserted, which occurred_at need not be; consumers use
+    # it to tell an id still in flight from one whose insert rolled back
+    recorded_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['event_type', 'occurred_at'], name='event_type_occurred_idx'),
+        ]
+    
+    def __str__(self):
+        return f"#{self.id} {self.get_event_type_display()} at {self.occurred_at}"
+
+class EventConsumerWatermark(models.Model):
+    """Highest CirculationEvent id a consumer has folded into its tables."""
+    name = models.CharField(max_length=100, unique=True)
+    last_event_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.last_event_id}"
+
+class BookCirculationStats(models.Model):
+    """Per-book counters derived from the circulation event stream."""
+    book = models.OneToOneField('books.Book', on_delete=models.CASCADE, related_name='circulation_stats')
+    checkouts = models.PositiveIntegerField(default=0)
+    renewals = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    lost = models.PositiveIntegerField(default=0)
+    active_loans = models.IntegerField(default=0)
+    last_checkout_at = models.DateTimeField(blank=True, null=True)
+    
+    class Meta:
+        verbose_name = 'Book Circulation Stats'
+        verbose_name_plural = 'Book Circulation Stats'
+    
+    def __str__(self):
+        return f"{self.book.title}: {self.checkouts} checkouts"
+
+class DailyCirculationStat(models.Model):
+    """
+    Daily circulation rollup per branch, category and member type.
+
+    The current day is maintained from the circulation event stream; closed
+    days are recomputed from the source tables by ``rollup_circulation_stats``,
+    which is also the only writer of ``overdues`` and ``active_members``.
+    """
+    date = models.DateField()
+    branch = models.ForeignKey('library_branches.LibraryBranch', on_delete=models.CASCADE, blank=True, null=True, related_name='daily_stats')
+    category = models.ForeignKey('books.Category', on_delete=models.CASCADE, blank=True, null=True, related_name='daily_stats')
+    user_type = models.CharField(max_length=20, blank=True)
+    checkouts = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    renewals = models.PositiveIntegerField(default=0)
+    overdues = models.PositiveIntegerField(default=0, help_text="Loans that passed their due date on this day without being returned")
+    fines_issued = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    fines_paid = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    active_members = models.PositiveIntegerField(default=0, help_text="Distinct members who borrowed or returned on this day")
+    
+    class Meta:
+        ordering = ['-date']
+        unique_together = [['date', 'branch', 'category', 'user_type']]
+        indexes = [
+            models.Index(fields=['date'], name='daily_stat_date_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.date} {self.branch_id}/{self.category_id}/{self.user_type}: {self.checkouts} checkouts"
+
+class LoanPolicy(models.Model):
+    """
+    Loan terms for a member type, category and book format. A blank field
+    matches any value; the most specific active policy wins and anything not
+    covered falls back to LIBRARY_SETTINGS.
+    """
+    user_type = models.CharField(max_length=20, choices=User.USER_TYPE_CHOICES, blank=True, help_text="Leave blank for all member types")
+    category = models.ForeignKey('books.Category', on_delete=models.CASCADE, blank=True, null=True, related_name='loan_policies', help_text="Leave blank for all categories")
+    book_format = models.CharField(max_length=20, choices=Book.FORMAT_CHOICES, blank=True, help_text="Leave blank for all formats")
+    loan_days = models.PositiveIntegerField()
+    max_renewals = models.PositiveIntegerField()
+    max_loans = models.PositiveIntegerField(help_text="Books a member may have on loan at once")
+    fine_per_day = models.DecimalField(max_digits=10, decimal_places=2)
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'Loan Policies'
+        unique_together = [['user_type', 'category', 'book_format']]
+    
+    def __str__(self):
+        parts = [
+            self.get_user_type_display() if self.user_type else 'Any member',
+            str(self.category) if self.category_id else 'any category',
+            self.get_book_format_display() if self.book_format else 'any format',
+        ]
+        return f"{' / '.join(parts)}: {self.loan_days} days"
+
+class LoanLengthHistogram(models.Model):
+    """
+    Distribution of loan lengths for one title, one category or, with both
+    blank, the whole collection. ``counts[d]`` is the number of returned
+    loans that lasted ``d`` days; the last bucket also holds longer loans.
+    Rebuilt from BorrowingHistory by ``build_loan_histograms``.
+    """
+    MAX_DAYS = 60
+    
+    book = models.ForeignKey('books.Book', on_delete=models.CASCADE, blank=True, null=True, related_name='loan_length_histograms')
+    category = models.ForeignKey('books.Category', on_delete=models.CASCADE, blank=True, null=True, related_name='loan_length_histograms')
+    counts = models.JSONField(default=list)
+    samples = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        scope = self.book or self.category or 'All loans'
+        return f"{scope}: {self.samples} loans"
+
+class AccountSummary(models.Model):
+    """
+    Per-user circulation counts for dashboards and the loan limit, read with
+    one primary-key lookup. Checkout, return, renewal and the reservation
+    paths update it in the same transaction as the change; it can be
+    rebuilt from the source tables by ``rebuild_account_summaries``.
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='account_summary')
+    lifetime_borrows = models.PositiveIntegerField(default=0)
+    active_reservations = models.PositiveIntegerField(default=0)
+    # Due date of each active loan by loan id, so overdue counts need no sweep
+    loan_due_dates = models.JSONField(default=dict, blank=True)
+    
+    class Meta:
+        verbose_name_plural = 'Account Summaries'
+    
+    def __str__(self):
+        return f"{self.user_id}: {self.active_loans} on loan, {self.active_reservations} reserved"
+    
+    @property
+    def active_loans(self):
+        return len(self.loan_due_dates)
+    
+    def due_dates(self):
+        return sorted(datetime.fromisoformat(value) for value in self.loan_due_dates.values())
+    
+    def overdue_loans(self, as_of=None):
+        as_of = as_of or timezone.now()
+        return sum(1 for due_date in self.due_dates() if due_date < as_of)
+
+class DueNotice(models.Model):
+    """
+    A due-date reminder or overdue notice claimed for a loan by one run of
+    ``send_due_notices``, so reruns and overlapping runs do not repeat it.
+    Keyed on the due date at the time, so a renewed loan is reminded again.
+    """
+    KIND_CHOICES = [
+        ('due_soon', 'Due Soon'),
+        ('overdue', 'Overdue'),
+    ]
+    
+    borrow_transaction = models.ForeignKey(BorrowTransaction, on_delete=models.CASCADE, related_name='due_notices')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    days = models.PositiveSmallIntegerField(help_text="Days before or after the due date the notice is for")
+    due_date = models.DateTimeField()
+    run = models.CharField(max_length=32, db_index=True, help_text="Run that claimed and sent the notice")
+    sent_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = [['borrow_transaction', 'kind', 'days', 'due_date']]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} ({self.days}d) for loan {self.borrow_transaction_id}"
@@ -0,0 +1,133 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Exists, OuterRef
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import BorrowTransaction, DueNotice
+
+
+def _day_bounds(day):
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(day, time.min), tz)
+    return start, start + timedelta(days=1)
+
+
+def _loans_due_between(start, end, kind, days):
+    # Served by the (status, due_date) index on BorrowTransaction; loans
+    # already sent this notice for their current due date are left out
+    sent = DueNotice.objects.filter(
+        borrow_transaction=OuterRef('pk'), kind=kind, days=days, due_date=OuterRef('due_date')
+    )
+    return BorrowTransaction.objects.filter(
+        status='active', due_date__gte=start, due_date__lt=end
+    ).exclude(Exists(sent)).select_related('user', 'user__profile', 'book_copy__book', 'book_copy__branch')
+
+
+def _profile_allows(user, kind):
+    from accounts.models import UserProfile
+    profile = getattr(user, 'profile', None) or UserProfile(user=user)
+    return profile.wants_notification(kind)
+
+
+def _loan_entry(transaction, today, kind, days):
+    due = timezone.localtime(transaction.due_date).date()
+    return {
+        'notice': (transaction.pk, kind, days, transaction.due_date),
+        'title': transaction.book_copy.book.title,
+        'barcode': transaction.book_copy.barcode,
+        'branch': transaction.book_copy.branch.name,
+        'due_date': due,
+        'days_until_due': (due - today).days,
+        'days_overdue': (today - due).days,
+    }
+
+
+def collect_digests(reminder_days=(3,), overdue_days=(1, 7, 14), today=None):
+    """
+    Returns one digest per user containing every loan that is due in one of
+    ``reminder_days`` days or overdue by one of ``overdue_days`` days, keeping
+    only the sections the user has opted into. Notices already sent for a
+    loan's current due date are skipped; see ``claim_notices``.
+    """
+    today = today or timezone.localdate()
+    digests = {}
+
+    def add(section, kind, days, start, end):
+        for t in _loans_due_between(start, end, section, days):
+            user = t.user
+            if not user.email or not _profile_allows(user, kind):
+                continue
+            digest = digests.setdefault(user.id, {
+                'user_id': user.id,
+                'email': user.email,
+                'name': user.full_name,
+                'due_soon': [],
+                'overdue': [],
+            })
+            digest[section].append(_loan_entry(t, today, section, days))
+
+    for days in sorted(set(reminder_days)):
+        add('due_soon', 'due_reminders', days, *_day_bounds(today + timedelta(days=days)))
+    for days in sorted(set(overdue_days)):
+        add('overdue', 'overdue_notices', days, *_day_bounds(today - timedelta(days=days)))
+
+    return list(digests.values())
+
+
+def claim_notices(digests):
+    """
+    Records every notice in ``digests`` as sent and returns the digests cut
+    down to the notices this call claimed. A concurrent run that collected
+    the same loans claims none of them, so each notice is mailed at most once.
+    """
+    run = uuid.uuid4().hex
+    DueNotice.objects.bulk_create([
+        DueNotice(borrow_transaction_id=loan_id, kind=kind, days=days, due_date=due_date, run=run)
+        for digest in digests
+        for section in ('due_soon', 'overdue')
+        for loan_id, kind, days, due_date in (entry['notice'] for entry in digest[section])
+    ], ignore_conflicts=True)
+    claimed = set(DueNotice.objects.filter(run=run).values_list('borrow_transaction_id', 'kind', 'days'))
+
+    kept = []
+    for digest in digests:
+        digest = dict(digest)
+        for section in ('due_soon', 'overdue'):
+            digest[section] = [entry for entry in digest[section] if entry['notice'][:3] in claimed]
+        if digest['due_soon'] or digest['overdue']:
+            kept.append(digest)
+    return kept
+
+
+def render_digest(digest):
+    """Builds the email for one digest. Does not touch the database."""
+    if digest['overdue']:
+        subject = 'Library notice: you have overdue books'
+    else:
+        subject = 'Library reminder: books due soon'
+    body = render_to_string('borrowing/email/loan_digest.txt', digest)
+    return EmailMessage(
+        subject=subject,
+        body=body,
+        from_email=getattr(settings, 'DEFAULT_FROM_EMAIL', None),
+        to=[digest['email']],
+    )
+
+
+def send_digests(digests, batch_size=100, workers=4, connection=None):
+    """
+    Renders ``digests`` in a thread pool and sends them in batches, reusing a
+    single mail connection per batch. Returns the number of messages sent.
+    """
+    sent = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for offset in range(0, len(digests), batch_size):
+            messages = list(pool.map(render_digest, digests[offset:offset + batch_size]))
+            batch_connection = connection or get_connection()
+            sent += batch_connection.send_messages(messages) or 0
+    return sent
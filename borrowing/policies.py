@@ -0,0 +1,136 @@
+import time
+from decimal import Decimal
+from itertools import product
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, DecimalField, Max, Q, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import LoanPolicy
+
+# Bumped in the cache on every edit so other processes reload at once when
+# the cache is shared between them
+VERSION_CACHE_KEY = 'borrowing:loan_policy_version'
+
+# With a per-process cache an edit made elsewhere is only seen through the
+# policy table's fingerprint, re-read at most this often
+RECHECK_SECONDS = getattr(settings, 'LIBRARY_SETTINGS', {}).get('LOAN_POLICY_RECHECK_SECONDS', 30)
+
+# Lookup order from most to least specific; a blank key part is a wildcard
+SPECIFICITY = sorted(product((True, False), repeat=3), key=lambda mask: (-sum(mask), [not m for m in mask]))
+
+_lock = Lock()
+_table = None
+_version = None
+_fingerprint = None
+_checked_at = 0.0
+
+
+def default_policy():
+    """Unsaved policy built from LIBRARY_SETTINGS, used when nothing matches."""
+    library_settings = getattr(settings, 'LIBRARY_SETTINGS', {})
+    return LoanPolicy(
+        loan_days=library_settings.get('DEFAULT_LOAN_PERIOD_DAYS', 14),
+        max_renewals=library_settings.get('MAX_RENEWALS', 2),
+        max_loans=library_settings.get('MAX_BOOKS_PER_USER', 5),
+        fine_per_day=Decimal(str(library_settings.get('FINE_PER_DAY', 1.00))),
+    )
+
+
+def _compile():
+    table = {}
+    for policy in LoanPolicy.objects.filter(is_active=True).order_by('id'):
+        table[(policy.user_type, policy.category_id, policy.book_format)] = policy
+    return table
+
+
+def _get_fingerprint():
+    # Saves bump updated_at and deletes change the count
+    return tuple(LoanPolicy.objects.aggregate(updated=Max('updated_at'), count=Count('id')).values())
+
+
+def _is_fresh(version):
+    return _table is not None and version == _version and time.monotonic() - _checked_at < RECHECK_SECONDS
+
+
+def get_table():
+    """Returns the compiled ``{(user_type, category_id, format): policy}`` table."""
+    global _table, _version, _fingerprint, _checked_at
+    version = cache.get(VERSION_CACHE_KEY, 0)
+    table = _table
+    if not _is_fresh(version):
+        with _lock:
+            if not _is_fresh(version):
+                fingerprint = _get_fingerprint()
+                if _table is None or version != _version or fingerprint != _fingerprint:
+                    _table = _compile()
+                _version, _fingerprint, _checked_at = version, fingerprint, time.monotonic()
+            table = _table
+    return table
+
+
+def invalidate():
+    global _table
+    _table = None
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 1, None)
+
+
+@receiver(post_save, sender=LoanPolicy)
+@receiver(post_delete, sender=LoanPolicy)
+def _policy_changed(sender, **kwargs):
+    invalidate()
+
+
+def resolve(user_type, category_id, book_format):
+    """Most specific active policy for the combination, in at most eight dict lookups."""
+    table = get_table()
+    if table:
+        key = (user_type or '', category_id, book_format or '')
+        for mask in SPECIFICITY:
+            policy = table.get((
+                key[0] if mask[0] else '',
+                key[1] if mask[1] else None,
+                key[2] if mask[2] else '',
+            ))
+            if policy is not None:
+                return policy
+    return default_policy()
+
+
+def policy_for(user, book):
+    return resolve(user.user_type, book.category_id, book.format)
+
+
+def fine_rate_expression(default_rate):
+    """
+    SQL expression giving the daily fine for each BorrowTransaction row, so
+    ``with_accrual`` can price every loan by its policy in one query.
+    """
+    money = DecimalField(max_digits=10, decimal_places=2)
+    table = get_table()
+    # A catch-all policy replaces the settings default
+    catch_all = table.get(('', None, ''))
+    default = Value(catch_all.fine_per_day if catch_all else default_rate, output_field=money)
+
+    whens = []
+    for mask in SPECIFICITY[:-1]:
+        for (user_type, category_id, book_format), policy in table.items():
+            if (bool(user_type), category_id is not None, bool(book_format)) != mask:
+                continue
+            condition = Q()
+            if user_type:
+                condition &= Q(user__user_type=user_type)
+            if category_id is not None:
+                condition &= Q(book_copy__book__category_id=category_id)
+            if book_format:
+                condition &= Q(book_copy__book__format=book_format)
+            whens.append(When(condition, then=Value(policy.fine_per_day, output_field=money)))
+    if not whens:
+        return default
+    return Case(*whens, default=default, output_field=money)
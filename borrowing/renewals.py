@@ -0,0 +1,157 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .events import record_events
+from .summaries import loans_renewed
+from .models import BorrowTransaction, BorrowingHistory
+from .policies import resolve
+
+
+class RenewalRules:
+    """
+    Evaluates renewal eligibility for a set of borrow transactions.
+
+    The number of queries is fixed regardless of how many transactions are
+    evaluated: one for competing reservations and one for fine balances.
+    """
+
+    MAX_RENEWALS_ERROR = "This book has already been renewed the maximum number of times ({max_renewals})."
+    RESERVED_ERROR = "This book is reserved by another user and cannot be renewed."
+    FINES_ERROR = "You have unpaid fines. Please pay all fines before renewing books."
+
+    def __init__(self, transactions):
+        self.transactions = list(transactions)
+        self.errors = {}
+        self._evaluate()
+
+    def _evaluate(self):
+        if not self.transactions:
+            return
+
+        from books.models import BookReservation
+        from fines.models import FineAccount
+
+        book_ids = {t.book_copy.book_id for t in self.transactions}
+        user_ids = {t.user_id for t in self.transactions}
+
+        reserving_users = {}
+        # Holds past their deadline no longer block, even before the sweeper runs
+        for book_id, user_id in BookReservation.objects.filter(
+            book_id__in=book_ids, status='active', expires_at__gte=timezone.now()
+        ).values_list('book_id', 'user_id'):
+            reserving_users.setdefault(book_id, set()).add(user_id)
+
+        users_with_fines = set(
+            FineAccount.objects.filter(
+                pk__in=user_ids, outstanding_balance__gt=0
+            ).values_list('pk', flat=True)
+        )
+
+        # Checks are applied in the same order as the renew page has always
+        # used, so the last failing rule determines the message shown.
+        for t in self.transactions:
+            error = None
+            if t.renewal_count >= t.max_renewals_allowed:
+                error = self.MAX_RENEWALS_ERROR.format(max_renewals=t.max_renewals_allowed)
+            if reserving_users.get(t.book_copy.book_id, set()) - {t.user_id}:
+                error = self.RESERVED_ERROR
+            if t.user_id in users_with_fines:
+                error = self.FINES_ERROR
+            self.errors[t.id] = error
+
+    def can_renew(self, transaction):
+        return transaction.id in self.errors and self.errors[transaction.id] is None
+
+    def error_for(self, transaction):
+        return self.errors.get(transaction.id)
+
+    @property
+    def eligible(self):
+        return [t for t in self.transactions if self.can_renew(t)]
+
+    def annotate(self):
+        """Sets ``renewal_allowed`` and ``renewal_error`` on each transaction."""
+        for t in self.transactions:
+            t.renewal_allowed = self.can_renew(t)
+            t.renewal_error = self.error_for(t)
+        return self.transactions
+
+
+def get_renewal_due_date(transaction, now=None):
+    """Due date after renewing ``transaction`` now, per its loan policy."""
+    policy = resolve(transaction.user.user_type, transaction.book_copy.book.category_id, transaction.book_copy.book.format)
+    return (now or timezone.now()) + timedelta(days=policy.loan_days)
+
+
+def renew_transactions(transactions, librarian=None):
+    """
+    Pushes the due date of ``transactions`` out by one loan period with one
+    UPDATE per distinct loan period and logs the renewals with a single bulk
+    insert. Callers are expected to have checked eligibility with
+    ``RenewalRules`` first. The passed instances are updated in place.
+    """
+    transactions = list(transactions)
+    if not transactions:
+        return transactions
+
+    now = timezone.now()
+    by_due_date = defaultdict(list)
+    for t in transactions:
+        by_due_date[get_renewal_due_date(t, now=now)].append(t)
+
+    updates = {'renewal_count': F('renewal_count') + 1}
+    if librarian:
+        updates['librarian_issued'] = librarian
+
+    with db_transaction.atomic():
+        for new_due_date, group in by_due_date.items():
+            BorrowTransaction.objects.filter(
+                id__in=[t.id for t in group]
+            ).update(due_date=new_due_date, **updates)
+            for t in group:
+                t.due_date = new_due_date
+
+        BorrowingHistory.objects.bulk_create([
+            BorrowingHistory(
+                user_id=t.user_id,
+                book_id=t.book_copy.book_id,
+                branch_id=t.book_copy.branch_id,
+                borrowed_date=t.borrowed_at,
+                renewal_count=t.renewal_count + 1,
+                action='renewed',
+            )
+            for t in transactions
+        ])
+
+        record_events('renew', [
+            {'borrow_transaction': t, 'due_date': t.due_date.isoformat()}
+            for t in transactions
+        ])
+        loans_renewed(transactions)
+
+    for t in transactions:
+        t.renewal_count += 1
+    return transactions
+
+
+def renew_all_eligible(user, librarian=None):
+    """
+    Renews every eligible active loan of ``user`` in a single database
+    transaction. Returns ``(renewed, skipped)`` lists of transactions.
+    """
+    with db_transaction.atomic():
+        transactions = list(
+            BorrowTransaction.objects.select_for_update().filter(
+                user=user, status='active'
+            ).select_related('user', 'book_copy__book')
+        )
+        rules = RenewalRules(transactions)
+        renewed = rules.eligible
+        skipped = [t for t in transactions if not rules.can_renew(t)]
+        renew_transactions(renewed, librarian=librarian)
+
+    return renewed, skipped
@@ -0,0 +1,305 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import BorrowTransaction, BorrowingHistory, CirculationEvent, DailyCirculationStat
+
+COUNTER_FIELDS = ['checkouts', 'returns', 'renewals', 'overdues', 'active_members']
+AMOUNT_FIELDS = ['fines_issued', 'fines_paid']
+METRIC_FIELDS = COUNTER_FIELDS + AMOUNT_FIELDS
+
+
+def _empty_metrics():
+    metrics = {field: 0 for field in COUNTER_FIELDS}
+    metrics.update({field: Decimal('0.00') for field in AMOUNT_FIELDS})
+    return metrics
+
+
+def _aware(day):
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_current_timezone())
+
+
+# Rebuilding closed days from the source tables
+
+def _grouped(queryset, date_field, branch, category, user_type, aggregate=None):
+    """
+    Groups ``queryset`` by local date of ``date_field`` and the three rollup
+    dimensions (given as lookup paths). With ``aggregate`` each row carries a
+    ``total``; without it the rows are the distinct groups.
+    """
+    queryset = queryset.order_by().values(
+        d_date=TruncDate(date_field),
+        d_branch=F(branch),
+        d_category=F(category),
+        d_user_type=F(user_type),
+    )
+    if aggregate is None:
+        return queryset.distinct()
+    return queryset.annotate(total=aggregate)
+
+
+LOAN_DIMENSIONS = ('book_copy__branch', 'book_copy__book__category', 'user__user_type')
+
+
+def _collect(start, end):
+    """Computes every metric for local dates in [start, end) from source tables."""
+    from fines.models import Fine, FinePayment
+
+    lower, upper = _aware(start), _aware(end)
+    rows = defaultdict(_empty_metrics)
+
+    def add(field, grouped):
+        for row in grouped:
+            row_key = (row['d_date'], row['d_branch'], row['d_category'], row['d_user_type'] or '')
+            rows[row_key][field] += row['total'] or 0
+
+    loans = BorrowTransaction.objects.all()
+    add('checkouts', _grouped(
+        loans.filter(borrowed_at__gte=lower, borrowed_at__lt=upper),
+        'borrowed_at', *LOAN_DIMENSIONS, aggregate=Count('id'),
+    ))
+    add('returns', _grouped(
+        loans.filter(returned_at__gte=lower, returned_at__lt=upper),
+        'returned_at', *LOAN_DIMENSIONS, aggregate=Count('id'),
+    ))
+    add('overdues', _grouped(
+        loans.filter(due_date__gte=lower, due_date__lt=upper).filter(
+            Q(returned_at__isnull=True, status__in=['active', 'overdue', 'renewed'])
+            | Q(returned_at__gt=F('due_date'))
+        ),
+        'due_date', *LOAN_DIMENSIONS, aggregate=Count('id'),
+    ))
+    add('renewals', _grouped(
+        BorrowingHistory.objects.filter(action='renewed', created_at__gte=lower, created_at__lt=upper),
+        'created_at', 'branch', 'book__category', 'user__user_type', aggregate=Count('id'),
+    ))
+    # Money comes from the event stream, as in ``apply_events``, so payments
+    # recorded without a FinePayment row (admin actions) count the same way.
+    # The stream starts when it was deployed; earlier days fall back to the
+    # fine and payment rows, which is all there is for them.
+    events = CirculationEvent.objects.all()
+    money = (
+        ('fine_issued', 'fines_issued', Fine.objects.all(), 'issued_date', (
+            'borrow_transaction__book_copy__branch', 'borrow_transaction__book_copy__book__category', 'user__user_type',
+        )),
+        ('payment', 'fines_paid', FinePayment.objects.all(), 'payment_date', (
+            'fine__borrow_transaction__book_copy__branch', 'fine__borrow_transaction__book_copy__book__category',
+            'fine__user__user_type',
+        )),
+    )
+    for event_type, field, source, date_field, dimensions in money:
+        first = events.filter(event_type=event_type).order_by('occurred_at').values_list('occurred_at', flat=True).first()
+        streamed_from = max(lower, first) if first else upper
+        if streamed_from < upper:
+            add(field, _grouped(
+                events.filter(event_type=event_type, occurred_at__gte=streamed_from, occurred_at__lt=upper),
+                'occurred_at', 'branch', 'book__category', 'user__user_type', aggregate=Sum('amount'),
+            ))
+        if lower < streamed_from:
+            add(field, _grouped(
+                source.filter(**{f'{date_field}__gte': lower, f'{date_field}__lt': min(streamed_from, upper)}),
+                date_field, *dimensions, aggregate=Sum('amount'),
+            ))
+
+    # Members who borrowed or returned something, counted once per row
+    members = defaultdict(set)
+    for date_field in ('borrowed_at', 'returned_at'):
+        active = _grouped(
+            loans.filter(**{f'{date_field}__gte': lower, f'{date_field}__lt': upper}),
+            date_field, *LOAN_DIMENSIONS,
+        ).values('d_date', 'd_branch', 'd_category', 'd_user_type', 'user_id')
+        for row in active:
+            row_key = (row['d_date'], row['d_branch'], row['d_category'], row['d_user_type'] or '')
+            members[row_key].add(row['user_id'])
+    for row_key, user_ids in members.items():
+        rows[row_key]['active_members'] = len(user_ids)
+
+    return rows
+
+
+def rebuild_daily_stats(start, end=None):
+    """
+    Recomputes the rollup rows for local dates in [start, end) from the source
+    tables, one month per transaction. ``end`` defaults to today, so the
+    current (still open) day is left to the event consumer.
+    Returns the number of rollup rows written.
+    """
+    end = end or timezone.localdate()
+    written = 0
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min((chunk_start.replace(day=1) + timedelta(days=32)).replace(day=1), end)
+        rows = _collect(chunk_start, chunk_end)
+        with transaction.atomic():
+            DailyCirculationStat.objects.filter(date__gte=chunk_start, date__lt=chunk_end).delete()
+            DailyCirculationStat.objects.bulk_create([
+                DailyCirculationStat(
+                    date=day, branch_id=branch_id, category_id=category_id, user_type=user_type, **metrics
+                )
+                for (day, branch_id, category_id, user_type), metrics in rows.items()
+            ])
+        written += len(rows)
+        chunk_start = chunk_end
+    return written
+
+
+# Live updates for the current day
+
+EVENT_METRICS = {
+    'checkout': 'checkouts',
+    'return': 'returns',
+    'renew': 'renewals',
+    'fine_issued': 'fines_issued',
+    'payment': 'fines_paid',
+}
+
+
+def apply_events(events, today=None):
+    """
+    Adds today's events to the current day's rollup rows. Events from earlier
+    days are skipped: closed days are owned by ``rebuild_daily_stats``.
+    """
+    from accounts.models import User
+    from books.models import Book
+
+    today = today or timezone.localdate()
+    events = [
+        e for e in events
+        if e.event_type in EVENT_METRICS and timezone.localdate(e.occurred_at) == today
+    ]
+    if not events:
+        return
+
+    categories = dict(
+        Book.objects.filter(id__in={e.book_id for e in events if e.book_id}).values_list('id', 'category_id')
+    )
+    user_types = dict(
+        User.objects.filter(id__in={e.user_id for e in events if e.user_id}).values_list('id', 'user_type')
+    )
+
+    deltas = defaultdict(_empty_metrics)
+    for e in events:
+        row_key = (e.branch_id, categories.get(e.book_id), user_types.get(e.user_id, ''))
+        field = EVENT_METRICS[e.event_type]
+        deltas[row_key][field] += (e.amount or 0) if field in AMOUNT_FIELDS else 1
+
+    existing = {
+        (row.branch_id, row.category_id, row.user_type): row
+        for row in DailyCirculationStat.objects.filter(date=today)
+    }
+    to_create, to_update = [], []
+    for row_key, changes in deltas.items():
+        row = existing.get(row_key)
+        if row is None:
+            branch_id, category_id, user_type = row_key
+            row = DailyCirculationStat(date=today, branch_id=branch_id, category_id=category_id, user_type=user_type)
+            to_create.append(row)
+        else:
+            to_update.append(row)
+        for field, delta in changes.items():
+            setattr(row, field, getattr(row, field) + delta)
+
+    DailyCirculationStat.objects.bulk_create(to_create)
+    DailyCirculationStat.objects.bulk_update(to_update, list(EVENT_METRICS.values()))
+
+
+# Query API
+
+def _filtered(queryset, branch=None, category=None, user_type=None):
+    if branch is not None:
+        queryset = queryset.filter(branch=branch)
+    if category is not None:
+        queryset = queryset.filter(category=category)
+    if user_type is not None:
+        queryset = queryset.filter(user_type=user_type)
+    return queryset
+
+
+def totals(start, end, **filters):
+    """Sums every metric over local dates in [start, end] with one query."""
+    queryset = _filtered(DailyCirculationStat.objects.filter(date__gte=start, date__lte=end), **filters)
+
+    result = _empty_metrics()
+    sums = queryset.aggregate(**{field: Sum(field) for field in METRIC_FIELDS})
+    result.update({field: value for field, value in sums.items() if value is not None})
+    return result
+
+
+def last_n_days(days, today=None, **filters):
+    today = today or timezone.localdate()
+    return totals(today - timedelta(days=days - 1), today, **filters)
+
+
+def month_to_date(today=None, **filters):
+    today = today or timezone.localdate()
+    return totals(today.replace(day=1), today, **filters)
+
+
+def _same_day_last_year(today):
+    try:
+        return today.replace(year=today.year - 1)
+    except ValueError:
+        # 29 February
+        return today.replace(year=today.year - 1, day=28)
+
+
+def _compare(current, previous):
+    change = {
+        field: (round((current[field] - previous[field]) * 100 / previous[field], 1) if previous[field] else None)
+        for field in METRIC_FIELDS
+    }
+    return {'current': current, 'previous': previous, 'change': change}
+
+
+def year_over_year(today=None, **filters):
+    """
+    Compares year-to-date totals with the same span of the previous year.
+    Returns ``{'current': ..., 'previous': ..., 'change': ...}`` where change
+    is the percentage difference per metric (None when the previous value is 0).
+    """
+    today = today or timezone.localdate()
+    last_year_today = _same_day_last_year(today)
+    current = totals(today.replace(month=1, day=1), today, **filters)
+    previous = totals(last_year_today.replace(month=1, day=1), last_year_today, **filters)
+    return _compare(current, previous)
+
+
+def overview(days=30, today=None, **filters):
+    """
+    ``last_n_days(days)``, ``month_to_date()`` and ``year_over_year()`` from
+    one aggregate with a filtered sum per window, for dashboards showing all
+    three. Returns ``{'last_n_days': ..., 'month_to_date': ..., 'year_over_year': ...}``.
+    """
+    today = today or timezone.localdate()
+    last_year_today = _same_day_last_year(today)
+    windows = {
+        'recent': (today - timedelta(days=days - 1), today),
+        'mtd': (today.replace(day=1), today),
+        'ytd': (today.replace(month=1, day=1), today),
+        'previous_ytd': (last_year_today.replace(month=1, day=1), last_year_today),
+    }
+    earliest = min(start for start, _ in windows.values())
+    queryset = _filtered(DailyCirculationStat.objects.filter(date__gte=earliest, date__lte=today), **filters)
+    sums = queryset.aggregate(**{
+        f'{name}_{field}': Sum(field, filter=Q(date__gte=start, date__lte=end))
+        for name, (start, end) in windows.items()
+        for field in METRIC_FIELDS
+    })
+
+    results = {}
+    for name in windows:
+        metrics = _empty_metrics()
+        for field in METRIC_FIELDS:
+            if sums[f'{name}_{field}'] is not None:
+                metrics[field] = sums[f'{name}_{field}']
+        results[name] = metrics
+    return {
+        'last_n_days': results['recent'],
+        'month_to_date': results['mtd'],
+        'year_over_year': _compare(results['ytd'], results['previous_ytd']),
+    }
@@ -0,0 +1,170 @@
+from datetime import datetime
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Count
+
+from .models import AccountSummary, BorrowTransaction
+
+SUMMARY_FIELDS = ['lifetime_borrows', 'active_reservations', 'loan_due_dates']
+
+
+def _source_values(user_ids):
+    """``{user_id: {field: value}}`` computed from the loan and reservation tables."""
+    from books.models import BookReservation
+
+    values = {
+        user_id: {'lifetime_borrows': 0, 'active_reservations': 0, 'loan_due_dates': {}}
+        for user_id in user_ids
+    }
+    borrows = BorrowTransaction.objects.filter(user_id__in=user_ids).order_by().values('user_id').annotate(n=Count('id'))
+    for row in borrows:
+        values[row['user_id']]['lifetime_borrows'] = row['n']
+    active = BorrowTransaction.objects.filter(user_id__in=user_ids, status='active').order_by()
+    for pk, user_id, due_date in active.values_list('pk', 'user_id', 'due_date'):
+        values[user_id]['loan_due_dates'][str(pk)] = due_date.isoformat()
+    reservations = BookReservation.objects.filter(user_id__in=user_ids, status='active').order_by().values('user_id').annotate(n=Count('id'))
+    for row in reservations:
+        values[row['user_id']]['active_reservations'] = row['n']
+    return values
+
+
+def _build(user_ids):
+    """Writes the summaries of ``user_ids`` from the source tables."""
+    values = _source_values(user_ids)
+    AccountSummary.objects.bulk_create(
+        [AccountSummary(user_id=user_id, **fields) for user_id, fields in values.items()],
+        update_conflicts=True, unique_fields=['user'], update_fields=SUMMARY_FIELDS,
+    )
+    return len(values)
+
+
+def get_summary(user):
+    """``user``'s summary, built from the source tables on first use."""
+    summary = AccountSummary.objects.filter(pk=user.pk).first()
+    if summary is None:
+        _build([user.pk])
+        summary = AccountSummary.objects.get(pk=user.pk)
+    return summary
+
+
+def lock_summary(user):
+    """
+    ``user``'s summary locked for the rest of the transaction, so checks
+    made against it (the loan limit) hold until the change is written.
+    """
+    summary = AccountSummary.objects.select_for_update().filter(pk=user.pk).first()
+    if summary is None:
+        _build([user.pk])
+        summary = AccountSummary.objects.select_for_update().get(pk=user.pk)
+    return summary
+
+
+def _update(changes):
+    """
+    Applies ``{user_id: change}`` callables to the locked summaries. Users
+    without a summary yet get one built from the source tables instead, which
+    already include the change.
+    """
+    if not changes:
+        return
+    with transaction.atomic():
+        summaries = AccountSummary.objects.select_for_update().in_bulk(list(changes))
+        for user_id, summary in summaries.items():
+            changes[user_id](summary)
+        AccountSummary.objects.bulk_update(summaries.values(), SUMMARY_FIELDS)
+        missing = changes.keys() - summaries.keys()
+        if missing:
+            _build(missing)
+
+
+def _per_user(loans, change):
+    by_user = {}
+    for loan in loans:
+        by_user.setdefault(loan.user_id, []).append(loan)
+    return {user_id: partial(change, loans=group) for user_id, group in by_user.items()}
+
+
+def _open(summary, loans):
+    for loan in loans:
+        summary.loan_due_dates[str(loan.pk)] = loan.due_date.isoformat()
+    summary.lifetime_borrows += len(loans)
+
+
+def _close(summary, loans):
+    for loan in loans:
+        summary.loan_due_dates.pop(str(loan.pk), None)
+
+
+def _move_due_dates(summary, loans):
+    for loan in loans:
+        if str(loan.pk) in summary.loan_due_dates:
+            summary.loan_due_dates[str(loan.pk)] = loan.due_date.isoformat()
+
+
+def loans_opened(loans):
+    _update(_per_user(loans, _open))
+
+
+def loans_closed(loans):
+    _update(_per_user(loans, _close))
+
+
+def loans_renewed(loans):
+    """Records the new due dates of renewed ``loans``."""
+    _update(_per_user(loans, _move_due_dates))
+
+
+def reservations_changed(deltas):
+    """Adjusts active reservation counts by ``{user_id: delta}``."""
+    def change(delta):
+        def apply(summary):
+            summary.active_reservations = max(summary.active_reservations + delta, 0)
+        return apply
+    _update({user_id: change(delta) for user_id, delta in deltas.items() if delta})
+
+
+def _same(summary, fields):
+    def due_dates(values):
+        return {pk: datetime.fromisoformat(value) for pk, value in values.items()}
+    return (
+        summary.lifetime_borrows == fields['lifetime_borrows']
+        and summary.active_reservations == fields['active_reservations']
+        and due_dates(summary.loan_due_dates) == due_dates(fields['loan_due_dates'])
+    )
+
+
+def _user_chunks(chunk_size):
+    from accounts.models import User
+
+    last_id = 0
+    while True:
+        user_ids = list(User.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not user_ids:
+            return
+        yield user_ids
+        last_id = user_ids[-1]
+
+
+def rebuild_summaries(chunk_size=1000):
+    """Recomputes every user's summary, ``chunk_size`` users per transaction. Returns the number written."""
+    written = 0
+    for user_ids in _user_chunks(chunk_size):
+        with transaction.atomic():
+            written += _build(user_ids)
+    return written
+
+
+def verify_summaries(chunk_size=1000):
+    """
+    Ids of users whose stored summary differs from the source tables. Users
+    without one are skipped; theirs is built when first read.
+    """
+    mismatched = []
+    for user_ids in _user_chunks(chunk_size):
+        with transaction.atomic():
+            stored = AccountSummary.objects.in_bulk(user_ids)
+            for user_id, fields in _source_values(user_ids).items():
+                if user_id in stored and not _same(stored[user_id], fields):
+                    mismatched.append(user_id)
+    return mismatched
@@ -1,3 +1,527 @@
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts import audit
+from accounts.models import User
+from books.holds import expire_holds
+from books.models import Book, BookCopy, BookReservation, Category
+from fines.models import Fine, FinePayment, FineType
+from library_branches.models import LibraryBranch
+from . import policies, stats, summaries
+from .archive import archive_history, combined_history, get_archive_cutoff, history_count
+from .consumers import BookCirculationStatsConsumer
+from .events import committed_through, record_event
+from .loan_lengths import build_histograms, estimate_wait, wait_percentiles
+from .models import (
+    AccountSummary, ArchivedBorrowingHistory, BookCirculationStats, BorrowingHistory, BorrowTransaction,
+    CirculationEvent, DailyCirculationStat, DueNotice, EventConsumerWatermark, LoanPolicy,
+)
+from .notifications import claim_notices, collect_digests
+from .renewals import RenewalRules, renew_all_eligible, renew_transactions
+
+
+def make_branch(code='MAIN'):
+    return LibraryBranch.objects.create(
+        name=f'{code} branch', code=code, address='1 Main Street', phone_number='+9601234567',
+        email=f'{code.lower()}@library.example', manager_name='Manager',
+        established_date=date(2020, 1, 1), total_capacity=1000,
+    )
+
+
+def make_member(username, **kwargs):
+    return User.objects.create_user(
+        username=username, password='pw', email=f'{username}@example.com', user_type='member', **kwargs
+    )
+
+
+def make_copy(branch, title='Book', status='available', **kwargs):
+    book = Book.objects.create(
+        isbn=f'978{Book.objects.count():010d}', title=title, publication_date=date(2000, 1, 1), pages=100, **kwargs
+    )
+    return BookCopy.objects.create(
+        book=book, branch=branch, copy_number='1', status=status, acquisition_date=date(2020, 1, 1),
+    )
+
+
+def make_loan(user, copy, days_left=7, **kwargs):
+    copy.status = 'borrowed'
+    copy.save()
+    return BorrowTransaction.objects.create(
+        user=user, book_copy=copy, due_date=timezone.now() + timedelta(days=days_left), status='active', **kwargs
+    )
+
+
+class RenewalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.branch = make_branch()
+        cls.member = make_member('borrower')
+        cls.other = make_member('waiting')
+
+    def test_eligible_loan(self):
+        loan = make_loan(self.member, make_copy(self.branch))
+        rules = RenewalRules([loan])
+        self.assertTrue(rules.can_renew(loan))
+        self.assertIsNone(rules.error_for(loan))
+
+    def test_renewal_limit(self):
+        loan = make_loan(self.member, make_copy(self.branch), renewal_count=2, max_renewals_allowed=2)
+        self.assertEqual(RenewalRules([loan]).error_for(loan), RenewalRules.MAX_RENEWALS_ERROR.format(max_renewals=2))
+
+    def test_reserved_by_another_member(self):
+        loan = make_loan(self.member, make_copy(self.branch))
+        BookReservation.objects.create(
+            user=self.other, book=loan.book_copy.book, branch=self.branch,
+            status='active', expires_at=timezone.now() + timedelta(days=1),
+        )
+        self.assertEqual(RenewalRules([loan]).error_for(loan), RenewalRules.RESERVED_ERROR)
+
+    def test_expired_and_own_reservations_do_not_block(self):
+        loan = make_loan(self.member, make_copy(self.branch))
+        for user, expires_at in [(self.other, timezone.now() - timedelta(hours=1)), (self.member, timezone.now() + timedelta(days=1))]:
+            BookReservation.objects.create(
+                user=user, book=loan.book_copy.book, branch=self.branch, status='active', expires_at=expires_at,
+            )
+        self.assertTrue(RenewalRules([loan]).can_renew(loan))
+
+    def test_outstanding_fines(self):
+        loan = make_loan(self.member, make_copy(self.branch))
+        Fine.objects.create(
+            user=self.member, fine_type=FineType.get_overdue_type(), amount=Decimal('0.50'),
+            due_date=timezone.now() + timedelta(days=30),
+        )
+        self.assertEqual(RenewalRules([loan]).error_for(loan), RenewalRules.FINES_ERROR)
+
+    def test_renew_transactions(self):
+        loan = make_loan(self.member, make_copy(self.branch), days_left=1)
+        old_due_date = loan.due_date
+        renew_transactions([loan])
+        loan.refresh_from_db()
+        self.assertEqual(loan.renewal_count, 1)
+        self.assertGreater(loan.due_date, old_due_date)
+        self.assertTrue(BorrowingHistory.objects.filter(user=self.member, action='renewed').exists())
+
+    def test_renew_all_eligible_skips_ineligible(self):
+        eligible = make_loan(self.member, make_copy(self.branch))
+        at_limit = make_loan(self.member, make_copy(self.branch), renewal_count=2, max_renewals_allowed=2)
+        renewed, skipped = renew_all_eligible(self.member)
+        self.assertEqual(renewed, [eligible])
+        self.assertEqual(skipped, [at_limit])
+
+
+class HistoryArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = make_member('reader')
+        cls.branch = make_branch()
+        cls.book = make_copy(cls.branch).book
+        cls.cutoff = get_archive_cutoff()
+
+    def history(self, days_before_cutoff):
+        return BorrowingHistory.objects.create(
+            user=self.member, book=self.book, branch=self.branch,
+            borrowed_date=self.cutoff - timedelta(days=days_before_cutoff),
+        )
+
+    def test_moves_only_old_rows_in_chunks(self):
+        old = [self.history(days) for days in (10, 20, 30)]
+        recent = self.history(-10)
+
+        self.assertEqual(archive_history(self.cutoff, chunk_size=2, max_chunks=1), 2)
+        self.assertEqual(archive_history(self.cutoff, chunk_size=2), 1)
+        self.assertEqual(archive_history(self.cutoff), 0)
+
+        self.assertEqual(list(BorrowingHistory.objects.values_list('pk', flat=True)), [recent.pk])
+        self.assertEqual(
+            set(ArchivedBorrowingHistory.objects.values_list('original_id', flat=True)), {row.pk for row in old}
+        )
+
+    def test_rerun_after_an_interrupted_copy(self):
+        row = self.history(10)
+        # Copied but not yet deleted when the previous run stopped
+        ArchivedBorrowingHistory.objects.create(
+            original_id=row.pk, user=self.member, book=self.book, branch=row.branch, borrowed_date=row.borrowed_date,
+        )
+        self.assertEqual(archive_history(self.cutoff), 1)
+        self.assertEqual(ArchivedBorrowingHistory.objects.count(), 1)
+        self.assertFalse(BorrowingHistory.objects.exists())
+
+    def test_reads_span_both_tables(self):
+        self.history(10)
+        self.history(-10)
+        archive_history(self.cutoff)
+
+        self.assertEqual(history_count(user=self.member), 2)
+        self.assertEqual(len(combined_history(user=self.member)), 2)
+        self.assertEqual(len(combined_history(since=self.cutoff, user=self.member)), 1)
+        rows = combined_history(since=self.cutoff - timedelta(days=20), user=self.member)
+        self.assertEqual([row['book_title'] for row in rows], [self.book.title, self.book.title])
+        self.assertGreater(rows[0]['borrowed_date'], rows[1]['borrowed_date'])
+
+
+class DueNoticeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.localdate()
+        cls.member = make_member('reader')
+        cls.branch = make_branch()
+
+    def loan_due(self, days_from_today):
+        loan = make_loan(self.member, make_copy(self.branch))
+        due = timezone.make_aware(datetime.combine(self.today + timedelta(days=days_from_today), time(12)))
+        BorrowTransaction.objects.filter(pk=loan.pk).update(due_date=due)
+        return loan
+
+    def test_one_digest_per_member(self):
+        soon = self.loan_due(3)
+        late = self.loan_due(-7)
+        self.loan_due(5)
+
+        digests = collect_digests(today=self.today)
+        self.assertEqual(len(digests), 1)
+        self.assertEqual([entry['notice'][0] for entry in digests[0]['due_soon']], [soon.pk])
+        self.assertEqual([entry['notice'][0] for entry in digests[0]['overdue']], [late.pk])
+
+    def test_notices_are_claimed_once(self):
+        self.loan_due(3)
+        digests = collect_digests(today=self.today)
+        self.assertEqual(len(claim_notices(digests)), 1)
+        # An overlapping run that collected the same loans claims nothing
+        self.assertEqual(claim_notices(digests), [])
+        self.assertEqual(collect_digests(today=self.today), [])
+        self.assertEqual(DueNotice.objects.count(), 1)
+
+    def test_renewed_loan_is_reminded_again(self):
+        loan = self.loan_due(3)
+        claim_notices(collect_digests(today=self.today))
+        loan.refresh_from_db()
+        BorrowTransaction.objects.filter(pk=loan.pk).update(due_date=loan.due_date + timedelta(days=14))
+        self.assertEqual(len(collect_digests(today=self.today + timedelta(days=14))), 1)
+
+    def test_rerunning_the_command_sends_nothing(self):
+        self.loan_due(3)
+        self.loan_due(-1)
+        call_command('send_due_notices', stdout=StringIO())
+        call_command('send_due_notices', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.member.email])
+
+
+class AccrualTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = make_member('reader')
+        cls.branch = make_branch()
+
+    def setUp(self):
+        policies.invalidate()
+        self.addCleanup(policies.invalidate)
+
+    def loans(self):
+        return [
+            make_loan(self.member, make_copy(self.branch), days_left=days_left)
+            for days_left in (-3, -10, 5)
+        ]
+
+    def test_matches_the_python_properties(self):
+        loans = self.loans()
+        BorrowTransaction.objects.filter(pk=loans[1].pk).update(status='returned')
+        annotated = {loan.pk: loan for loan in BorrowTransaction.objects.with_accrual()}
+
+        for loan in BorrowTransaction.objects.all():
+            row = annotated[loan.pk]
+            self.assertEqual(
+                (row.is_overdue, row.days_overdue, row.fine_amount),
+                (loan.is_overdue, loan.days_overdue, loan.fine_for(loan.policy)),
+            )
+        self.assertEqual([annotated[loan.pk].days_overdue for loan in loans], [3, 0, 0])
+
+    def test_fine_type_rate_and_cap(self):
+        overdue_3, overdue_10, _ = self.loans()
+        fine_type = FineType.objects.create(
+            name='Capped overdue', description='Per day, capped', default_amount=Decimal('0.50'),
+            is_per_day=True, max_amount=Decimal('4.00'),
+        )
+        fines = dict(BorrowTransaction.objects.with_accrual(fine_type=fine_type).values_list('pk', 'accrued_fine'))
+        self.assertEqual(fines[overdue_3.pk], Decimal('1.50'))
+        self.assertEqual(fines[overdue_10.pk], Decimal('4.00'))
+
+    def test_as_of(self):
+        loan = make_loan(self.member, make_copy(self.branch), days_left=2)
+        later = BorrowTransaction.objects.with_accrual(as_of=loan.due_date + timedelta(days=4)).get()
+        self.assertEqual((later.is_overdue, later.days_overdue), (True, 4))
+        self.assertFalse(BorrowTransaction.objects.with_accrual().get().is_overdue)
+
+
+class LoanPolicyTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fiction = Category.objects.create(name='Fiction')
+
+    def setUp(self):
+        policies.invalidate()
+        self.addCleanup(policies.invalidate)
+
+    def policy(self, loan_days, user_type='', category=None, book_format='', fine_per_day='1.00'):
+        return LoanPolicy.objects.create(
+            user_type=user_type, category=category, book_format=book_format, loan_days=loan_days,
+            max_renewals=2, max_loans=5, fine_per_day=Decimal(fine_per_day),
+        )
+
+    def test_most_specific_policy_wins(self):
+        self.policy(21)
+        self.policy(7, category=self.fiction)
+        self.policy(3, user_type='member', book_format='ebook')
+        self.policy(2, user_type='member', category=self.fiction, book_format='ebook')
+
+        self.assertEqual(policies.resolve('member', self.fiction.pk, 'ebook').loan_days, 2)
+        self.assertEqual(policies.resolve('member', None, 'ebook').loan_days, 3)
+        self.assertEqual(policies.resolve('member', self.fiction.pk, 'paperback').loan_days, 7)
+        self.assertEqual(policies.resolve('librarian', None, 'audiobook').loan_days, 21)
+
+    def test_falls_back_to_settings(self):
+        self.policy(7, category=self.fiction)
+        policy = policies.resolve('member', None, 'paperback')
+        self.assertIsNone(policy.pk)
+        self.assertEqual(policy.loan_days, policies.default_policy().loan_days)
+
+    def test_edits_and_deletes_take_effect(self):
+        policy = self.policy(7, user_type='member')
+        self.assertEqual(policies.resolve('member', None, '').loan_days, 7)
+        policy.loan_days = 10
+        policy.save()
+        self.assertEqual(policies.resolve('member', None, '').loan_days, 10)
+        policy.is_active = False
+        policy.save()
+        self.assertIsNone(policies.resolve('member', None, '').pk)
+        policy.delete()
+        self.assertEqual(policies.get_table(), {})
+
+    def test_sql_fine_rate_follows_policies(self):
+        self.policy(14, fine_per_day='0.25')
+        self.policy(7, category=self.fiction, fine_per_day='2.00')
+        branch = make_branch()
+        member = make_member('reader')
+        novel = make_loan(member, make_copy(branch, 'Novel', category=self.fiction), days_left=-2)
+        atlas = make_loan(member, make_copy(branch, 'Atlas'), days_left=-2)
+
+        fines = dict(BorrowTransaction.objects.with_accrual().values_list('pk', 'accrued_fine'))
+        self.assertEqual(fines, {novel.pk: Decimal('4.00'), atlas.pk: Decimal('0.50')})
+        for loan in (novel, atlas):
+            self.assertEqual(BorrowTransaction.objects.get(pk=loan.pk).fine_amount, fines[loan.pk])
+
+
+class WaitEstimateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_turns_add_whole_loans(self):
+        # Every loan lasts ten days, so the first turn waits 0-9 days
+        counts = [0] * 10 + [1]
+        low, days, high = wait_percentiles(counts, position=1, copies=1)
+        self.assertTrue(0 <= low <= days <= high <= 9)
+        self.assertEqual(wait_percentiles(counts, position=3, copies=1), [low + 20, days + 20, high + 20])
+        self.assertEqual(wait_percentiles(counts, position=2, copies=2), [low, days, high])
+
+    def test_long_queues_are_approximated(self):
+        counts = [0] * 10 + [1]
+        low, days, high = wait_percentiles(counts, position=40, copies=1)
+        self.assertIn(days, (394, 395))
+        self.assertTrue(390 <= low < days < high <= 399)
+
+    def test_estimate_from_history(self):
+        branch = make_branch()
+        member = make_member('reader')
+        copy = make_copy(branch)
+        for days in (7, 14, 21):
+            BorrowingHistory.objects.create(
+                user=member, book=copy.book, branch=branch, borrowed_date=timezone.now() - timedelta(days=60),
+                days_borrowed=days, action='returned',
+            )
+        self.assertEqual(estimate_wait(copy.book, branch, 1), {'days': 0, 'low': 0, 'high': 0})
+
+        make_loan(member, copy)
+        self.assertIsNone(estimate_wait(copy.book, branch, 1))
+        self.assertEqual(build_histograms(), 1)
+        first, second = estimate_wait(copy.book, branch, 1), estimate_wait(copy.book, branch, 2)
+        self.assertLessEqual(first['high'], 21)
+        self.assertGreater(second['days'], first['days'])
+
+
+class EventConsumerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.loan = make_loan(make_member('reader'), make_copy(make_branch()))
+
+    def stats(self):
+        return BookCirculationStats.objects.get(book=self.loan.book_copy.book)
+
+    def test_folds_each_event_once(self):
+        for event_type in ['checkout', 'renew', 'return']:
+            record_event(event_type, borrow_transaction=self.loan)
+        record_event('fine_issued', user=self.loan.user)
+        consumer = BookCirculationStatsConsumer()
+
+        self.assertEqual(consumer.run(), 3)
+        self.assertEqual(consumer.run(), 0)
+        stats = self.stats()
+        self.assertEqual((stats.checkouts, stats.renewals, stats.returns, stats.active_loans), (1, 1, 1, 0))
+        watermark = EventConsumerWatermark.objects.get(name=consumer.name)
+        self.assertEqual(watermark.last_event_id, CirculationEvent.objects.order_by('id').last().id)
+
+        self.assertEqual(consumer.rebuild(), 3)
+        self.assertEqual(self.stats().checkouts, 1)
+
+    def test_waits_at_a_recent_gap_in_ids(self):
+        first = record_event('checkout', borrow_transaction=self.loan)
+        # An id left free as if its transaction had not committed yet
+        CirculationEvent.objects.create(id=first.id + 2, event_type='renew', book=self.loan.book_copy.book)
+        consumer = BookCirculationStatsConsumer()
+
+        self.assertEqual(consumer.run(), 1)
+        self.assertEqual(self.stats().renewals, 0)
+
+        CirculationEvent.objects.create(id=first.id + 1, event_type='checkout', book=self.loan.book_copy.book)
+        self.assertEqual(consumer.run(), 2)
+        stats = self.stats()
+        self.assertEqual((stats.checkouts, stats.renewals), (2, 1))
+
+    def test_passes_a_gap_once_it_is_old(self):
+        first = record_event('checkout', borrow_transaction=self.loan)
+        later = CirculationEvent.objects.create(id=first.id + 2, event_type='renew', book=self.loan.book_copy.book)
+        CirculationEvent.objects.filter(pk=later.pk).update(recorded_at=timezone.now() - timedelta(hours=1))
+
+        self.assertEqual(BookCirculationStatsConsumer().run(), 2)
+        self.assertEqual(self.stats().renewals, 1)
+
+    def test_committed_through(self):
+        now = timezone.now()
+        old = now - timedelta(hours=1)
+        self.assertEqual(committed_through(5, [], now), 5)
+        self.assertEqual(committed_through(5, [(6, now), (7, now), (9, now), (10, now)], now), 7)
+        self.assertEqual(committed_through(5, [(6, now), (9, old), (10, now), (12, now)], now), 10)
+        self.assertEqual(committed_through(5, [(8, now)], now), 5)
+
+
+class DailyStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.loan = make_loan(make_member('reader'), make_copy(make_branch()))
+
+    def fine(self, amount, paid, days_ago):
+        fine = Fine.objects.create(
+            user=self.loan.user, fine_type=FineType.get_overdue_type(), borrow_transaction=self.loan,
+            amount=Decimal(amount), due_date=timezone.now(),
+        )
+        FinePayment.objects.create(fine=fine, amount=Decimal(paid), payment_method='cash')
+        when = timezone.now() - timedelta(days=days_ago)
+        Fine.objects.filter(pk=fine.pk).update(issued_date=when)
+        FinePayment.objects.filter(fine=fine).update(payment_date=when)
+        CirculationEvent.objects.filter(data__fine_id=fine.pk).update(occurred_at=when)
+        return timezone.localdate(when)
+
+    def money(self, day):
+        totals = stats.totals(day, day)
+        return totals['fines_issued'], totals['fines_paid']
+
+    def test_backfills_fines_from_before_the_event_stream(self):
+        old_day = self.fine('5.00', '2.00', days_ago=40)
+        CirculationEvent.objects.all().delete()
+        recent_day = self.fine('3.00', '3.00', days_ago=5)
+        # Paid outside FinePayment, so only the event stream knows about it
+        CirculationEvent.objects.create(
+            event_type='payment', user=self.loan.user, amount=Decimal('1.50'),
+            occurred_at=timezone.now() - timedelta(days=5),
+        )
+
+        stats.rebuild_daily_stats(old_day - timedelta(days=1))
+
+        self.assertEqual(self.money(old_day), (Decimal('5.00'), Decimal('2.00')))
+        self.assertEqual(self.money(recent_day), (Decimal('3.00'), Decimal('4.50')))
+        row = DailyCirculationStat.objects.get(date=old_day)
+        self.assertEqual((row.branch_id, row.user_type), (self.loan.book_copy.branch_id, 'member'))
+
+    def test_overview_matches_the_separate_queries(self):
+        today = timezone.localdate()
+        DailyCirculationStat.objects.create(date=today, user_type='member', checkouts=4, fines_issued=Decimal('2.00'))
+        DailyCirculationStat.objects.create(date=today - timedelta(days=40), user_type='member', checkouts=1)
+        DailyCirculationStat.objects.create(date=stats._same_day_last_year(today), user_type='member', checkouts=2)
+
+        overview = stats.overview(30, today=today)
+        self.assertEqual(overview['last_n_days'], stats.last_n_days(30, today=today))
+        self.assertEqual(overview['month_to_date'], stats.month_to_date(today=today))
+        self.assertEqual(overview['year_over_year'], stats.year_over_year(today=today))
+
+
+class AccountSummaryTests(TestCase):
+    def setUp(self):
+        # Logins and reservations are audited; keep the flusher thread from
+        # writing through its own connection while the test transaction is open
+        patcher = mock.patch.object(audit, '_start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(audit._pending.clear)
+
+        self.branch = make_branch()
+        self.member = make_member('reader')
+        self.client.force_login(self.member)
+
+    def assertInSync(self):
+        self.assertEqual(summaries.verify_summaries(), [])
+
+    def summary(self):
+        return AccountSummary.objects.get(pk=self.member.pk)
+
+    def test_checkout_return_and_renew(self):
+        copies = [make_copy(self.branch, f'Book {i}') for i in range(3)]
+        for copy in copies:
+            self.client.post(reverse('borrowing:borrow'), {'book_copy_id': copy.pk})
+        self.assertEqual(self.summary().active_loans, 3)
+        self.assertEqual(self.summary().lifetime_borrows, 3)
+        self.assertInSync()
+
+        loan = BorrowTransaction.objects.filter(user=self.member).first()
+        self.client.post(reverse('borrowing:return_confirmation', args=[loan.pk]))
+        self.assertEqual(self.summary().active_loans, 2)
+        self.assertEqual(self.summary().lifetime_borrows, 3)
+        self.assertInSync()
+
+        self.client.post(reverse('borrowing:renew_all'))
+        self.assertEqual(BorrowTransaction.objects.filter(user=self.member, renewal_count=1).count(), 2)
+        self.assertInSync()
+
+    def test_reserve_cancel_and_expire(self):
+        book = make_loan(make_member('holder'), make_copy(self.branch)).book_copy.book
+
+        self.client.post(reverse('books:reserve', args=[book.pk]))
+        self.assertEqual(self.summary().active_reservations, 1)
+        self.assertInSync()
+
+        reservation = BookReservation.objects.get(user=self.member)
+        self.client.post(reverse('books:reservation_cancel', args=[reservation.pk]))
+        self.assertEqual(self.summary().active_reservations, 0)
+        self.assertInSync()
+
+        self.client.post(reverse('books:reserve', args=[book.pk]))
+        BookReservation.objects.filter(user=self.member, status='active').update(expires_at=timezone.now() - timedelta(hours=1))
+        expire_holds()
+        self.assertEqual(self.summary().active_reservations, 0)
+        self.assertInSync()
 
-# Create your tests here.
+    def test_verify_reports_drift(self):
+        loan = make_loan(self.member, make_copy(self.branch))
+        summaries.get_summary(self.member)
+        BorrowTransaction.objects.filter(pk=loan.pk).update(due_date=loan.due_date + timedelta(days=3))
+        self.assertEqual(summaries.verify_summaries(), [self.member.pk])
+        summaries.rebuild_summaries()
+        self.assertInSync()
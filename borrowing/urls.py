@@ -18,6 +18,7 @@ urlpatterns = [
     path('return/', views.ReturnBookView.as_view(), name='return'),
     path('return/<int:transaction_id>/', views.ReturnConfirmationView.as_view(), name='return_confirmation'),
     path('renew/<int:transaction_id>/', views.RenewBookView.as_view(), name='renew'),
+    path('renew/all/', views.RenewAllView.as_view(), name='renew_all'),
     
     # Book browsing for borrowing
     path('browse/', views.BrowseBooksView.as_view(), name='browse_books'),
@@ -2,11 +2,20 @@ from django.shortcuts import render, redirect
 from django.views.generic import ListView, DetailView, TemplateView, View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
-from django.db.models import Q, Count
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Case, Count, Q, Value, When
 from django.utils import timezone
 from datetime import timedelta
 from decimal import Decimal
 from .models import BorrowTransaction, BorrowingHistory
+from .archive import combined_history, get_archive_cutoff
+from .events import record_event
+from .policies import policy_for
+from .renewals import RenewalRules, get_renewal_due_date, renew_all_eligible, renew_transactions
+from . import summaries
+from books.availability import pick_branch
+from books.holds import allocate_copy, fulfil_hold, held_copy_for
 from books.models import Book, BookCopy
 
 class BorrowingDashboardView(LoginRequiredMixin, TemplateView):
@@ -20,14 +29,13 @@ class BorrowingDashboardView(LoginRequiredMixin, TemplateView):
             user=user, status='active'
         ).select_related('book_copy__book')
         
-        context['current_borrowings_count'] = current_borrowings.count()
+        summary = summaries.get_summary(user)
+        context['summary'] = summary
+        context['current_borrowings_count'] = summary.active_loans
+        context['overdue_count'] = summary.overdue_loans()
+        context['total_borrowed'] = summary.lifetime_borrows
         
         today = timezone.now().date()
-        overdue_transactions = current_borrowings.filter(due_date__lt=today)
-        context['overdue_count'] = overdue_transactions.count()
-        
-        context['total_borrowed'] = BorrowingHistory.objects.filter(user=user).count()
-        
         context['available_books'] = BookCopy.objects.filter(
             status='available'
         ).count()
@@ -51,7 +59,14 @@ class CurrentBorrowingsView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         return BorrowTransaction.objects.filter(
             user=self.request.user, status='active'
-        ).select_related('book_copy__book').prefetch_related('book_copy__book__authors')
+        ).with_accrual().select_related('book_copy__book').prefetch_related('book_copy__book__authors')
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        rules = RenewalRules(context['transactions'])
+        context['transactions'] = context['object_list'] = rules.annotate()
+        context['renewable_count'] = len(rules.eligible)
+        return context
 
 class BorrowingHistoryView(LoginRequiredMixin, ListView):
     model = BorrowingHistory
@@ -59,10 +74,22 @@ class BorrowingHistoryView(LoginRequiredMixin, ListView):
     context_object_name = 'history'
     paginate_by = 20
     
+    def get_period(self):
+        return 'all' if self.request.GET.get('period') == 'all' else 'recent'
+    
     def get_queryset(self):
-        return BorrowingHistory.objects.filter(
-            user=self.request.user
-        ).select_related('book_copy__book').prefetch_related('book_copy__book__authors')
+        # Recent history comes from the hot table only; the full history
+        # also pulls in archived rows
+        if self.get_period() == 'all':
+            return combined_history(user=self.request.user)
+        return combined_history(
+            since=get_archive_cutoff(), include_archive=False, user=self.request.user
+        )
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['period'] = self.get_period()
+        return context
 
 class ReturnBookView(LoginRequiredMixin, TemplateView):
     template_name = 'borrowing/return.html'
@@ -72,53 +99,31 @@ class ReturnBookView(LoginRequiredMixin, TemplateView):
         context['active_transactions'] = BorrowTransaction.objects.filter(
             user=self.request.user,
             status='active'
-        ).select_related('book_copy__book').prefetch_related('book_copy__book__authors')
+        ).with_accrual().select_related('book_copy__book').prefetch_related('book_copy__book__authors')
         return context
 
 class RenewBookView(LoginRequiredMixin, TemplateView):
     template_name = 'borrowing/renew.html'
     
+    def get_transaction(self, transaction_id):
+        return BorrowTransaction.objects.select_related('user', 'book_copy__book').get(
+            id=transaction_id,
+            user=self.request.user,
+            status='active'
+        )
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         transaction_id = kwargs.get('transaction_id')
         
         try:
-            transaction = BorrowTransaction.objects.get(
-                id=transaction_id,
-                user=self.request.user,
-                status='active'
-            )
+            transaction = self.get_transaction(transaction_id)
             context['transaction'] = transaction
             
-            can_renew = True
-            renewal_error = None
-            
-            if transaction.renewal_count >= transaction.max_renewals_allowed:
-                can_renew = False
-                renewal_error = f"This book has already been renewed the maximum number of times ({transaction.max_renewals_allowed})."
-            
-            from books.models import BookReservation
-            if BookReservation.objects.filter(
-                book=transaction.book_copy.book,
-                status='active'
-            ).exclude(user=self.request.user).exists():
-                can_renew = False
-                renewal_error = "This book is reserved by another user and cannot be renewed."
-            
-            from fines.models import Fine
-            if Fine.objects.filter(
-                user=self.request.user,
-                status='unpaid'
-            ).exists():
-                can_renew = False
-                renewal_error = "You have unpaid fines. Please pay all fines before renewing books."
-            
-            context['can_renew'] = can_renew
-            context['renewal_error'] = renewal_error
-            
-            from datetime import timedelta
-            new_due_date = timezone.now() + timedelta(days=14)
-            context['new_due_date'] = new_due_date.date()
+            rules = RenewalRules([transaction])
+            context['can_renew'] = rules.can_renew(transaction)
+            context['renewal_error'] = rules.error_for(transaction)
+            context['new_due_date'] = get_renewal_due_date(transaction).date()
             
         except BorrowTransaction.DoesNotExist:
             context['error'] = 'Transaction not found or you do not have permission to renew this book.'
@@ -129,54 +134,34 @@ class RenewBookView(LoginRequiredMixin, TemplateView):
         transaction_id = kwargs.get('transaction_id')
         
         try:
-            transaction = BorrowTransaction.objects.get(
-                id=transaction_id,
-                user=request.user,
-                status='active'
-            )
-            
-            can_renew = True
-            renewal_error = None
-            
-            if transaction.renewal_count >= transaction.max_renewals_allowed:
-                can_renew = False
-                renewal_error = f"This book has already been renewed the maximum number of times ({transaction.max_renewals_allowed})."
+            transaction = self.get_transaction(transaction_id)
             
-            from books.models import BookReservation
-            if BookReservation.objects.filter(
-                book=transaction.book_copy.book,
-                status='active'
-            ).exclude(user=request.user).exists():
-                can_renew = False
-                renewal_error = "This book is reserved by another user and cannot be renewed."
-            
-            from fines.models import Fine
-            if Fine.objects.filter(
-                user=request.user,
-                status='unpaid'
-            ).exists():
-                can_renew = False
-                renewal_error = "You have unpaid fines. Please pay all fines before renewing books."
-            
-            if not can_renew:
-                messages.error(request, renewal_error or 'This book cannot be renewed at this time.')
+            rules = RenewalRules([transaction])
+            if not rules.can_renew(transaction):
+                messages.error(request, rules.error_for(transaction) or 'This book cannot be renewed at this time.')
                 return redirect('borrowing:renew', transaction_id=transaction_id)
             
-            from datetime import timedelta
-            new_due_date = timezone.now() + timedelta(days=14)
-            transaction.due_date = new_due_date
-            
-            transaction.renewal_count += 1
-            
-            transaction.save()
+            renew_transactions([transaction])
             
-            messages.success(request, f'Book "{transaction.book_copy.book.title}" has been renewed successfully. New due date: {new_due_date.strftime("%B %d, %Y")}')
+            messages.success(request, f'Book "{transaction.book_copy.book.title}" has been renewed successfully. New due date: {transaction.due_date.strftime("%B %d, %Y")}')
             return redirect('borrowing:current')
             
         except BorrowTransaction.DoesNotExist:
             messages.error(request, 'Transaction not found or you do not have permission to renew this book.')
             return redirect('borrowing:current')
 
+class RenewAllView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        renewed, skipped = renew_all_eligible(request.user)
+        
+        if renewed:
+            messages.success(request, f'{len(renewed)} book{"s" if len(renewed) != 1 else ""} renewed successfully.')
+        if skipped:
+            messages.warning(request, f'{len(skipped)} book{"s" if len(skipped) != 1 else ""} could not be renewed.')
+        if not renewed and not skipped:
+            messages.info(request, 'You have no books to renew.')
+        return redirect('borrowing:current')
+
 class BorrowBookView(LoginRequiredMixin, TemplateView):
     template_name = 'borrowing/borrow.html'
     
@@ -202,6 +187,15 @@ class BorrowBookView(LoginRequiredMixin, TemplateView):
                     status='available'
                 ).select_related('branch', 'section')
                 
+                # Copies at the suggested branch are listed first
+                suggested = pick_branch(self.request.user, book)
+                if suggested and suggested.available:
+                    context['suggested_branch'] = suggested.branch
+                    available_copies = available_copies.order_by(
+                        Case(When(branch_id=suggested.branch_id, then=Value(0)), default=Value(1)),
+                        'branch__name', 'copy_number'
+                    )
+                
                 context['book'] = book
                 context['available_copies'] = available_copies
                 
@@ -233,10 +227,17 @@ class BorrowBookView(LoginRequiredMixin, TemplateView):
         if book_id and not book_copy_id:
             try:
                 book = Book.objects.get(id=book_id, is_active=True)
-                available_copy = BookCopy.objects.filter(
-                    book=book, 
-                    status='available'
-                ).first()
+                # A copy held for this patron takes precedence over the shelf,
+                # then the preferred branch or the one with the most spare copies
+                available_copy = held_copy_for(request.user, book)
+                if not available_copy:
+                    suggested = pick_branch(request.user, book)
+                    if suggested and suggested.available:
+                        available_copy = BookCopy.objects.filter(
+                            book=book,
+                            branch_id=suggested.branch_id,
+                            status='available'
+                        ).first()
                 
                 if not available_copy:
                     messages.error(request, f'No copies of "{book.title}" are currently available.')
@@ -248,7 +249,9 @@ class BorrowBookView(LoginRequiredMixin, TemplateView):
                 return redirect('borrowing:borrow')
         else:
             try:
-                book_copy = BookCopy.objects.get(id=book_copy_id, status='available')
+                book_copy = BookCopy.objects.filter(
+                    Q(status='available') | Q(status='reserved', holds__user=request.user, holds__status='active')
+                ).distinct().get(id=book_copy_id)
             except BookCopy.DoesNotExist:
                 messages.error(request, 'Book copy not found or not available.')
                 return redirect('borrowing:borrow')
@@ -263,17 +266,41 @@ class BorrowBookView(LoginRequiredMixin, TemplateView):
             messages.error(request, 'You already have this book borrowed.')
             return redirect('borrowing:current')
         
-        due_date = timezone.now() + timedelta(days=14)
-        
-        transaction = BorrowTransaction.objects.create(
-            user=request.user,
-            book_copy=book_copy,
-            due_date=due_date,
-            status='active'
-        )
-        
-        book_copy.status = 'borrowed'
-        book_copy.save()
+        from fines.ledger import outstanding_balance
+        fine_limit = settings.LIBRARY_SETTINGS.get('MAX_OUTSTANDING_FINES')
+        if fine_limit is not None:
+            balance = outstanding_balance(request.user)
+            if balance >= Decimal(str(fine_limit)):
+                messages.error(request, f'You owe MVR {balance} in fines. Please pay your fines before borrowing more books.')
+                return redirect('fines:fine_list')
+        
+        policy = policy_for(request.user, book_copy.book)
+        due_date = timezone.now() + timedelta(days=policy.loan_days)
+        
+        with db_transaction.atomic():
+            # The locked summary row serialises this member's checkouts, so two
+            # requests cannot both take the last loan slot
+            if summaries.lock_summary(request.user).active_loans >= policy.max_loans:
+                messages.error(request, f'You have reached your borrowing limit of {policy.max_loans} books.')
+                return redirect('borrowing:current')
+            
+            # Conditional UPDATE so the copy cannot be handed out twice
+            if not BookCopy.objects.filter(pk=book_copy.pk, status=book_copy.status).update(status='borrowed'):
+                messages.error(request, 'Book copy not found or not available.')
+                return redirect('borrowing:borrow')
+            book_copy.status = 'borrowed'
+            fulfil_hold(request.user, book_copy)
+            
+            transaction = BorrowTransaction.objects.create(
+                user=request.user,
+                book_copy=book_copy,
+                due_date=due_date,
+                max_renewals_allowed=policy.max_renewals,
+                status='active'
+            )
+            
+            record_event('checkout', borrow_transaction=transaction, due_date=due_date.isoformat())
+            summaries.loans_opened([transaction])
         
         messages.success(request, f'Book "{book_copy.book.title}" has been borrowed successfully!')
         return redirect('borrowing:current')
@@ -311,13 +338,20 @@ class BorrowConfirmationView(LoginRequiredMixin, TemplateView):
 class ReturnConfirmationView(LoginRequiredMixin, View):
     template_name = 'borrowing/return_confirmation.html'
     
+    def get_transaction(self, request, transaction_id):
+        from fines.models import FineType
+        
+        return BorrowTransaction.objects.with_accrual(
+            fine_type=FineType.get_overdue_type()
+        ).select_related('book_copy__book').get(
+            id=transaction_id,
+            user=request.user,
+            status='active'
+        )
+    
     def get(self, request, transaction_id):
         try:
-            transaction = BorrowTransaction.objects.get(
-                id=transaction_id,
-                user=request.user,
-                status='active'
-            )
+            transaction = self.get_transaction(request, transaction_id)
         except BorrowTransaction.DoesNotExist:
             messages.error(request, 'Transaction not found or already returned.')
             return redirect('borrowing:current')
@@ -333,39 +367,58 @@ class ReturnConfirmationView(LoginRequiredMixin, View):
         return render(request, self.template_name, context)
     
     def post(self, request, transaction_id):
-        from django.utils import timezone
-        from fines.models import Fine
+        from fines.models import Fine, FineType
         
         try:
-            transaction = BorrowTransaction.objects.get(
-                id=transaction_id,
-                user=request.user,
-                status='active'
-            )
+            transaction = self.get_transaction(request, transaction_id)
         except BorrowTransaction.DoesNotExist:
             messages.error(request, 'Transaction not found or already returned.')
             return redirect('borrowing:current')
         
-        fine_amount = Decimal('0.00')
-        if transaction.is_overdue:
-            fine_amount = transaction.fine_amount
-        
-        transaction.status = 'returned'
-        transaction.returned_at = timezone.now()
-        transaction.save()
-        
-        book_copy = transaction.book_copy
-        book_copy.status = 'available'
-        book_copy.save()
+        fine_amount = transaction.accrued_fine
+        days_overdue = transaction.days_overdue
+        returned_at = timezone.now()
         
-        if fine_amount > 0:
-            Fine.objects.create(
+        with db_transaction.atomic():
+            # Conditional UPDATE so a repeated submit cannot return the loan twice
+            closed = BorrowTransaction.objects.filter(pk=transaction.pk, status='active').update(
+                status='returned', returned_at=returned_at
+            )
+            if not closed:
+                messages.error(request, 'Transaction not found or already returned.')
+                return redirect('borrowing:current')
+            transaction.status = 'returned'
+            transaction.returned_at = returned_at
+            
+            # The copy goes to the next hold in the queue, if any
+            allocate_copy(transaction.book_copy)
+            
+            record_event('return', borrow_transaction=transaction, amount=fine_amount)
+            summaries.loans_closed([transaction])
+            
+            if fine_amount > 0:
+                Fine.objects.create(
+                    user=request.user,
+                    fine_type=FineType.get_overdue_type(),
+                    borrow_transaction=transaction,
+                    amount=fine_amount,
+                    due_date=returned_at + timedelta(days=30),
+                    description=f'Late return fine for "{transaction.book_copy.book.title}" - {days_overdue} days overdue'
+                )
+            
+            BorrowingHistory.objects.create(
                 user=request.user,
-                borrow_transaction=transaction,
-                amount=fine_amount,
-                reason='overdue',
-                description=f'Late return fine for "{transaction.book_copy.book.title}" - {transaction.days_overdue} days overdue'
+                book=transaction.book_copy.book,
+                branch=transaction.book_copy.branch,
+                borrowed_date=transaction.borrowed_at,
+                returned_date=returned_at,
+                days_borrowed=(returned_at.date() - transaction.borrowed_at.date()).days,
+                was_overdue=days_overdue > 0,
+                renewal_count=transaction.renewal_count,
+                action='returned'
             )
+        
+        if fine_amount > 0:
             messages.warning(
                 request, 
                 f'Book returned successfully! A fine of MVR {fine_amount} has been added to your account for late return.'
@@ -373,16 +426,6 @@ class ReturnConfirmationView(LoginRequiredMixin, View):
         else:
             messages.success(request, f'Book "{transaction.book_copy.book.title}" returned successfully!')
         
-        from .models import BorrowingHistory
-        BorrowingHistory.objects.create(
-            user=request.user,
-            book=transaction.book_copy.book,
-            branch=transaction.book_copy.branch,
-            borrowed_date=transaction.borrowed_at,
-            returned_date=timezone.now(),
-            action='returned'
-        )
-        
         return redirect('borrowing:current')
 
 class BorrowingManageView(LoginRequiredMixin, TemplateView):
@@ -1,9 +1,13 @@
 from django.contrib import admin
-from .models import FineType, Fine, FinePayment
+from django.db import transaction
+from borrowing.events import record_event, record_events
+from .ledger import post_entries
+from .reports import invalidate_on_commit
+from .models import FineType, Fine, FinePayment, FineAccount, FineLedgerEntry, PaymentRollup
 
 @admin.register(FineType)
 class FineTypeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'default_amount', 'is_per_day', 'is_active')
+    list_display = ('name', 'default_amount', 'is_per_day', 'max_amount', 'is_active')
     list_filter = ('is_per_day', 'is_active', 'created_at')
     search_fields = ('name', 'description')
     readonly_fields = ('created_at', 'updated_at')
@@ -20,22 +24,80 @@ class FineAdmin(admin.ModelAdmin):
     actions = ['mark_as_paid', 'waive_fine']
     
     def mark_as_paid(self, request, queryset):
-        for fine in queryset:
-            fine.amount_paid = fine.amount
-            fine.status = 'paid'
-            fine.save()
+        with transaction.atomic():
+            for fine in queryset:
+                outstanding = fine.amount_remaining
+                fine.amount_paid = fine.amount
+                fine.status = 'paid'
+                fine.save()
+                if outstanding > 0:
+                    record_event('payment', user=fine.user, borrow_transaction=fine.borrow_transaction,
+                                 amount=outstanding, fine_id=fine.id, payment_method='admin')
         self.message_user(request, f'{queryset.count()} fines marked as paid.')
     mark_as_paid.short_description = 'Mark selected fines as paid'
     
     def waive_fine(self, request, queryset):
-        queryset.update(status='waived')
-        self.message_user(request, f'{queryset.count()} fines waived.')
+        with transaction.atomic():
+            # Fines already waived owe nothing more, so they post no waiver or event
+            fines = list(
+                queryset.exclude(status='waived').select_for_update(of=('self',))
+                .select_related('user', 'borrow_transaction__book_copy')
+            )
+            Fine.objects.filter(pk__in=[fine.pk for fine in fines]).update(status='waived')
+            post_entries([
+                FineLedgerEntry(user_id=fine.user_id, fine=fine, entry_type='waiver', amount=-fine.amount_remaining)
+                for fine in fines
+            ])
+            invalidate_on_commit()
+            record_events('fine_waived', [
+                {'user': fine.user, 'borrow_transaction': fine.borrow_transaction,
+                 'amount': fine.amount_remaining, 'fine_id': fine.id}
+                for fine in fines
+            ])
+        self.message_user(request, f'{len(fines)} fines waived.')
     waive_fine.short_description = 'Waive selected fines'
 
 @admin.register(FinePayment)
 class FinePaymentAdmin(admin.ModelAdmin):
-    list_display = ('fine', 'amount', 'payment_method', 'payment_date', 'processed_by')
+    list_display = ('fine', 'amount', 'payment_method', 'payment_date', 'processed_by', 'transaction_id')
     list_filter = ('payment_method', 'payment_date')
-    search_fields = ('fine__user__username', 'reference_number')
+    search_fields = ('fine__user__username', 'receipt_number', 'transaction_id')
     raw_id_fields = ('fine', 'processed_by')
     readonly_fields = ('payment_date',)
+
+@admin.register(FineAccount)
+class FineAccountAdmin(admin.ModelAdmin):
+    list_display = ('user', 'outstanding_balance', 'total_fined', 'total_paid', 'total_waived', 'updated_at')
+    search_fields = ('user__username', 'user__library_card_number')
+    readonly_fields = ('user', 'outstanding_balance', 'total_fined', 'total_paid', 'total_waived', 'updated_at')
+    
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(FineLedgerEntry)
+class FineLedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'entry_type', 'amount', 'balance_after', 'fine', 'created_at')
+    list_filter = ('entry_type', 'created_at')
+    search_fields = ('user__username',)
+    raw_id_fields = ('user', 'fine', 'payment')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(PaymentRollup)
+class PaymentRollupAdmin(admin.ModelAdmin):
+    list_display = ('date', 'source', 'payment_method', 'processed_by', 'payments', 'amount')
+    list_filter = ('source', 'payment_method', 'date')
+    date_hierarchy = 'date'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class FinesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'fines'
+
+    def ready(self):
+        # Report snapshot invalidation and payment rollups on payment writes
+        from . import reconciliation, reports  # noqa: F401
@@ -0,0 +1,241 @@
+import os
+import zipfile
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, time
+from itertools import islice, repeat
+from multiprocessing import get_context
+from threading import Lock
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from . import pdf
+from .models import FineLedgerEntry, MembershipFee
+
+# Worker processes are spawned rather than forked: forking a process that
+# holds database connections and threads is unsafe, and the workers only
+# need fines.pdf, which imports nothing from Django
+_mp_context = get_context('spawn')
+_executor = None
+_lock = Lock()
+
+
+def get_cache_dir():
+    return str(getattr(settings, 'DOCUMENT_CACHE_DIR', settings.BASE_DIR / 'var' / 'documents'))
+
+
+def _library_settings():
+    return getattr(settings, 'LIBRARY_SETTINGS', {})
+
+
+def get_executor():
+    """Process pool shared by the requests of this process."""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                workers = _library_settings().get('DOCUMENT_WORKERS') or os.cpu_count()
+                _executor = ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context)
+    return _executor
+
+
+def _money(value):
+    return f'-${-value:,.2f}' if value < 0 else f'${value:,.2f}'
+
+
+def _day(value):
+    return timezone.localtime(value).strftime('%d %b %Y') if value else ''
+
+
+def _document(title, details, tables=(), footer=()):
+    return {
+        'library': _library_settings().get('LIBRARY_NAME', 'Library Management System'),
+        'title': title,
+        'details': [[label, str(value)] for label, value in details],
+        'tables': list(tables),
+        'footer': list(footer),
+    }
+
+
+def payment_receipt(payment):
+    fine, user = payment.fine, payment.fine.user
+    return _document(f'Receipt {payment.receipt_number}', [
+        ('Receipt number', payment.receipt_number),
+        ('Date', _day(payment.payment_date)),
+        ('Member', user.full_name),
+        ('Library card', user.library_card_number or ''),
+        ('Fine', f'{fine.fine_type.name} - {fine.description}' if fine.description else fine.fine_type.name),
+        ('Amount paid', _money(payment.amount)),
+        ('Payment method', payment.get_payment_method_display()),
+        ('Transaction', payment.transaction_id or ''),
+    ], footer=['Thank you for your payment.'])
+
+
+def membership_receipt(fee):
+    user = fee.user
+    return _document(f'Membership Receipt {fee.pk}', [
+        ('Reference', fee.transaction_id or fee.pk),
+        ('Date paid', _day(fee.paid_date)),
+        ('Member', user.full_name),
+        ('Library card', user.library_card_number or ''),
+        ('Membership', fee.get_fee_type_display()),
+        ('Valid', f'{_day(fee.valid_from)} to {_day(fee.valid_until)}'),
+        ('Amount paid', _money(fee.amount)),
+        ('Payment method', fee.get_payment_method_display() if fee.payment_method else ''),
+    ], footer=['Thank you for your membership.'])
+
+
+def _ledger_row(entry):
+    if entry.payment_id:
+        details = f'Receipt {entry.payment.receipt_number}'
+    elif entry.fine_id:
+        details = entry.fine.fine_type.name
+    else:
+        details = entry.description
+    return [_day(entry.created_at), entry.get_entry_type_display(), details,
+            _money(entry.amount), _money(entry.balance_after)]
+
+
+def fine_statement(user, year, entries, opening_balance, fees):
+    """
+    Year statement for ``user`` from their ledger ``entries`` and the
+    membership ``fees`` they paid in ``year``.
+    """
+    closing = entries[-1].balance_after if entries else opening_balance
+    totals = defaultdict(int)
+    for entry in entries:
+        totals[entry.entry_type] += entry.amount
+    return _document(f'Fine Statement {year}', [
+        ('Member', user.full_name),
+        ('Library card', user.library_card_number or ''),
+        ('Period', f'1 Jan {year} to 31 Dec {year}'),
+        ('Opening balance', _money(opening_balance)),
+        ('Fines issued', _money(totals['fine_issued'] + totals['adjustment'])),
+        ('Payments', _money(-totals['payment'])),
+        ('Waived', _money(-totals['waiver'])),
+        ('Closing balance', _money(closing)),
+    ], tables=[
+        {
+            'heading': 'Fines and payments',
+            'columns': ['Date', 'Entry', 'Details', 'Amount', 'Balance'],
+            'rows': [_ledger_row(entry) for entry in entries],
+        },
+        {
+            'heading': 'Membership fees paid',
+            'columns': ['Date', 'Membership', 'Reference', 'Amount'],
+            'rows': [
+                [_day(fee.paid_date), fee.get_fee_type_display(), fee.transaction_id, _money(fee.amount)]
+                for fee in fees
+            ],
+        },
+    ])
+
+
+def year_bounds(year):
+    tz = timezone.get_current_timezone()
+    return (
+        timezone.make_aware(datetime.combine(date(year, 1, 1), time.min), tz),
+        timezone.make_aware(datetime.combine(date(year + 1, 1, 1), time.min), tz),
+    )
+
+
+def statement_documents(users, year):
+    """
+    ``(user, document)`` for each of ``users`` (a list), using a fixed number
+    of queries for the whole batch: ledger entries for the year, the last
+    entry before it for opening balances, and the membership fees paid.
+    """
+    start, end = year_bounds(year)
+    ids = [user.pk for user in users]
+
+    entries = defaultdict(list)
+    for entry in FineLedgerEntry.objects.filter(
+        user_id__in=ids, created_at__gte=start, created_at__lt=end
+    ).select_related('fine__fine_type', 'payment').order_by('user_id', 'id').iterator():
+        entries[entry.user_id].append(entry)
+
+    last_before = FineLedgerEntry.objects.filter(
+        user_id__in=ids, created_at__lt=start
+    ).order_by().values('user_id').annotate(last_id=Max('id'))
+    opening = {
+        user_id: balance for user_id, balance in FineLedgerEntry.objects.filter(
+            pk__in=[row['last_id'] for row in last_before]
+        ).values_list('user_id', 'balance_after')
+    }
+
+    fees = defaultdict(list)
+    for fee in MembershipFee.objects.filter(
+        user_id__in=ids, status='paid', paid_date__gte=start, paid_date__lt=end
+    ).order_by('paid_date'):
+        fees[fee.user_id].append(fee)
+
+    for user in users:
+        yield user, fine_statement(user, year, entries[user.pk], opening.get(user.pk, 0), fees[user.pk])
+
+
+def cached(document):
+    """Path of the already rendered PDF for ``document``, or None."""
+    path = pdf.cache_path(get_cache_dir(), pdf.content_hash(document))
+    return path if os.path.exists(path) else None
+
+
+def render(document, timeout=30):
+    """
+    Path of the PDF for ``document``, rendered in the process pool when it is
+    not cached yet. Raises ``concurrent.futures.TimeoutError`` after
+    ``timeout`` seconds; the PDF keeps rendering and is cached for the next call.
+    """
+    return cached(document) or get_executor().submit(
+        pdf.render_to_cache, document, get_cache_dir()
+    ).result(timeout=timeout)
+
+
+def prerender(document):
+    """Queues ``document`` for rendering without waiting, so a later download is instant."""
+    if not cached(document):
+        get_executor().submit(pdf.render_to_cache, document, get_cache_dir())
+
+
+def statement_filename(user, year):
+    return f'statement-{year}-{user.library_card_number or user.username}.pdf'
+
+
+def build_statements_zip(users, year, output, workers=None, batch_size=500):
+    """
+    Renders the ``year`` statement of every user in ``users`` (a queryset)
+    across a process pool and writes them into the zip file ``output`` as
+    they finish. The next batch is queued before the previous one is
+    written, so workers stay busy while statements are gathered and zipped.
+    Returns the number of statements written.
+    """
+    cache_dir = get_cache_dir()
+    workers = workers or os.cpu_count()
+    written = 0
+    users = users.order_by('pk').iterator(chunk_size=batch_size)
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context) as pool, \
+            zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+        in_flight = deque()
+
+        def write_batch(batch, paths):
+            nonlocal written
+            for (user, _), path in zip(batch, paths):
+                # PDFs are already compressed; storing them keeps zipping cheap
+                archive.write(path, statement_filename(user, year))
+                written += 1
+
+        while True:
+            batch = list(statement_documents(list(islice(users, batch_size)), year))
+            if not batch:
+                break
+            chunksize = max(1, len(batch) // (workers * 4))
+            in_flight.append((batch, pool.map(
+                pdf.render_to_cache, [document for _, document in batch], repeat(cache_dir), chunksize=chunksize
+            )))
+            if len(in_flight) > 1:
+                write_batch(*in_flight.popleft())
+        while in_flight:
+            write_batch(*in_flight.popleft())
+    return written
@@ -0,0 +1,97 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import FineAccount, FineLedgerEntry
+
+ZERO = Decimal('0.00')
+
+# Running total on FineAccount that each entry type moves, and in which direction
+TOTALS = {
+    'fine_issued': ('total_fined', 1),
+    'adjustment': ('total_fined', 1),
+    'payment': ('total_paid', -1),
+    'waiver': ('total_waived', -1),
+}
+
+
+def _money(value):
+    return Decimal(str(value or 0))
+
+
+def fine_entries(fine, previous=None):
+    """
+    Unsaved ledger entries for the change from ``previous`` (the fine's
+    ``(amount, amount_paid, status)`` before this save, None for a new fine)
+    to its current state. A waived fine owes nothing, so waiving books the
+    unpaid remainder and reinstating books it back.
+    """
+    amount, paid, status = previous or (ZERO, ZERO, None)
+    amount, paid = _money(amount), _money(paid)
+    new_amount, new_paid = _money(fine.amount), _money(fine.amount_paid)
+    was_waived, is_waived = status == 'waived', fine.status == 'waived'
+    entries = []
+
+    def add(entry_type, value, **kwargs):
+        if value:
+            entries.append(FineLedgerEntry(
+                user_id=fine.user_id, fine=fine, entry_type=entry_type, amount=value, **kwargs
+            ))
+
+    if not was_waived:
+        if previous is None:
+            add('fine_issued', new_amount, description=(fine.description or fine.fine_type.name)[:255])
+        else:
+            add('adjustment', new_amount - amount)
+        add('payment', paid - new_paid, payment=getattr(fine, '_ledger_payment', None))
+    if is_waived != was_waived:
+        remaining = new_amount - new_paid
+        add('waiver', -remaining if is_waived else remaining)
+    return entries
+
+
+def post_entries(entries):
+    """
+    Saves ledger entries and moves each member's FineAccount with them, in a
+    fixed number of queries however many entries and members are involved.
+    Account rows are locked first, so concurrent postings for a member
+    serialise and ``balance_after`` stays a true running balance.
+    """
+    entries = [entry for entry in entries if entry.amount]
+    if not entries:
+        return []
+
+    by_user = defaultdict(list)
+    for entry in entries:
+        by_user[entry.user_id].append(entry)
+
+    with transaction.atomic():
+        FineAccount.objects.bulk_create(
+            [FineAccount(user_id=user_id) for user_id in by_user], ignore_conflicts=True
+        )
+        accounts = FineAccount.objects.select_for_update().filter(pk__in=sorted(by_user)).in_bulk()
+        for user_id, user_entries in by_user.items():
+            account = accounts[user_id]
+            for entry in user_entries:
+                field, sign = TOTALS[entry.entry_type]
+                setattr(account, field, getattr(account, field) + sign * entry.amount)
+                account.outstanding_balance += entry.amount
+                entry.balance_after = account.outstanding_balance
+            account.updated_at = timezone.now()
+        FineLedgerEntry.objects.bulk_create(entries)
+        FineAccount.objects.bulk_update(
+            accounts.values(), ['outstanding_balance', 'total_fined', 'total_paid', 'total_waived', 'updated_at']
+        )
+    return entries
+
+
+def get_account(user):
+    """The member's FineAccount in one primary-key read; an unsaved zero account if they have none."""
+    return FineAccount.objects.filter(pk=user.pk).first() or FineAccount(user_id=user.pk)
+
+
+def outstanding_balance(user):
+    balance = FineAccount.objects.filter(pk=user.pk).values_list('outstanding_balance', flat=True).first()
+    return balance if balance is not None else ZERO
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from accounts.models import User
+from fines import documents
+
+
+class Command(BaseCommand):
+    help = 'Render the yearly fine statement of every member with activity into a zip of PDFs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help='Statement year (default: last year)')
+        parser.add_argument('--output', help='Zip file to write (default: statements-<year>.zip)')
+        parser.add_argument('--workers', type=int, help='Rendering processes (default: one per CPU)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Members gathered per batch of queries')
+
+    def handle(self, *args, **options):
+        year = options['year'] or timezone.localdate().year - 1
+        output = options['output'] or f'statements-{year}.zip'
+        start, end = documents.year_bounds(year)
+
+        # Members with ledger entries or membership payments, or a balance carried into the year
+        users = User.objects.filter(
+            Q(fine_ledger__created_at__lt=end)
+            | Q(membership_fees__status='paid', membership_fees__paid_date__gte=start, membership_fees__paid_date__lt=end)
+        ).distinct()
+
+        written = documents.build_statements_zip(
+            users, year, output, workers=options['workers'], batch_size=options['batch_size']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} statement(s) for {year} to {output}'))
@@ -0,0 +1,27 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from fines.reconciliation import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily payment reconciliation rollups from the payment tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=1, help='Number of days before today to recompute (default: 1)')
+        parser.add_argument('--since', help='Backfill every day from this date (YYYY-MM-DD) up to today')
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        if options['since']:
+            try:
+                start = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError('--since must be a date in YYYY-MM-DD format')
+        else:
+            start = today - timedelta(days=options['days'])
+
+        written = rebuild_rollups(start, today + timedelta(days=1))
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollup row(s) for {start} to {today}'))
@@ -0,0 +1,55 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fines.models import FinePayment
+from fines.reconciliation import read_settlement_file, reconcile
+
+
+class Command(BaseCommand):
+    help = 'Match a bank or card settlement file against recorded payments by transaction id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help='Settlement CSV with transaction id, amount and date columns')
+        parser.add_argument(
+            '--method', action='append', dest='methods',
+            choices=[key for key, _ in FinePayment.PAYMENT_METHOD_CHOICES],
+            help='Payment method the file settles; repeat for several (default: card and online)'
+        )
+        parser.add_argument('--id-column', default='transaction_id')
+        parser.add_argument('--amount-column', default='amount')
+        parser.add_argument('--date-column', default='date')
+        parser.add_argument('--slack-days', type=int, default=3, help='Days a payment may settle before or after it was taken')
+        parser.add_argument('--output', help='Write the unmatched and mismatched rows to this CSV')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['file'], newline='', encoding='utf-8-sig') as stream:
+                settlement = read_settlement_file(
+                    stream, options['id_column'], options['amount_column'], options['date_column']
+                )
+        except (OSError, ValueError) as exc:
+            raise CommandError(str(exc))
+
+        result = reconcile(settlement, options['methods'] or ['card', 'online'], options['slack_days'])
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as stream:
+                writer = csv.writer(stream)
+                writer.writerow(['problem', 'transaction_id', 'file_line', 'file_amount', 'source', 'record_id', 'recorded_amount', 'paid_at'])
+                for row, ours in result['amount_mismatches']:
+                    writer.writerow(['amount_mismatch', row.transaction_id, row.line, row.amount, ours.source, ours.pk, ours.amount, ours.paid_at.isoformat()])
+                for row in result['unmatched_settlement']:
+                    writer.writerow(['not_recorded', row.transaction_id, row.line, row.amount, '', '', '', ''])
+                for ours in result['unmatched_ledger']:
+                    writer.writerow(['not_settled', ours.transaction_id, '', '', ours.source, ours.pk, ours.amount, ours.paid_at.isoformat()])
+
+        summary = (
+            f"{len(result['matched'])} matched, {len(result['amount_mismatches'])} amount mismatch(es), "
+            f"{len(result['unmatched_settlement'])} settlement row(s) not recorded, "
+            f"{len(result['unmatched_ledger'])} payment(s) not settled"
+        )
+        if result['amount_mismatches'] or result['unmatched_settlement'] or result['unmatched_ledger']:
+            self.stdout.write(self.style.WARNING(summary))
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
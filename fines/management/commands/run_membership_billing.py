@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from fines.membership import (
+    auto_renewal_members, get_billing_window, members_expiring, run_billing,
+)
+
+
+class Command(BaseCommand):
+    help = 'Invoice upcoming membership renewals, process auto-renewals and deactivate lapsed members'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            help='Invoice memberships expiring within this many days '
+                 '(default: LIBRARY_SETTINGS["MEMBERSHIP_BILLING_DAYS"])'
+        )
+        parser.add_argument('--chunk-size', type=int, default=500, help='Members handled per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many members are due')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        window = timedelta(days=options['days']) if options['days'] is not None else get_billing_window()
+
+        if options['dry_run']:
+            expiring = members_expiring(now, now + window).count()
+            renewals = auto_renewal_members(now).count()
+            self.stdout.write(
+                f'{expiring} member(s) expire by {now + window:%Y-%m-%d}; '
+                f'{renewals} lapsed member(s) would be renewed automatically'
+            )
+            return
+
+        result = run_billing(now=now, window=window, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Issued {result['invoiced']} invoice(s), renewed {result['renewed']} membership(s), "
+            f"marked {result['overdue']} fee(s) overdue, deactivated {result['deactivated']} member(s)"
+        ))
@@ -0,0 +1,256 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery
+from django.utils import timezone
+
+from accounts import audit
+from accounts.backends import forget_users
+from accounts.models import User
+from accounts.sequences import next_value
+from .models import MembershipFee, MembershipRenewal
+from .reconciliation import add_payments
+
+DEFAULT_FEE_TYPE = 'annual'
+
+# Length of the period each kind of membership pays for
+TERM_DAYS = {
+    'annual': 365,
+    'monthly': 30,
+    'student': 365,
+    'senior': 365,
+    'family': 365,
+}
+
+
+def _library_settings():
+    return getattr(settings, 'LIBRARY_SETTINGS', {})
+
+
+def fee_amount(fee_type):
+    fees = _library_settings().get('MEMBERSHIP_FEES', {})
+    return Decimal(str(fees.get(fee_type, fees.get(DEFAULT_FEE_TYPE, 0)))).quantize(Decimal('0.01'))
+
+
+def get_billing_window():
+    return timedelta(days=_library_settings().get('MEMBERSHIP_BILLING_DAYS', 30))
+
+
+def get_payment_window():
+    return timedelta(days=_library_settings().get('MEMBERSHIP_PAYMENT_DAYS', 14))
+
+
+def _period(fee_type, start):
+    return start, start + timedelta(days=TERM_DAYS.get(fee_type, TERM_DAYS[DEFAULT_FEE_TYPE]))
+
+
+def _with_fee_type(members):
+    """Annotates each member's ``fee_type`` from their latest membership fee."""
+    latest = MembershipFee.objects.filter(user=OuterRef('pk')).order_by('-valid_from', '-id')
+    return members.annotate(last_fee_type=Subquery(latest.values('fee_type')[:1]))
+
+
+def _not_invoiced(members):
+    # The next period starts at the current expiry, so an invoice for it has
+    # valid_from equal to membership_expiry; reruns skip members that have one
+    return members.exclude(Exists(MembershipFee.objects.filter(
+        user=OuterRef('pk'), valid_from=OuterRef('membership_expiry')
+    )))
+
+
+def _new_invoice(member, now, due_date=None):
+    fee_type = member.last_fee_type or DEFAULT_FEE_TYPE
+    valid_from, valid_until = _period(fee_type, member.membership_expiry)
+    return MembershipFee(
+        user=member,
+        fee_type=fee_type,
+        amount=fee_amount(fee_type),
+        status='pending',
+        due_date=due_date or member.membership_expiry,
+        valid_from=valid_from,
+        valid_until=valid_until,
+        notes=f'Billing run {timezone.localdate(now):%Y-%m-%d}',
+    )
+
+
+def _chunks(queryset, chunk_size):
+    # Keyset pagination on (membership_expiry, pk) so progress survives the
+    # rows each chunk changes and the scan stays on user_membership_expiry_idx
+    last = None
+    while True:
+        chunk = queryset
+        if last is not None:
+            chunk = chunk.filter(
+                membership_expiry__gte=last[0]
+            ).exclude(membership_expiry=last[0], pk__lte=last[1])
+        ids = list(chunk.order_by('membership_expiry', 'pk').values_list('membership_expiry', 'pk')[:chunk_size])
+        if not ids:
+            return
+        last = ids[-1]
+        yield [pk for _, pk in ids]
+
+
+def members_expiring(start, end):
+    """Active members whose membership runs out in ``[start, end)``, a range scan on the expiry index."""
+    return User.objects.filter(
+        user_type='member', is_active_member=True,
+        membership_expiry__gte=start, membership_expiry__lt=end,
+    )
+
+
+def issue_invoices(now=None, window=None, chunk_size=500):
+    """
+    Bulk-creates a pending MembershipFee for the next period of every member
+    expiring within ``window`` of ``now`` who has not been invoiced for it.
+    Each chunk commits on its own. Returns the number of invoices created.
+    """
+    now = now or timezone.now()
+    due = _not_invoiced(members_expiring(now, now + (window or get_billing_window())))
+    created = 0
+    for ids in _chunks(due, chunk_size):
+        with transaction.atomic():
+            members = _not_invoiced(_with_fee_type(
+                User.objects.select_for_update(of=('self',)).filter(pk__in=ids)
+            ))
+            created += len(MembershipFee.objects.bulk_create([_new_invoice(member, now) for member in members]))
+    return created
+
+
+def auto_renewal_members(now):
+    """Active members past their expiry whose latest renewal asked to renew automatically."""
+    latest = MembershipRenewal.objects.filter(user=OuterRef('pk')).order_by('-renewed_date', '-id')
+    return User.objects.filter(
+        user_type='member', is_active_member=True, membership_expiry__lte=now,
+    ).annotate(auto_renew=Subquery(latest.values('auto_renewal')[:1])).filter(auto_renew=True)
+
+
+def process_auto_renewals(now=None, chunk_size=200):
+    """
+    Extends every lapsed member who opted into auto-renewal by one period.
+    The period's invoice is created if the billing run has not already
+    issued it and is left pending, due ``MEMBERSHIP_PAYMENT_DAYS`` from
+    ``now``, for the member to pay. Returns the number of memberships renewed.
+    """
+    now = now or timezone.now()
+    renewed = 0
+    for ids in _chunks(auto_renewal_members(now), chunk_size):
+        with transaction.atomic():
+            # Re-checked under the lock; another run may have renewed them
+            members = list(_with_fee_type(
+                auto_renewal_members(now).select_for_update(of=('self',)).filter(pk__in=ids)
+            ))
+            if not members:
+                continue
+            expiries = {member.pk: member.membership_expiry for member in members}
+            invoices = {
+                fee.user_id: fee for fee in MembershipFee.objects.filter(
+                    user_id__in=expiries, valid_from__in=set(expiries.values())
+                )
+                if fee.valid_from == expiries[fee.user_id]
+            }
+            MembershipFee.objects.bulk_create([
+                _new_invoice(member, now, due_date=now + get_payment_window())
+                for member in members if member.pk not in invoices
+            ])
+
+            renewals = []
+            for member in members:
+                fee_type = member.last_fee_type or DEFAULT_FEE_TYPE
+                invoice = invoices.get(member.pk)
+                new_expiry = invoice.valid_until if invoice else _period(fee_type, member.membership_expiry)[1]
+                renewals.append(MembershipRenewal(
+                    user=member,
+                    previous_expiry=member.membership_expiry,
+                    new_expiry=new_expiry,
+                    renewal_fee=invoice.amount if invoice else fee_amount(fee_type),
+                    auto_renewal=True,
+                    notes='Renewed automatically',
+                ))
+                member.membership_expiry = new_expiry
+            MembershipRenewal.objects.bulk_create(renewals)
+            User.objects.bulk_update(members, ['membership_expiry'])
+            forget_users([member.pk for member in members])
+            renewed += len(members)
+    return renewed
+
+
+def mark_overdue_fees(now=None):
+    """Flags pending membership fees past their due date as overdue with one UPDATE."""
+    return MembershipFee.objects.filter(status='pending', due_date__lt=now or timezone.now()).update(status='overdue')
+
+
+def deactivate_lapsed(now=None):
+    """Clears ``is_active_member`` for every member past their expiry with one UPDATE."""
+    lapsed = User.objects.filter(
+        user_type='member', is_active_member=True, membership_expiry__lt=now or timezone.now()
+    )
+    with transaction.atomic():
+        user_ids = list(lapsed.select_for_update().values_list('pk', flat=True))
+        User.objects.filter(pk__in=user_ids).update(is_active_member=False)
+        forget_users(user_ids)
+        # update() skips the post_save audit hook
+        for user_id in user_ids:
+            audit.record_on_commit('account_deactivated', user_id, 'Membership lapsed')
+    return len(user_ids)
+
+
+def run_billing(now=None, window=None, chunk_size=500):
+    """
+    Full billing run: invoice upcoming expiries, renew auto-renewal members,
+    flag overdue fees, then deactivate whoever is still lapsed. Every step
+    only touches rows still needing it, so a rerun (or a run resumed after a
+    failure) picks up where the last one stopped.
+    """
+    now = now or timezone.now()
+    return {
+        'invoiced': issue_invoices(now, window, chunk_size),
+        'renewed': process_auto_renewals(now, chunk_size),
+        'overdue': mark_overdue_fees(now),
+        'deactivated': deactivate_lapsed(now),
+    }
+
+
+def renew_membership(user, payment_method, processed_by=None, fee_type=None, auto_renewal=False, now=None):
+    """
+    Renews ``user`` for one period, paid now. Settles the oldest unpaid
+    invoice whose period has not ended (issued by the billing run or an
+    automatic renewal) when there is one, otherwise records a paid
+    MembershipFee, and writes the MembershipRenewal. Returns the renewal.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        user = User.objects.select_for_update().get(pk=user.pk)
+        previous_expiry = user.membership_expiry or now
+        start = max(previous_expiry, now)
+        fee = MembershipFee.objects.filter(
+            user=user, valid_until__gt=now, status__in=['pending', 'overdue']
+        ).order_by('valid_from', 'id').first()
+        if fee is None:
+            fee_type = fee_type or _with_fee_type(User.objects.filter(pk=user.pk)).get().last_fee_type or DEFAULT_FEE_TYPE
+            valid_from, valid_until = _period(fee_type, start)
+            fee = MembershipFee(
+                user=user, fee_type=fee_type, amount=fee_amount(fee_type),
+                due_date=now, valid_from=valid_from, valid_until=valid_until,
+            )
+        fee.status = 'paid'
+        fee.paid_date = now
+        fee.payment_method = payment_method
+        fee.processed_by = processed_by
+        fee.transaction_id = next_value('receipt')
+        fee.save()
+        add_payments('membership', [fee])
+
+        # An auto-renewal invoice covers the period the member is already in
+        user.membership_expiry = max(previous_expiry, fee.valid_until)
+        user.is_active_member = True
+        user.save(update_fields=['membership_expiry', 'is_active_member'])
+        return MembershipRenewal.objects.create(
+            user=user,
+            previous_expiry=previous_expiry,
+            new_expiry=user.membership_expiry,
+            renewal_fee=fee.amount,
+            processed_by=processed_by,
+            auto_renewal=auto_renewal,
+        )
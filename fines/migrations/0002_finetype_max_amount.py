@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fines', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='finetype',
+            name='max_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Upper limit for per-day fines; leave blank for no limit', max_digits=10, null=True),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:54
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_ledger(apps, schema_editor):
+    """Replays existing fines and payments into ledger entries and account totals."""
+    Fine = apps.get_model('fines', 'Fine')
+    FinePayment = apps.get_model('fines', 'FinePayment')
+    FineAccount = apps.get_model('fines', 'FineAccount')
+    FineLedgerEntry = apps.get_model('fines', 'FineLedgerEntry')
+
+    payments = {}
+    for payment in FinePayment.objects.order_by('payment_date', 'id').iterator():
+        payments.setdefault(payment.fine_id, []).append(payment)
+
+    accounts, entries = {}, []
+    for fine in Fine.objects.order_by('issued_date', 'id').iterator():
+        account = accounts.setdefault(fine.user_id, FineAccount(user_id=fine.user_id))
+
+        def add(entry_type, amount, field, payment=None, created_at=fine.issued_date):
+            if not amount:
+                return
+            setattr(account, field, getattr(account, field) + abs(amount))
+            account.outstanding_balance += amount
+            entries.append(FineLedgerEntry(
+                user_id=fine.user_id, fine_id=fine.id, payment=payment, entry_type=entry_type,
+                amount=amount, balance_after=account.outstanding_balance, created_at=created_at,
+            ))
+
+        add('fine_issued', fine.amount, 'total_fined')
+        recorded = Decimal('0.00')
+        for payment in payments.get(fine.id, []):
+            add('payment', -payment.amount, 'total_paid', payment, payment.payment_date)
+            recorded += payment.amount
+        # Fines marked paid without a payment record
+        add('payment', recorded - fine.amount_paid, 'total_paid')
+        if fine.status == 'waived':
+            add('waiver', fine.amount_paid - fine.amount, 'total_waived')
+
+    FineAccount.objects.bulk_create(accounts.values(), batch_size=1000)
+    FineLedgerEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_sequence'),
+        ('fines', '0002_finetype_max_amount'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FineAccount',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='fine_account', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('outstanding_balance', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_fined', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_waived', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FineLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('fine_issued', 'Fine Issued'), ('payment', 'Payment'), ('waiver', 'Waiver'), ('adjustment', 'Adjustment')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('balance_after', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('fine', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='fines.fine')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='fines.finepayment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fine_ledger', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Fine ledger entries',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['user', '-id'], name='fine_ledger_user_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.5 on 2026-10-19 10:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('borrowing', '0009_loan_length_histogram'),
+        ('fines', '0003_fine_ledger'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fine',
+            index=models.Index(fields=['issued_date', 'status'], name='fine_issued_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='finepayment',
+            index=models.Index(fields=['payment_date', 'payment_method'], name='payment_date_method_idx'),
+        ),
+    ]
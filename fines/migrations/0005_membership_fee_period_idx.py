@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fines', '0004_report_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='membershipfee',
+            index=models.Index(fields=['user', 'valid_from'], name='membership_fee_period_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.5 on 2026-10-19 11:06
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_copy_barcode_blank'),
+        ('fines', '0005_membership_fee_period_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('source', models.CharField(choices=[('fine', 'Fine Payment'), ('membership', 'Membership Fee'), ('priority', 'Priority Reservation Fee')], max_length=20)),
+                ('payment_method', models.CharField(choices=[('cash', 'Cash'), ('card', 'Debit/Credit Card'), ('bank_transfer', 'Bank Transfer'), ('online', 'Online Payment'), ('waived', 'Waived')], max_length=20)),
+                ('payments', models.PositiveIntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+            ],
+            options={
+                'ordering': ['-date', 'source', 'payment_method'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='finepayment',
+            index=models.Index(fields=['transaction_id'], name='payment_transaction_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membershipfee',
+            index=models.Index(fields=['paid_date', 'payment_method'], name='membership_fee_paid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membershipfee',
+            index=models.Index(fields=['transaction_id'], name='membership_fee_transaction_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='priorityreservationfee',
+            index=models.Index(fields=['paid_date', 'payment_method'], name='priority_fee_paid_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='priorityreservationfee',
+            index=models.Index(fields=['transaction_id'], name='priority_fee_transaction_idx'),
+        ),
+        migrations.AddField(
+            model_name='paymentrollup',
+            name='processed_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payment_rollups', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='paymentrollup',
+            unique_together={('date', 'source', 'payment_method', 'processed_by')},
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils import timezone
 from decimal import Decimal
@@ -8,15 +8,37 @@ class FineType(models.Model):
     description = models.TextField()
     default_amount = models.DecimalField(max_digits=10, decimal_places=2)
     is_per_day = models.BooleanField(default=False, help_text="If true, fine amount multiplies by number of days")
+    max_amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        help_text="Upper limit for per-day fines; leave blank for no limit"
+    )
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    OVERDUE_TYPE_NAME = 'Overdue'
+    
     class Meta:
         ordering = ['name']
     
     def __str__(self):
         return self.name
+    
+    @classmethod
+    def get_overdue_type(cls):
+        fine_per_day = getattr(settings, 'LIBRARY_SETTINGS', {}).get('FINE_PER_DAY', 1.00)
+        fine_type, _ = cls.objects.get_or_create(
+            name=cls.OVERDUE_TYPE_NAME,
+            defaults={
+                'description': 'Late return of borrowed items',
+                'default_amount': Decimal(str(fine_per_day)),
+                'is_per_day': True,
+            }
+        )
+        return fine_type
 
 class Fine(models.Model):
     STATUS_CHOICES = [
@@ -53,6 +75,9 @@ class Fine(models.Model):
     
     class Meta:
         ordering = ['-issued_date']
+        indexes = [
+            models.Index(fields=['issued_date', 'status'], name='fine_issued_status_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.fine_type.name} - ${self.amount}"
@@ -70,15 +95,38 @@ class Fine(models.Model):
         return self.amount_paid >= self.amount
     
     def save(self, *args, **kwargs):
-        # Auto-update status based on payment
-        if self.is_fully_paid:
+        from borrowing.events import record_event
+        from .ledger import fine_entries, post_entries
+        
+        # Auto-update status based on payment; waived fines stay waived
+        if self.status == 'waived':
+            pass
+        elif self.is_fully_paid:
             self.status = 'paid'
         elif self.amount_paid > 0:
             self.status = 'partial'
         elif self.is_overdue:
             self.status = 'overdue'
         
-        super().save(*args, **kwargs)
+        is_new = self.pk is None
+        with transaction.atomic():
+            previous = None
+            if not is_new:
+                previous = Fine.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'amount', 'amount_paid', 'status'
+                ).first()
+            super().save(*args, **kwargs)
+            # Post the change in what the member owes to their ledger
+            post_entries(fine_entries(self, previous))
+            if is_new:
+                record_event(
+                    'fine_issued',
+                    user=self.user,
+                    borrow_transaction=self.borrow_transaction,
+                    amount=self.amount,
+                    fine_id=self.id,
+                    fine_type=self.fine_type.name,
+                )
 
 class FinePayment(models.Model):
     PAYMENT_METHOD_CHOICES = [
@@ -106,19 +154,25 @@ class FinePayment(models.Model):
     
     class Meta:
         ordering = ['-payment_date']
+        indexes = [
+            models.Index(fields=['payment_date', 'payment_method'], name='payment_date_method_idx'),
+            models.Index(fields=['transaction_id'], name='payment_transaction_idx'),
+        ]
     
     def __str__(self):
         return f"Payment ${self.amount} for {self.fine}"
     
     def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self._save_and_apply(*args, **kwargs)
+    
+    def _save_and_apply(self, *args, **kwargs):
+        from borrowing.events import record_event
+        
+        is_new = self.pk is None
         if not self.receipt_number:
-            # Generate receipt number
-            last_payment = FinePayment.objects.order_by('id').last()
-            if last_payment:
-                last_number = int(last_payment.receipt_number.replace('RCP', ''))
-                self.receipt_number = f"RCP{last_number + 1:06d}"
-            else:
-                self.receipt_number = "RCP000001"
+            from accounts.sequences import next_value
+            self.receipt_number = next_value('receipt')
         
         super().save(*args, **kwargs)
         
@@ -126,7 +180,68 @@ class FinePayment(models.Model):
         self.fine.amount_paid = self.fine.payments.aggregate(
             total=models.Sum('amount')
         )['total'] or Decimal('0.00')
+        # Lets the fine's ledger entry point back at this payment
+        self.fine._ledger_payment = self
         self.fine.save()
+        
+        if is_new:
+            record_event(
+                'payment',
+                user=self.fine.user,
+                borrow_transaction=self.fine.borrow_transaction,
+                amount=self.amount,
+                fine_id=self.fine_id,
+                payment_method=self.payment_method,
+                receipt_number=self.receipt_number,
+            )
+
+class FineAccount(models.Model):
+    """
+    Materialized totals of a member's fine ledger, updated in the same
+    transaction as every ledger entry so balance checks are one primary-key read.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='fine_account'
+    )
+    outstanding_balance = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    total_fined = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    total_paid = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    total_waived = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.user.username} owes ${self.outstanding_balance}"
+
+class FineLedgerEntry(models.Model):
+    ENTRY_TYPE_CHOICES = [
+        ('fine_issued', 'Fine Issued'),
+        ('payment', 'Payment'),
+        ('waiver', 'Waiver'),
+        ('adjustment', 'Adjustment'),
+    ]
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='fine_ledger')
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPE_CHOICES)
+    # Positive amounts add to what the member owes, negative ones settle it
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    balance_after = models.DecimalField(max_digits=12, decimal_places=2)
+    fine = models.ForeignKey(Fine, on_delete=models.SET_NULL, blank=True, null=True, related_name='ledger_entries')
+    payment = models.ForeignKey(FinePayment, on_delete=models.SET_NULL, blank=True, null=True, related_name='ledger_entries')
+    description = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['user', '-id'], name='fine_ledger_user_idx'),
+        ]
+        verbose_name_plural = 'Fine ledger entries'
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.get_entry_type_display()} {self.amount}"
 
 class MembershipFee(models.Model):
     FEE_TYPE_CHOICES = [
@@ -166,6 +281,12 @@ class MembershipFee(models.Model):
     
     class Meta:
         ordering = ['-issued_date']
+        indexes = [
+            # The billing run looks up a member's invoice for a period by its start
+            models.Index(fields=['user', 'valid_from'], name='membership_fee_period_idx'),
+            models.Index(fields=['paid_date', 'payment_method'], name='membership_fee_paid_idx'),
+            models.Index(fields=['transaction_id'], name='membership_fee_transaction_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.get_fee_type_display()} - ${self.amount}"
@@ -221,5 +342,43 @@ class PriorityReservationFee(models.Model):
     transaction_id = models.CharField(max_length=100, blank=True)
     notes = models.TextField(blank=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['paid_date', 'payment_method'], name='priority_fee_paid_idx'),
+            models.Index(fields=['transaction_id'], name='priority_fee_transaction_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.user.username} - Priority Fee for {self.reservation.book.title}"
+
+class PaymentRollup(models.Model):
+    """
+    Money taken per day, source, payment method and staff member, for
+    reconciliation. Kept up to date as payments are written; past days can
+    be recomputed from the payment tables by ``rebuild_payment_rollups``.
+    """
+    SOURCE_CHOICES = [
+        ('fine', 'Fine Payment'),
+        ('membership', 'Membership Fee'),
+        ('priority', 'Priority Reservation Fee'),
+    ]
+    
+    date = models.DateField()
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    payment_method = models.CharField(max_length=20, choices=FinePayment.PAYMENT_METHOD_CHOICES)
+    processed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, 
+        on_delete=models.SET_NULL, 
+        blank=True, 
+        null=True, 
+        related_name='payment_rollups'
+    )
+    payments = models.PositiveIntegerField(default=0)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    
+    class Meta:
+        ordering = ['-date', 'source', 'payment_method']
+        unique_together = [['date', 'source', 'payment_method', 'processed_by']]
+    
+    def __str__(self):
+        return f"{self.date} {self.get_source_display()} {self.get_payment_method_display()}: {self.amount}"
@@ -0,0 +1,91 @@
+"""
+PDF rendering for receipts and statements.
+
+Runs inside worker processes, so it works from plain, picklable document
+dicts and deliberately imports nothing from Django.
+"""
+import hashlib
+import json
+import os
+import tempfile
+from io import BytesIO
+from xml.sax.saxutils import escape
+
+# Bump when the layout changes so cached PDFs are rebuilt
+LAYOUT_VERSION = 1
+
+
+def content_hash(document):
+    payload = json.dumps([LAYOUT_VERSION, document], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def cache_path(cache_dir, digest):
+    return os.path.join(cache_dir, digest[:2], f'{digest}.pdf')
+
+
+def render_to_cache(document, cache_dir):
+    """
+    Renders ``document`` unless a PDF with the same content hash is already
+    cached, and returns the cached file's path. Files are written under a
+    temporary name and renamed, so readers never see a partial PDF.
+    """
+    path = cache_path(cache_dir, content_hash(document))
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data = render(document)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp:
+        tmp.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def render(document):
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    styles = getSampleStyleSheet()
+    buffer = BytesIO()
+    pdf = SimpleDocTemplate(
+        buffer, pagesize=A4, title=document['title'],
+        leftMargin=18 * mm, rightMargin=18 * mm, topMargin=18 * mm, bottomMargin=18 * mm,
+    )
+
+    story = [
+        Paragraph(escape(document['library']), styles['Title']),
+        Paragraph(escape(document['title']), styles['Heading2']),
+        Spacer(1, 4 * mm),
+    ]
+    details = Table([[label, value] for label, value in document['details']], colWidths=[45 * mm, None])
+    details.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+    ]))
+    story += [details, Spacer(1, 6 * mm)]
+
+    for section in document.get('tables', []):
+        story.append(Paragraph(escape(section['heading']), styles['Heading3']))
+        rows = [section['columns']] + section['rows']
+        if not section['rows']:
+            rows.append(['No entries'] + [''] * (len(section['columns']) - 1))
+        table = Table(rows, repeatRows=1, hAlign='LEFT')
+        table.setStyle(TableStyle([
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 9),
+            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+            ('LINEBELOW', (0, 0), (-1, 0), 0.5, colors.grey),
+            ('ALIGN', (-2, 1), (-1, -1), 'RIGHT'),
+        ]))
+        story += [table, Spacer(1, 6 * mm)]
+
+    for line in document.get('footer', []):
+        story.append(Paragraph(escape(line), styles['Normal']))
+
+    pdf.build(story)
+    return buffer.getvalue()
@@ -0,0 +1,218 @@
+import csv
+from collections import defaultdict, namedtuple
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import FinePayment, MembershipFee, PaymentRollup, PriorityReservationFee
+
+ZERO = Decimal('0.00')
+
+# Where each kind of payment lives: queryset of settled rows and its payment time field
+SOURCES = {
+    'fine': (FinePayment.objects.all, 'payment_date'),
+    'membership': (lambda: MembershipFee.objects.filter(status='paid'), 'paid_date'),
+    'priority': (PriorityReservationFee.objects.all, 'paid_date'),
+}
+
+
+def _aware(day):
+    return timezone.make_aware(datetime.combine(day, time.min), timezone.get_current_timezone())
+
+
+# Live rollup maintenance
+
+def add_payments(source, payments):
+    """
+    Adds settled ``payments`` (FinePayment, MembershipFee or
+    PriorityReservationFee instances of one ``source``) to the day's rollup
+    rows with one ``F()`` UPDATE per row touched. Call it in the transaction
+    that writes the payments.
+    """
+    time_field = SOURCES[source][1]
+    deltas = defaultdict(lambda: [0, ZERO])
+    for payment in payments:
+        paid_at = getattr(payment, time_field) or timezone.now()
+        key = (timezone.localdate(paid_at), payment.payment_method, payment.processed_by_id)
+        deltas[key][0] += 1
+        deltas[key][1] += Decimal(str(payment.amount))
+
+    for (day, payment_method, processed_by_id), (count, amount) in deltas.items():
+        lookup = {'date': day, 'source': source, 'payment_method': payment_method, 'processed_by_id': processed_by_id}
+        increment = {'payments': F('payments') + count, 'amount': F('amount') + amount}
+        if PaymentRollup.objects.filter(**lookup).update(**increment):
+            continue
+        try:
+            with transaction.atomic():
+                PaymentRollup.objects.create(payments=count, amount=amount, **lookup)
+        except IntegrityError:
+            # Created by a concurrent payment in the meantime
+            PaymentRollup.objects.filter(**lookup).update(**increment)
+
+
+@receiver(post_save, sender=FinePayment)
+def _fine_payment_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        add_payments('fine', [instance])
+
+
+@receiver(post_save, sender=PriorityReservationFee)
+def _priority_fee_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        add_payments('priority', [instance])
+
+
+# Rebuilding days from the payment tables
+
+def rebuild_rollups(start, end=None):
+    """
+    Recomputes the rollup rows for local dates in [start, end) from the
+    payment tables with one grouped query per source and month. Use it to
+    backfill and after payments are edited or deleted by hand.
+    Returns the number of rollup rows written.
+    """
+    end = end or timezone.localdate() + timedelta(days=1)
+    written = 0
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min((chunk_start.replace(day=1) + timedelta(days=32)).replace(day=1), end)
+        rows = []
+        for source, (queryset, time_field) in SOURCES.items():
+            grouped = queryset().filter(**{
+                f'{time_field}__gte': _aware(chunk_start), f'{time_field}__lt': _aware(chunk_end),
+            }).order_by().values(
+                'payment_method', 'processed_by_id', day=TruncDate(time_field),
+            ).annotate(payments=Count('id'), total=Sum('amount'))
+            rows += [
+                PaymentRollup(
+                    date=row['day'], source=source, payment_method=row['payment_method'],
+                    processed_by_id=row['processed_by_id'], payments=row['payments'], amount=row['total'],
+                )
+                for row in grouped
+            ]
+        with transaction.atomic():
+            PaymentRollup.objects.filter(date__gte=chunk_start, date__lt=chunk_end).delete()
+            PaymentRollup.objects.bulk_create(rows)
+        written += len(rows)
+        chunk_start = chunk_end
+    return written
+
+
+def daily_totals(start, end, **filters):
+    """Takings per date, source and payment method for local dates in [start, end]."""
+    return PaymentRollup.objects.filter(date__gte=start, date__lte=end, **filters).values(
+        'date', 'source', 'payment_method'
+    ).annotate(payments=Sum('payments'), total=Sum('amount')).order_by('date', 'source', 'payment_method')
+
+
+# Matching settlement files
+
+SettlementRow = namedtuple('SettlementRow', 'line transaction_id amount date')
+LedgerRow = namedtuple('LedgerRow', 'source pk transaction_id amount paid_at payment_method')
+
+
+def read_settlement_file(stream, id_column='transaction_id', amount_column='amount', date_column='date'):
+    """
+    Parses a bank or card settlement CSV into SettlementRow tuples. Column
+    names are matched case-insensitively; dates are ISO formatted.
+    Raises ValueError naming the line of the first unreadable row.
+    """
+    reader = csv.DictReader(stream)
+    columns = {name.strip().lower(): name for name in reader.fieldnames or []}
+    missing = [name for name in (id_column, amount_column, date_column) if name.lower() not in columns]
+    if missing:
+        raise ValueError(f"Settlement file has no {', '.join(missing)} column")
+    id_key, amount_key, date_key = (columns[name.lower()] for name in (id_column, amount_column, date_column))
+
+    rows = []
+    for line, record in enumerate(reader, start=2):
+        try:
+            rows.append(SettlementRow(
+                line=line,
+                transaction_id=record[id_key].strip(),
+                amount=Decimal(record[amount_key].strip().replace(',', '')),
+                date=date.fromisoformat(record[date_key].strip()[:10]),
+            ))
+        except (InvalidOperation, ValueError, AttributeError) as exc:
+            raise ValueError(f'Line {line}: {exc}') from exc
+    return rows
+
+
+def ledger_rows(start, end, payment_methods):
+    """
+    Payments taken with ``payment_methods`` on local dates in [start, end],
+    across every source, read as plain tuples with one query per source.
+    """
+    for source, (queryset, time_field) in SOURCES.items():
+        values = queryset().filter(**{
+            f'{time_field}__gte': _aware(start),
+            f'{time_field}__lt': _aware(end + timedelta(days=1)),
+            'payment_method__in': payment_methods,
+        }).order_by().values_list('pk', 'transaction_id', 'amount', time_field, 'payment_method')
+        for pk, transaction_id, amount, paid_at, payment_method in values.iterator(chunk_size=5000):
+            yield LedgerRow(source, pk, transaction_id.strip(), amount, paid_at, payment_method)
+
+
+def match(settlement, ledger):
+    """
+    Hash join of ``settlement`` rows against ``ledger`` rows on
+    transaction_id. The ledger side is indexed in a dict and the settlement
+    rows are probed against it, so the cost is linear in both. Duplicate ids
+    pair up in order.
+
+    Returns a dict of ``matched`` and ``amount_mismatches`` (lists of
+    ``(settlement_row, ledger_row)``), and ``unmatched_settlement`` and
+    ``unmatched_ledger`` lists.
+    """
+    index = defaultdict(list)
+    unmatched_ledger = []
+    for row in ledger:
+        if row.transaction_id:
+            index[row.transaction_id].append(row)
+        else:
+            # Nothing a processor could have reported it under
+            unmatched_ledger.append(row)
+    for rows in index.values():
+        rows.reverse()
+
+    matched, mismatches, unmatched_settlement = [], [], []
+    for row in settlement:
+        candidates = index.get(row.transaction_id)
+        if not candidates:
+            unmatched_settlement.append(row)
+            continue
+        ours = candidates.pop()
+        (matched if ours.amount == row.amount else mismatches).append((row, ours))
+
+    for rows in index.values():
+        unmatched_ledger.extend(reversed(rows))
+    return {
+        'matched': matched,
+        'amount_mismatches': mismatches,
+        'unmatched_settlement': unmatched_settlement,
+        'unmatched_ledger': unmatched_ledger,
+    }
+
+
+def reconcile(settlement, payment_methods, slack_days=3):
+    """
+    Matches parsed ``settlement`` rows against our payments taken with
+    ``payment_methods``. The ledger side covers the file's dates widened by
+    ``slack_days`` either way, since processors settle a few days late.
+    """
+    if not settlement:
+        return match([], [])
+    first, last = min(row.date for row in settlement), max(row.date for row in settlement)
+    slack = timedelta(days=slack_days)
+    result = match(settlement, ledger_rows(first - slack, last + slack, payment_methods))
+    # Payments in the slack margin only count if the file reports them
+    result['unmatched_ledger'] = [
+        row for row in result['unmatched_ledger'] if first <= timezone.localdate(row.paid_at) <= last
+    ]
+    return result
@@ -0,0 +1,180 @@
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Fine, FinePayment
+
+# Bumped on every fine or payment write so cached snapshots are never served
+# stale. Other processes only see the bump through a shared cache; with the
+# default per-process cache their snapshots can lag by up to SNAPSHOT_TIMEOUT.
+VERSION_CACHE_KEY = 'fines:report_version'
+SNAPSHOT_TIMEOUT = 5 * 60
+
+ZERO = Decimal('0.00')
+
+
+def invalidate():
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 1, None)
+
+
+def invalidate_on_commit():
+    # Invalidating before commit would let a concurrent request cache the old figures
+    transaction.on_commit(invalidate)
+
+
+@receiver(post_save, sender=Fine)
+@receiver(post_delete, sender=Fine)
+@receiver(post_save, sender=FinePayment)
+@receiver(post_delete, sender=FinePayment)
+def _fines_changed(sender, **kwargs):
+    invalidate_on_commit()
+
+
+def _bounds(start, end):
+    tz = timezone.get_current_timezone()
+    bounds = {}
+    if start:
+        bounds['gte'] = timezone.make_aware(datetime.combine(start, time.min), tz)
+    if end:
+        bounds['lt'] = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz)
+    return bounds
+
+
+def _in_range(field, start, end):
+    return Q(**{f'{field}__{lookup}': value for lookup, value in _bounds(start, end).items()})
+
+
+def _month_key(value):
+    if isinstance(value, datetime):
+        value = timezone.localtime(value) if timezone.is_aware(value) else value
+        value = value.date()
+    return value.replace(day=1)
+
+
+def _months(start, end):
+    month = start.replace(day=1)
+    while month <= end:
+        yield month
+        month = (month + timedelta(days=32)).replace(day=1)
+
+
+def compute_report(start=None, end=None):
+    """
+    Fine figures for local dates in [start, end] (open-ended when None).
+
+    Each source table is read in one grouped pass: fines by month of issue
+    with a conditional count and sum per status, and payments by month with
+    a conditional sum per method. Status and method breakdowns are the sums
+    of those monthly rows, and the issued-versus-collected series is their
+    per-month totals.
+    """
+    statuses = [status for status, _ in Fine.STATUS_CHOICES]
+    methods = [method for method, _ in FinePayment.PAYMENT_METHOD_CHOICES]
+
+    fine_aggregates = {'fines': Count('id'), 'issued': Sum('amount'), 'paid': Sum('amount_paid')}
+    for status in statuses:
+        fine_aggregates[f'n_{status}'] = Count('id', filter=Q(status=status))
+        fine_aggregates[f'sum_{status}'] = Sum('amount', filter=Q(status=status))
+    fine_aggregates['outstanding'] = Sum(
+        F('amount') - F('amount_paid'), filter=~Q(status='waived') & Q(amount_paid__lt=F('amount'))
+    )
+    fine_rows = Fine.objects.filter(_in_range('issued_date', start, end)).order_by().annotate(
+        month=TruncMonth('issued_date')
+    ).values('month').annotate(**fine_aggregates)
+
+    payment_aggregates = {'payments': Count('id'), 'collected': Sum('amount')}
+    for method in methods:
+        payment_aggregates[f'n_{method}'] = Count('id', filter=Q(payment_method=method))
+        payment_aggregates[f'sum_{method}'] = Sum('amount', filter=Q(payment_method=method))
+    payment_rows = FinePayment.objects.filter(_in_range('payment_date', start, end)).order_by().annotate(
+        month=TruncMonth('payment_date')
+    ).values('month').annotate(**payment_aggregates)
+
+    by_status = {status: {'count': 0, 'amount': ZERO} for status in statuses}
+    by_method = {method: {'count': 0, 'amount': ZERO} for method in methods}
+    totals = {'fines': 0, 'issued': ZERO, 'paid': ZERO, 'outstanding': ZERO, 'payments': 0, 'collected': ZERO}
+    series = {}
+
+    for row in fine_rows:
+        for status in statuses:
+            by_status[status]['count'] += row[f'n_{status}']
+            by_status[status]['amount'] += row[f'sum_{status}'] or ZERO
+        for field in ('fines', 'issued', 'paid', 'outstanding'):
+            totals[field] += row[field] or 0
+        month = series.setdefault(_month_key(row['month']), {'issued': ZERO, 'collected': ZERO, 'fines': 0})
+        month['issued'] += row['issued'] or ZERO
+        month['fines'] += row['fines']
+
+    for row in payment_rows:
+        for method in methods:
+            by_method[method]['count'] += row[f'n_{method}']
+            by_method[method]['amount'] += row[f'sum_{method}'] or ZERO
+        totals['payments'] += row['payments']
+        totals['collected'] += row['collected'] or ZERO
+        month = series.setdefault(_month_key(row['month']), {'issued': ZERO, 'collected': ZERO, 'fines': 0})
+        month['collected'] += row['collected'] or ZERO
+
+    # Months without activity still appear in a bounded range
+    if series or (start and end):
+        first = start or min(series)
+        last = end or max(series)
+        for month in _months(first, last):
+            series.setdefault(month, {'issued': ZERO, 'collected': ZERO, 'fines': 0})
+
+    return {
+        'start': start,
+        'end': end,
+        'statuses': [
+            {'status': status, 'label': label, **by_status[status]} for status, label in Fine.STATUS_CHOICES
+        ],
+        'status_counts': {status: values['count'] for status, values in by_status.items()},
+        'methods': [
+            {'method': method, 'label': label, **by_method[method]}
+            for method, label in FinePayment.PAYMENT_METHOD_CHOICES if by_method[method]['count']
+        ],
+        'totals': totals,
+        'series': [{'month': month, **values} for month, values in sorted(series.items())],
+        'generated_at': timezone.now(),
+    }
+
+
+def fine_report(start=None, end=None):
+    """``compute_report`` served from a short-lived cached snapshot."""
+    key = f'fines:report:{cache.get(VERSION_CACHE_KEY, 0)}:{start}:{end}'
+    report = cache.get(key)
+    if report is None:
+        report = compute_report(start, end)
+        cache.set(key, report, SNAPSHOT_TIMEOUT)
+    return report
+
+
+def default_range(today=None):
+    """The last twelve months, from the first of the month eleven months ago to today."""
+    today = today or timezone.localdate()
+    start = today.replace(day=1)
+    for _ in range(11):
+        start = (start - timedelta(days=1)).replace(day=1)
+    return start, today
+
+
+def parse_range(params, today=None):
+    """``(start, end)`` from ``start``/``end`` YYYY-MM-DD query parameters, else the default range."""
+    default_start, default_end = default_range(today)
+    try:
+        start = date.fromisoformat(params.get('start') or default_start.isoformat())
+        end = date.fromisoformat(params.get('end') or default_end.isoformat())
+    except ValueError:
+        return default_start, default_end
+    if start > end:
+        start, end = end, start
+    return start, end
@@ -0,0 +1,117 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, CharField, F, Value, When
+from django.utils import timezone
+
+from accounts import audit
+from accounts.sequences import allocate
+from borrowing.events import record_events
+from .ledger import post_entries
+from .reconciliation import add_payments
+from .models import Fine, FineLedgerEntry, FinePayment, MembershipFee
+from .reports import invalidate_on_commit
+
+OUTSTANDING_FEE_STATUSES = ['pending', 'overdue']
+
+
+def outstanding_fines(user):
+    """Fines with something left to pay, with their remaining ``balance`` annotated."""
+    return Fine.objects.filter(user=user, amount_paid__lt=F('amount')).exclude(
+        status='waived'
+    ).annotate(balance=F('amount') - F('amount_paid')).order_by('issued_date', 'id')
+
+
+def outstanding_membership_fees(user):
+    return MembershipFee.objects.filter(user=user, status__in=OUTSTANDING_FEE_STATUSES).order_by('due_date', 'id')
+
+
+def settle_outstanding(user, payment_method, processed_by=None, now=None):
+    """
+    Pays every outstanding fine and membership fee of ``user`` in one
+    transaction. Receipt numbers come from one sequence allocation, payments
+    are bulk-inserted and fines are settled with a single ``F()`` UPDATE, so
+    the query count does not grow with the number of items.
+
+    Returns a dict with the ``fines`` and ``membership_fees`` settled, the
+    ``total`` charged and the ``receipts`` issued.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        fines = list(
+            outstanding_fines(user).select_for_update(of=('self',))
+            .select_related('borrow_transaction__book_copy')
+        )
+        fees = list(outstanding_membership_fees(user).select_for_update())
+        receipts = allocate('receipt', len(fines) + len(fees)) if fines or fees else []
+        fine_receipts, fee_receipts = receipts[:len(fines)], receipts[len(fines):]
+
+        payments = FinePayment.objects.bulk_create([
+            FinePayment(
+                fine=fine,
+                amount=fine.balance,
+                payment_method=payment_method,
+                processed_by=processed_by,
+                receipt_number=receipt,
+                notes='Settled with all outstanding items',
+            )
+            for fine, receipt in zip(fines, fine_receipts)
+        ])
+        if payments and payments[0].pk is None:
+            # Backends that don't return ids from bulk inserts
+            by_receipt = FinePayment.objects.in_bulk(fine_receipts, field_name='receipt_number')
+            payments = [by_receipt[receipt] for receipt in fine_receipts]
+
+        Fine.objects.filter(pk__in=[fine.pk for fine in fines]).update(
+            amount_paid=F('amount'), status='paid'
+        )
+        if fees:
+            MembershipFee.objects.filter(pk__in=[fee.pk for fee in fees]).update(
+                status='paid',
+                paid_date=now,
+                payment_method=payment_method,
+                processed_by=processed_by,
+                transaction_id=Case(
+                    *[When(pk=fee.pk, then=Value(receipt)) for fee, receipt in zip(fees, fee_receipts)],
+                    output_field=CharField(),
+                ),
+            )
+            for fee, receipt in zip(fees, fee_receipts):
+                fee.status, fee.paid_date, fee.transaction_id = 'paid', now, receipt
+                fee.payment_method, fee.processed_by = payment_method, processed_by
+        # Bulk writes skip the post_save receivers that keep the rollups current
+        add_payments('fine', payments)
+        add_payments('membership', fees)
+
+        post_entries([
+            FineLedgerEntry(user_id=user.pk, fine=fine, payment=payment, entry_type='payment', amount=-fine.balance)
+            for fine, payment in zip(fines, payments)
+        ])
+        record_events('payment', [
+            {
+                'user': user,
+                'borrow_transaction': fine.borrow_transaction,
+                'amount': fine.balance,
+                'occurred_at': now,
+                'fine_id': fine.pk,
+                'payment_method': payment_method,
+                'receipt_number': payment.receipt_number,
+            }
+            for fine, payment in zip(fines, payments)
+        ])
+        if fines:
+            # Bulk writes skip the signals that expire report snapshots
+            invalidate_on_commit()
+        if fines or fees:
+            # The bulk-created payment events skip the per-payment audit hook
+            audit.record_on_commit(
+                'fine_paid', user, 'Settled all outstanding items',
+                fines=len(fines), membership_fees=len(fees), receipts=receipts, payment_method=payment_method,
+            )
+
+    return {
+        'fines': fines,
+        'membership_fees': fees,
+        'total': sum((fine.balance for fine in fines), Decimal('0.00')) + sum((fee.amount for fee in fees), Decimal('0.00')),
+        'receipts': receipts,
+    }
@@ -1,3 +1,371 @@
-from django.test import TestCase
+import importlib.util
+import tempfile
+from datetime import date, timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+from decimal import Decimal
+
+from django.contrib.admin.sites import site
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from accounts import audit
+from accounts.models import User
+from borrowing.models import CirculationEvent
+from . import documents, pdf
+from .admin import FineAdmin
+from .ledger import outstanding_balance
+from .reconciliation import LedgerRow, SettlementRow, daily_totals, match, read_settlement_file, rebuild_rollups
+from .reports import compute_report, fine_report
+from .membership import renew_membership, run_billing
+from .models import Fine, FineAccount, FineLedgerEntry, FinePayment, FineType, MembershipFee, MembershipRenewal, PaymentRollup
+from .settlement import settle_outstanding
+
+
+def make_member(username, **kwargs):
+    return User.objects.create_user(
+        username=username, password='pw', email=f'{username}@example.com', user_type='member', **kwargs
+    )
+
+
+def make_fine(user, amount, fine_type=None):
+    return Fine.objects.create(
+        user=user,
+        fine_type=fine_type or FineType.get_overdue_type(),
+        amount=Decimal(amount),
+        due_date=timezone.now() + timedelta(days=30),
+    )
+
+
+class FineLedgerTests(TestCase):
+    def setUp(self):
+        self.member = make_member('reader')
+
+    def entries(self):
+        return list(
+            FineLedgerEntry.objects.filter(user=self.member).order_by('id').values_list('entry_type', 'amount', 'balance_after')
+        )
+
+    def test_new_fine_is_posted(self):
+        make_fine(self.member, '4.50')
+        self.assertEqual(outstanding_balance(self.member), Decimal('4.50'))
+        self.assertEqual(self.entries(), [('fine_issued', Decimal('4.50'), Decimal('4.50'))])
+
+    def test_payment_amount_edit_waiver_and_reinstatement(self):
+        fine = make_fine(self.member, '10.00')
+        FinePayment.objects.create(fine=fine, amount=Decimal('3.00'), payment_method='cash')
+        fine.refresh_from_db()
+        self.assertEqual(fine.status, 'partial')
+        self.assertEqual(outstanding_balance(self.member), Decimal('7.00'))
+
+        fine.amount = Decimal('12.00')
+        fine.save()
+        self.assertEqual(outstanding_balance(self.member), Decimal('9.00'))
+
+        fine.status = 'waived'
+        fine.save()
+        self.assertEqual(outstanding_balance(self.member), Decimal('0.00'))
+
+        fine.status = 'pending'
+        fine.save()
+        self.assertEqual(outstanding_balance(self.member), Decimal('9.00'))
+
+        self.assertEqual(self.entries(), [
+            ('fine_issued', Decimal('10.00'), Decimal('10.00')),
+            ('payment', Decimal('-3.00'), Decimal('7.00')),
+            ('adjustment', Decimal('2.00'), Decimal('9.00')),
+            ('waiver', Decimal('-9.00'), Decimal('0.00')),
+            ('waiver', Decimal('9.00'), Decimal('9.00')),
+        ])
+        account = FineAccount.objects.get(pk=self.member.pk)
+        self.assertEqual(
+            (account.total_fined, account.total_paid, account.total_waived),
+            (Decimal('12.00'), Decimal('3.00'), Decimal('0.00')),
+        )
+
+    def test_saving_unchanged_fine_posts_nothing(self):
+        fine = make_fine(self.member, '2.00')
+        fine.notes = 'Called the member'
+        fine.save()
+        self.assertEqual(len(self.entries()), 1)
+
+    def test_member_without_fines_owes_nothing(self):
+        self.assertEqual(outstanding_balance(self.member), Decimal('0.00'))
+
+
+class FineAdminTests(TestCase):
+    def setUp(self):
+        self.member = make_member('reader')
+        self.request = RequestFactory().post('/')
+        self.request.session = {}
+        self.request._messages = FallbackStorage(self.request)
+
+    def test_waiving_twice_posts_once(self):
+        fine = make_fine(self.member, '6.00')
+        FinePayment.objects.create(fine=fine, amount=Decimal('1.00'), payment_method='cash')
+        admin = FineAdmin(Fine, site)
+
+        admin.waive_fine(self.request, Fine.objects.filter(pk=fine.pk))
+        admin.waive_fine(self.request, Fine.objects.filter(pk=fine.pk))
+
+        self.assertEqual(outstanding_balance(self.member), Decimal('0.00'))
+        self.assertEqual(FineLedgerEntry.objects.filter(entry_type='waiver').count(), 1)
+        self.assertEqual(
+            list(CirculationEvent.objects.filter(event_type='fine_waived').values_list('amount', flat=True)),
+            [Decimal('5.00')],
+        )
+        self.assertEqual([str(message) for message in self.request._messages], ['1 fines waived.', '0 fines waived.'])
+
+
+class SettleOutstandingTests(TestCase):
+    def setUp(self):
+        self.member = make_member('debtor')
+        self.librarian = User.objects.create_user(username='desk', password='pw', user_type='librarian')
+
+    def test_settles_every_item_with_one_receipt_each(self):
+        partly_paid = make_fine(self.member, '5.00')
+        FinePayment.objects.create(fine=partly_paid, amount=Decimal('2.00'), payment_method='cash')
+        make_fine(self.member, '1.25')
+        fee = MembershipFee.objects.create(
+            user=self.member, fee_type='annual', amount=Decimal('50.00'), status='pending',
+            due_date=timezone.now(), valid_from=timezone.now(), valid_until=timezone.now() + timedelta(days=365),
+        )
+
+        result = settle_outstanding(self.member, 'card', processed_by=self.librarian)
+
+        self.assertEqual(len(result['fines']), 2)
+        self.assertEqual(result['membership_fees'], [fee])
+        self.assertEqual(result['total'], Decimal('54.25'))
+        self.assertEqual(len(result['receipts']), 3)
+        self.assertEqual(len(set(result['receipts'])), 3)
+        self.assertEqual(outstanding_balance(self.member), Decimal('0.00'))
+        self.assertFalse(Fine.objects.filter(user=self.member).exclude(status='paid').exists())
+        fee.refresh_from_db()
+        self.assertEqual(fee.status, 'paid')
+        self.assertIn(fee.transaction_id, result['receipts'])
+        receipts = set(FinePayment.objects.filter(notes='Settled with all outstanding items').values_list('receipt_number', flat=True))
+        self.assertEqual(receipts, set(result['receipts']) - {fee.transaction_id})
+
+    def test_nothing_outstanding(self):
+        result = settle_outstanding(self.member, 'cash')
+        self.assertEqual((result['fines'], result['membership_fees'], result['receipts']), ([], [], []))
+        self.assertEqual(result['total'], Decimal('0.00'))
+
+    def test_waived_fines_are_left_alone(self):
+        fine = make_fine(self.member, '3.00')
+        fine.status = 'waived'
+        fine.save()
+        self.assertEqual(settle_outstanding(self.member, 'cash')['fines'], [])
+
+
+class MembershipBillingTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+
+    def auto_renewing_member(self, username, expiry):
+        member = make_member(username, is_active_member=True, membership_expiry=expiry)
+        MembershipRenewal.objects.create(
+            user=member, previous_expiry=expiry - timedelta(days=365), new_expiry=expiry,
+            renewal_fee=Decimal('50.00'), auto_renewal=True,
+        )
+        return member
+
+    def test_rerun_changes_nothing(self):
+        make_member('upcoming', is_active_member=True, membership_expiry=self.now + timedelta(days=10))
+        self.auto_renewing_member('renewing', self.now - timedelta(days=1))
+        make_member('lapsed', is_active_member=True, membership_expiry=self.now - timedelta(days=1))
+
+        first = run_billing(self.now)
+        self.assertEqual(first, {'invoiced': 1, 'renewed': 1, 'overdue': 0, 'deactivated': 1})
+        self.assertEqual(run_billing(self.now), {'invoiced': 0, 'renewed': 0, 'overdue': 0, 'deactivated': 0})
+        self.assertEqual(MembershipFee.objects.count(), 2)
+
+    def test_auto_renewal_invoice_is_not_overdue_at_once(self):
+        member = self.auto_renewing_member('renewing', self.now - timedelta(days=3))
+        run_billing(self.now)
+        invoice = MembershipFee.objects.get(user=member)
+        self.assertEqual(invoice.status, 'pending')
+        self.assertGreater(invoice.due_date, self.now)
+
+    def test_renewal_settles_the_auto_renewal_invoice(self):
+        member = self.auto_renewing_member('renewing', self.now - timedelta(days=3))
+        run_billing(self.now)
+        member.refresh_from_db()
+        expiry = member.membership_expiry
+
+        renewal = renew_membership(member, 'cash', now=self.now)
+
+        self.assertEqual(MembershipFee.objects.filter(user=member).count(), 1)
+        self.assertEqual(MembershipFee.objects.get(user=member).status, 'paid')
+        member.refresh_from_db()
+        self.assertEqual(member.membership_expiry, expiry)
+        self.assertEqual(renewal.new_expiry, expiry)
+
+    def test_renewal_without_invoice_issues_a_fee(self):
+        member = make_member('walkin', is_active_member=True, membership_expiry=self.now + timedelta(days=100))
+        renew_membership(member, 'cash', now=self.now)
+        fee = MembershipFee.objects.get(user=member)
+        self.assertEqual(fee.status, 'paid')
+        member.refresh_from_db()
+        self.assertEqual(member.membership_expiry, self.now + timedelta(days=465))
+
+
+class SettlementMatchTests(SimpleTestCase):
+    def settled(self, transaction_id, amount, line=2):
+        return SettlementRow(line, transaction_id, Decimal(amount), date(2026, 3, 2))
+
+    def ours(self, pk, transaction_id, amount):
+        return LedgerRow('fine', pk, transaction_id, Decimal(amount), None, 'card')
+
+    def test_match(self):
+        settlement = [
+            self.settled('A', '5.00'), self.settled('B', '3.00'), self.settled('C', '1.00'),
+            self.settled('D', '2.00', line=5), self.settled('D', '2.00', line=6),
+        ]
+        ledger = [
+            self.ours(1, 'D', '2.00'), self.ours(2, 'A', '5.00'), self.ours(3, 'B', '3.50'),
+            self.ours(4, '', '9.00'), self.ours(5, 'E', '4.00'), self.ours(6, 'D', '2.00'),
+        ]
+
+        result = match(settlement, ledger)
+
+        self.assertEqual(
+            [(row.transaction_id, ours.pk) for row, ours in result['matched']], [('A', 2), ('D', 1), ('D', 6)]
+        )
+        self.assertEqual([(row.line, ours.pk) for row, ours in result['matched'][1:]], [(5, 1), (6, 6)])
+        self.assertEqual([(row.transaction_id, ours.pk) for row, ours in result['amount_mismatches']], [('B', 3)])
+        self.assertEqual(result['unmatched_settlement'], [settlement[2]])
+        self.assertEqual([row.pk for row in result['unmatched_ledger']], [4, 5])
+
+    def test_every_row_lands_in_one_list(self):
+        settlement = [self.settled('X', '1.00')] * 3
+        ledger = [self.ours(1, 'X', '1.00')]
+        result = match(settlement, ledger)
+        self.assertEqual((len(result['matched']), len(result['unmatched_settlement'])), (1, 2))
+        self.assertEqual(result['unmatched_ledger'], [])
+
+    def test_read_settlement_file(self):
+        rows = read_settlement_file(StringIO('Transaction_ID,Amount,Date\n TX1 ,"1,250.00",2026-03-02T10:00\n'))
+        self.assertEqual(rows, [SettlementRow(2, 'TX1', Decimal('1250.00'), date(2026, 3, 2))])
+        with self.assertRaisesMessage(ValueError, 'Line 3'):
+            read_settlement_file(StringIO('transaction_id,amount,date\nTX1,1.00,2026-03-02\nTX2,lots,2026-03-02\n'))
+        with self.assertRaisesMessage(ValueError, 'no date column'):
+            read_settlement_file(StringIO('transaction_id,amount\n'))
+
+
+class PaymentRollupTests(TestCase):
+    def test_live_rollups_match_a_rebuild(self):
+        member = make_member('reader')
+        for amount, method in [('1.00', 'cash'), ('2.50', 'cash'), ('4.00', 'card')]:
+            FinePayment.objects.create(fine=make_fine(member, amount), amount=Decimal(amount), payment_method=method)
+        today = timezone.localdate()
+
+        live = list(daily_totals(today, today))
+        self.assertEqual(
+            [(row['payment_method'], row['payments'], row['total']) for row in live],
+            [('card', 1, Decimal('4.00')), ('cash', 2, Decimal('3.50'))],
+        )
+        PaymentRollup.objects.update(payments=0)
+        self.assertEqual(rebuild_rollups(today), 2)
+        self.assertEqual(list(daily_totals(today, today)), live)
+
+
+class FineReportTests(TestCase):
+    def setUp(self):
+        # Payments are audited once they commit; keep the flusher thread from
+        # writing through its own connection while the test transaction is open
+        patcher = mock.patch.object(audit, '_start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(audit._pending.clear)
+
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.member = make_member('reader')
+
+    def test_one_pass_figures_match_the_rows(self):
+        paid = make_fine(self.member, '4.00')
+        FinePayment.objects.create(fine=paid, amount=Decimal('4.00'), payment_method='cash')
+        partial = make_fine(self.member, '6.00')
+        FinePayment.objects.create(fine=partial, amount=Decimal('1.50'), payment_method='card')
+        waived = make_fine(self.member, '2.00')
+        waived.status = 'waived'
+        waived.save()
+
+        report = compute_report()
+
+        self.assertEqual(report['status_counts'], {
+            status: Fine.objects.filter(status=status).count() for status, _ in Fine.STATUS_CHOICES
+        })
+        self.assertEqual(report['totals'], {
+            'fines': 3, 'issued': Decimal('12.00'), 'paid': Decimal('5.50'), 'outstanding': Decimal('4.50'),
+            'payments': 2, 'collected': Decimal('5.50'),
+        })
+        self.assertEqual(
+            {row['method']: row['amount'] for row in report['methods']},
+            {'cash': Decimal('4.00'), 'card': Decimal('1.50')},
+        )
+        self.assertEqual(sum(month['issued'] for month in report['series']), Decimal('12.00'))
+
+    def test_bounded_range_lists_every_month(self):
+        today = timezone.localdate()
+        start = (today.replace(day=1) - timedelta(days=60)).replace(day=1)
+        report = compute_report(start, today)
+        self.assertEqual(len(report['series']), 3)
+        self.assertEqual(report['totals']['fines'], 0)
+
+    def test_snapshot_is_replaced_after_a_payment(self):
+        fine = make_fine(self.member, '5.00')
+        first = fine_report()
+        self.assertEqual(fine_report()['generated_at'], first['generated_at'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            FinePayment.objects.create(fine=fine, amount=Decimal('5.00'), payment_method='cash')
+        self.assertEqual(fine_report()['totals']['collected'], Decimal('5.00'))
+
+
+class StatementDocumentTests(TestCase):
+    def setUp(self):
+        self.member = make_member('reader')
+        self.year = timezone.localdate().year
+
+    def test_statement_with_opening_balance(self):
+        old = make_fine(self.member, '3.00')
+        FineLedgerEntry.objects.filter(fine=old).update(created_at=timezone.now().replace(year=self.year - 1))
+        fine = make_fine(self.member, '5.00')
+        FinePayment.objects.create(fine=fine, amount=Decimal('2.00'), payment_method='cash')
+        others = [make_member(f'other{n}') for n in range(3)]
+
+        with self.assertNumQueries(4):
+            statements = {
+                user.pk: document for user, document in documents.statement_documents([self.member, *others], self.year)
+            }
+
+        details = dict(statements[self.member.pk]['details'])
+        self.assertEqual(details['Opening balance'], '$3.00')
+        self.assertEqual(details['Fines issued'], '$5.00')
+        self.assertEqual(details['Payments'], '$2.00')
+        self.assertEqual(details['Closing balance'], '$6.00')
+        self.assertEqual(len(statements[self.member.pk]['tables'][0]['rows']), 2)
+        self.assertEqual(dict(statements[others[0].pk]['details'])['Closing balance'], '$0.00')
+
+    def test_rendered_pdfs_are_cached_by_content(self):
+        document = documents.payment_receipt(
+            FinePayment.objects.create(fine=make_fine(self.member, '1.00'), amount=Decimal('1.00'), payment_method='cash')
+        )
+        with tempfile.TemporaryDirectory() as cache_dir, override_settings(DOCUMENT_CACHE_DIR=cache_dir), \
+                mock.patch.object(pdf, 'render', return_value=b'%PDF-1.4') as render:
+            self.assertIsNone(documents.cached(document))
+            path = pdf.render_to_cache(document, cache_dir)
+            self.assertEqual(pdf.render_to_cache(document, cache_dir), path)
+            self.assertEqual(documents.cached(document), path)
+            self.assertEqual(render.call_count, 1)
+            self.assertNotEqual(pdf.content_hash(document), pdf.content_hash({**document, 'title': 'Other'}))
+
+    @skipUnless(importlib.util.find_spec('reportlab'), 'reportlab is not installed')
+    def test_render(self):
+        document = documents.fine_statement(self.member, self.year, [], Decimal('0.00'), [])
+        self.assertTrue(pdf.render(document).startswith(b'%PDF'))
 
-# Create your tests here.
@@ -8,11 +8,16 @@ urlpatterns = [
     path('', views.FineListView.as_view(), name='fine_list'),
     path('<int:pk>/', views.FineDetailView.as_view(), name='fine_detail'),
     path('pay/<int:pk>/', views.PayFineView.as_view(), name='pay'),
+    path('pay-all/', views.PayAllOutstandingView.as_view(), name='pay_all'),
     path('history/', views.FineHistoryView.as_view(), name='history'),
+    path('statement/', views.FineStatementView.as_view(), name='statement'),
+    path('statement/<int:year>/pdf/', views.StatementPDFView.as_view(), name='statement_pdf'),
+    path('receipt/<int:pk>/', views.PaymentReceiptView.as_view(), name='receipt'),
     
     # Membership fees
     path('membership/', views.MembershipFeeListView.as_view(), name='membership_list'),
     path('membership/pay/<int:pk>/', views.PayMembershipFeeView.as_view(), name='pay_membership'),
+    path('membership/receipt/<int:pk>/', views.MembershipReceiptView.as_view(), name='membership_receipt'),
     path('membership/renew/', views.RenewMembershipView.as_view(), name='renew_membership'),
     
     # Priority reservation fees
@@ -1,11 +1,22 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from django.views.generic import TemplateView, ListView, DetailView
+from django.views.generic import TemplateView, ListView, DetailView, View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
-from django.db.models import Sum, Q
+from django.db import transaction
+from django.db.models import Q
+from django.http import FileResponse, Http404
 from django.utils import timezone
-from .models import Fine, FineType, FinePayment
+from concurrent.futures import TimeoutError
+from decimal import Decimal, InvalidOperation
+from . import documents
+from .ledger import get_account
+from .membership import TERM_DAYS, renew_membership
+from .reports import fine_report, parse_range
+from .settlement import outstanding_fines, outstanding_membership_fees, settle_outstanding
+from .models import Fine, FineType, FinePayment, FineLedgerEntry, MembershipFee
 from accounts.models import User
+from borrowing import stats
+from borrowing.events import record_event
 
 class FineListView(LoginRequiredMixin, ListView):
     model = Fine
@@ -19,10 +30,11 @@ class FineListView(LoginRequiredMixin, ListView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user_fines = Fine.objects.filter(user=self.request.user)
-        context['total_fines'] = user_fines.aggregate(total=Sum('amount'))['total'] or 0
-        context['paid_fines'] = user_fines.filter(status='paid').aggregate(total=Sum('amount_paid'))['total'] or 0
-        context['pending_fines'] = user_fines.filter(status='pending').aggregate(total=Sum('amount'))['total'] or 0
+        account = get_account(self.request.user)
+        context['account'] = account
+        context['total_fines'] = account.total_fined
+        context['paid_fines'] = account.total_paid
+        context['pending_fines'] = account.outstanding_balance
         return context
 
 class FineDetailView(LoginRequiredMixin, DetailView):
@@ -66,10 +78,54 @@ class PayFineView(LoginRequiredMixin, TemplateView):
         fine.amount_paid = fine.amount
         fine.status = 'paid'
         fine.save()
+        # Render the receipt in the background so the download is ready
+        transaction.on_commit(lambda: documents.prerender(documents.payment_receipt(payment)))
         
         messages.success(request, f'Payment of ${payment_amount:.2f} processed successfully!')
         return redirect('fines:fine_list')
 
+class PayAllOutstandingView(LoginRequiredMixin, TemplateView):
+    template_name = 'fines/pay_all_outstanding.html'
+    
+    def get_payment_methods(self):
+        return [choice for choice in FinePayment.PAYMENT_METHOD_CHOICES if choice[0] != 'waived']
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        fines = list(outstanding_fines(self.request.user).select_related('fine_type'))
+        fees = list(outstanding_membership_fees(self.request.user))
+        fines_total = sum((fine.balance for fine in fines), Decimal('0.00'))
+        fees_total = sum((fee.amount for fee in fees), Decimal('0.00'))
+        context.update({
+            'outstanding_fines': fines,
+            'membership_fees': fees,
+            'totals': {
+                'fines': fines_total,
+                'membership': fees_total,
+                'outstanding': fines_total + fees_total,
+            },
+            'payment_methods': self.get_payment_methods(),
+        })
+        return context
+    
+    def post(self, request, *args, **kwargs):
+        payment_method = request.POST.get('payment_method')
+        if payment_method not in dict(self.get_payment_methods()):
+            messages.error(request, 'Please choose a payment method.')
+            return redirect('fines:pay_all')
+        
+        settlement = settle_outstanding(request.user, payment_method, processed_by=request.user)
+        items = len(settlement['fines']) + len(settlement['membership_fees'])
+        if not items:
+            messages.info(request, 'You have nothing outstanding to pay.')
+        else:
+            messages.success(
+                request,
+                f'Payment of MVR {settlement["total"]:.2f} processed for {items} item{"s" if items != 1 else ""}. '
+                f'Receipts: {", ".join(settlement["receipts"])}'
+            )
+        return redirect('fines:fine_list')
+
 class FineHistoryView(LoginRequiredMixin, ListView):
     model = Fine
     template_name = 'fines/payment_history.html'
@@ -79,6 +135,85 @@ class FineHistoryView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         return Fine.objects.filter(user=self.request.user).order_by('-issued_date')
 
+class FineStatementView(LoginRequiredMixin, ListView):
+    model = FineLedgerEntry
+    template_name = 'fines/statement.html'
+    context_object_name = 'entries'
+    paginate_by = 25
+    
+    def get_queryset(self):
+        # Newest first along fine_ledger_user_idx
+        return FineLedgerEntry.objects.filter(user=self.request.user).select_related(
+            'fine__fine_type', 'payment'
+        ).order_by('-id')
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['account'] = get_account(self.request.user)
+        context['statement_year'] = timezone.localdate().year
+        return context
+
+class DocumentDownloadView(LoginRequiredMixin, View):
+    """Serves a rendered PDF, sending the member back while it is still rendering."""
+    redirect_to = 'fines:statement'
+    
+    def get_document(self):
+        raise NotImplementedError
+    
+    def get_filename(self):
+        raise NotImplementedError
+    
+    def get(self, request, *args, **kwargs):
+        document = self.get_document()
+        try:
+            path = documents.render(document, timeout=10)
+        except TimeoutError:
+            messages.info(request, 'Your document is being prepared. Please try again in a moment.')
+            return redirect(self.redirect_to)
+        except ImportError:
+            messages.error(request, 'PDF documents are not available at the moment.')
+            return redirect(self.redirect_to)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=self.get_filename(),
+                            content_type='application/pdf')
+
+class PaymentReceiptView(DocumentDownloadView):
+    
+    def get_document(self):
+        self.payment = get_object_or_404(
+            FinePayment.objects.select_related('fine__user', 'fine__fine_type'), pk=self.kwargs['pk']
+        )
+        # Members get their own receipts; librarians any
+        if self.payment.fine.user_id != self.request.user.pk and not self.request.user.is_librarian:
+            raise Http404
+        return documents.payment_receipt(self.payment)
+    
+    def get_filename(self):
+        return f'receipt-{self.payment.receipt_number}.pdf'
+
+class MembershipReceiptView(DocumentDownloadView):
+    redirect_to = 'fines:membership_list'
+    
+    def get_document(self):
+        fees = MembershipFee.objects.select_related('user').filter(status='paid')
+        if not self.request.user.is_librarian:
+            fees = fees.filter(user=self.request.user)
+        self.fee = get_object_or_404(fees, pk=self.kwargs['pk'])
+        return documents.membership_receipt(self.fee)
+    
+    def get_filename(self):
+        return f'membership-receipt-{self.fee.pk}.pdf'
+
+class StatementPDFView(DocumentDownloadView):
+    
+    def get_document(self):
+        user, year = self.request.user, self.kwargs['year']
+        if not 2000 <= year <= timezone.localdate().year:
+            raise Http404
+        return next(documents.statement_documents([user], year))[1]
+    
+    def get_filename(self):
+        return documents.statement_filename(self.request.user, self.kwargs['year'])
+
 class MembershipFeeListView(LoginRequiredMixin, TemplateView):
     template_name = 'fines/membership.html'
     
@@ -97,16 +232,20 @@ class RenewMembershipView(LoginRequiredMixin, TemplateView):
     template_name = 'fines/membership_renewal.html'
     
     def post(self, request, *args, **kwargs):
-        user = request.user
-        # Simulate membership renewal
-        from datetime import timedelta
-        from django.utils import timezone
+        fee_type = request.POST.get('membership_type')
+        payment_method = request.POST.get('payment_method')
+        if payment_method not in dict(FinePayment.PAYMENT_METHOD_CHOICES) or payment_method == 'waived':
+            payment_method = 'online'
         
-        user.membership_expiry = timezone.now() + timedelta(days=365)
-        user.is_active_member = True
-        user.save()
+        renewal = renew_membership(
+            request.user,
+            payment_method=payment_method,
+            processed_by=request.user,
+            fee_type=fee_type if fee_type in TERM_DAYS else None,
+            auto_renewal=bool(request.POST.get('auto_renewal')),
+        )
         
-        messages.success(request, 'Membership renewed successfully for 1 year!')
+        messages.success(request, f'Membership renewed until {renewal.new_expiry:%B %d, %Y}. Paid ${renewal.renewal_fee:.2f}.')
         return redirect('fines:membership_list')
 
 class PriorityFeeListView(LoginRequiredMixin, TemplateView):
@@ -120,13 +259,14 @@ class FineManageView(LoginRequiredMixin, ListView):
     
     def get_queryset(self):
         # For librarians to manage all fines
-        return Fine.objects.all().order_by('-issued_date')
+        return Fine.objects.select_related('user', 'fine_type').order_by('-issued_date')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['total_fines'] = Fine.objects.aggregate(total=Sum('amount'))['total'] or 0
-        context['pending_fines'] = Fine.objects.filter(status='pending').count()
-        context['paid_fines'] = Fine.objects.filter(status='paid').count()
+        report = fine_report()
+        context['total_fines'] = report['totals']['issued']
+        context['pending_fines'] = report['status_counts']['pending']
+        context['paid_fines'] = report['status_counts']['paid']
         return context
 
 class CreateFineView(LoginRequiredMixin, TemplateView):
@@ -138,6 +278,11 @@ class CreateFineView(LoginRequiredMixin, TemplateView):
         amount = request.POST.get('amount')
         description = request.POST.get('description', '')
         
+        try:
+            amount = Decimal(amount) if amount else None
+        except InvalidOperation:
+            amount = None
+        
         if user_id and fine_type_id and amount:
             user = get_object_or_404(User, pk=user_id)
             fine_type = get_object_or_404(FineType, pk=fine_type_id)
@@ -165,8 +310,16 @@ class WaiveFineView(LoginRequiredMixin, TemplateView):
         fine_id = self.kwargs.get('pk')
         fine = get_object_or_404(Fine, pk=fine_id)
         
-        fine.status = 'waived'
-        fine.save()
+        with transaction.atomic():
+            fine.status = 'waived'
+            fine.save()
+            record_event(
+                'fine_waived',
+                user=fine.user,
+                borrow_transaction=fine.borrow_transaction,
+                amount=fine.amount_remaining,
+                fine_id=fine.id,
+            )
         
         messages.success(request, f'Fine #{fine.id} has been waived successfully')
         return redirect('fines:manage')
@@ -177,15 +330,24 @@ class FineReportsView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Summary statistics
-        context['total_fines'] = Fine.objects.count()
-        context['total_amount'] = Fine.objects.aggregate(total=Sum('amount'))['total'] or 0
-        context['paid_amount'] = Fine.objects.aggregate(total=Sum('amount_paid'))['total'] or 0
-        context['pending_fines'] = Fine.objects.filter(status='pending').count()
-        context['paid_fines'] = Fine.objects.filter(status='paid').count()
-        context['waived_fines'] = Fine.objects.filter(status='waived').count()
+        # Every breakdown for the selected range from one cached snapshot
+        start, end = parse_range(self.request.GET)
+        report = fine_report(start, end)
+        context['report'] = report
+        context['total_fines'] = report['totals']['fines']
+        context['total_amount'] = report['totals']['issued']
+        context['paid_amount'] = report['totals']['paid']
+        context['pending_fines'] = report['status_counts']['pending']
+        context['paid_fines'] = report['status_counts']['paid']
+        context['waived_fines'] = report['status_counts']['waived']
+        
+        # Issued versus collected, every window from one rollup query
+        overview = stats.overview(30)
+        context['fines_30_days'] = overview['last_n_days']
+        context['fines_mtd'] = overview['month_to_date']
+        context['fines_yoy'] = overview['year_over_year']
         
         # Recent fines
-        context['recent_fines'] = Fine.objects.order_by('-issued_date')[:10]
+        context['recent_fines'] = Fine.objects.select_related('user', 'fine_type').order_by('-issued_date')[:10]
         
         return context
@@ -52,6 +52,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.AuditContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -141,6 +142,22 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom user model
 AUTH_USER_MODEL = 'accounts.User'
 
+# Session storage and loading of the logged-in user:
+#   'database' - Django's defaults: session and user rows read on every request
+#   'cache'    - sessions read from the cache, written through to the database
+#   'cookie'   - sessions kept in a signed cookie, no server-side storage
+# Both non-database profiles also serve the user from the cache (see
+# accounts.backends). Switching profiles logs everyone out once.
+SESSION_PROFILE = 'database'
+
+SESSION_PROFILES = {
+    'database': ('django.contrib.sessions.backends.db', 'django.contrib.auth.backends.ModelBackend'),
+    'cache': ('django.contrib.sessions.backends.cached_db', 'accounts.backends.CachedUserBackend'),
+    'cookie': ('django.contrib.sessions.backends.signed_cookies', 'accounts.backends.CachedUserBackend'),
+}
+SESSION_ENGINE, _auth_backend = SESSION_PROFILES[SESSION_PROFILE]
+AUTHENTICATION_BACKENDS = [_auth_backend]
+
 # Login/Logout URLs
 LOGIN_URL = 'accounts:login'
 LOGIN_REDIRECT_URL = '/'
@@ -156,4 +173,30 @@ LIBRARY_SETTINGS = {
     'MAX_RENEWALS': 2,
     'FINE_PER_DAY': 1.00,
     'RESERVATION_EXPIRY_HOURS': 24,
+    'HOLD_QUEUE_EXPIRY_DAYS': 90,
+    'HISTORY_ARCHIVE_AFTER_DAYS': 730,
+    'MAX_OUTSTANDING_FINES': 10.00,  # borrowing is blocked at or above this balance
+    'LIBRARY_NAME': 'Library Management System',
+    'DOCUMENT_WORKERS': 2,  # PDF rendering processes per web process
+    'MEMBERSHIP_FEES': {
+        'annual': 50.00,
+        'monthly': 5.00,
+        'student': 25.00,
+        'senior': 25.00,
+        'family': 80.00,
+    },
+    'MEMBERSHIP_BILLING_DAYS': 30,  # invoice renewals this far ahead of expiry
+    'MEMBERSHIP_PAYMENT_DAYS': 14,  # time to pay an invoice raised by an automatic renewal
+    'AUDIT_BATCH_SIZE': 200,  # audit log entries written per insert
+    'AUDIT_FLUSH_SECONDS': 2.0,  # longest an entry waits in memory before it is written
+    'AUDIT_MAX_PENDING': 10000,
+    'AUDIT_RETENTION_DAYS': 365,  # older audit entries are moved to monthly archive files
+    'EVENT_GAP_SECONDS': 60,  # longest a transaction writing circulation events may stay open
+    'LOAN_POLICY_RECHECK_SECONDS': 30,  # how often each process checks the database for loan policy edits
+    'USER_CACHE_SECONDS': 300,  # lifetime of a cached logged-in user under the cache and cookie profiles
 }
+
+# Rendered receipts and statements, keyed by content hash; not publicly served
+DOCUMENT_CACHE_DIR = BASE_DIR / 'var' / 'documents'
+# Monthly audit log archives written by archive_audit_log
+AUDIT_ARCHIVE_DIR = BASE_DIR / 'var' / 'audit'
@@ -1,8 +1,9 @@
 from django.views.generic import TemplateView
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Count
-from books.models import Book, BookCopy
-from borrowing.models import BorrowTransaction
+from django.db.models import Count, Sum
+from books.models import Book, BookBranchAvailability
+from borrowing import stats
+from borrowing.summaries import get_summary
 from accounts.models import User
 
 class HomeView(TemplateView):
@@ -11,23 +12,24 @@ class HomeView(TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Get dashboard statistics
+        # Get dashboard statistics; copies on the shelf and on loan come from
+        # the availability matrix in one query instead of two counts
+        copies = BookBranchAvailability.objects.aggregate(available=Sum('available'), borrowed=Sum('borrowed'))
         context.update({
             'total_books': Book.objects.filter(is_active=True).count(),
             'total_members': User.objects.filter(user_type='member', is_active_member=True).count(),
-            'available_copies': BookCopy.objects.filter(status='available').count(),
-            'active_borrowings': BorrowTransaction.objects.filter(status='active').count(),
+            'available_copies': copies['available'] or 0,
+            'active_borrowings': copies['borrowed'] or 0,
             'recent_books': Book.objects.filter(is_active=True).order_by('-created_at')[:6],
+            'checkouts_this_month': stats.month_to_date()['checkouts'],
         })
         
         # Add user-specific context if logged in
         if self.request.user.is_authenticated:
+            summary = get_summary(self.request.user)
             context.update({
-                'user_current_borrowings': BorrowTransaction.objects.filter(
-                    user=self.request.user, 
-                    status='active'
-                ).count(),
-                'user_reservations': self.request.user.reservations.filter(status='active').count(),
+                'user_current_borrowings': summary.active_loans,
+                'user_reservations': summary.active_reservations,
             })
         
         return context
\ No newline at end of file